@@ -0,0 +1,782 @@
+from datetime import datetime, timedelta, UTC
+from flask import Flask
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+# Imported up front, with their lazy imports preloaded in __main__, so import time stays out of the timings
+from business_analytics import BusinessAnalytics
+from capital_functions import CapitalFunctions
+from customer_analytics import CustomerAnalytics
+from expenses import Expenses
+from loans import Loans
+from lazy_imports import preload_lazy_modules
+from log_config import configure_logging
+from overview_metrics import OverviewMetrics
+import query_profiler
+
+# Set up logging
+logging.basicConfig(level=logging.ERROR)
+logger = logging.getLogger(__name__)
+
+# Where benchmark runs are appended, one JSON object per line
+DEFAULT_HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'benchmarks.jsonl')
+
+# Modelled network round trip between the app server and Supabase
+DEFAULT_RTT_MS = 20
+
+# Estimated time may grow this much over the previous run before it counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+LOCATIONS = ['Lusaka', 'Ndola', 'Kitwe', 'Kabwe', 'Chingola', 'Livingstone', 'Chipata', 'Kasama', 'Solwezi', 'Mongu']
+OCCUPATIONS = ['Trader', 'Teacher', 'Farmer', 'Nurse', 'Driver', 'Civil Servant', 'Tailor', 'Miner', 'Student']
+LOAN_REASONS = ['School Fees', 'Business', 'Medical', 'Rent', 'Farming', 'Not specified']
+LOAN_STATUSES = ['Active'] * 30 + ['Completed'] * 50 + ['Overdue'] * 15 + ['Default'] * 5
+
+OPERATORS = {
+    'eq': lambda value, target: value == target,
+    'neq': lambda value, target: value != target,
+    'gt': lambda value, target: value is not None and value > target,
+    'gte': lambda value, target: value is not None and value >= target,
+    'lt': lambda value, target: value is not None and value < target,
+    'lte': lambda value, target: value is not None and value <= target,
+    'in': lambda value, target: value in target,
+    'is': lambda value, target: value is target,
+    'like': lambda value, target: value is not None and bool(target.match(str(value))),
+    'ilike': lambda value, target: value is not None and bool(target.match(str(value))),
+}
+
+
+class FakeResponse:
+    """Stands in for the postgrest APIResponse"""
+
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _singular(table: str) -> str:
+    """Returns the foreign-key prefix of a table name, e.g. loans -> loan"""
+    return table[:-1] if table.endswith('s') else table
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Splits a PostgREST select or or_ string on the commas that are not inside parentheses"""
+    parts, depth, current = [], 0, ''
+    for char in text:
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _like_pattern(pattern: str, ignore_case: bool):
+    """Compiles a SQL LIKE pattern into a regular expression"""
+    expression = ''.join('.*' if char in '%*' else '.' if char == '_' else re.escape(char) for char in pattern)
+    return re.compile(f"^{expression}$", (re.IGNORECASE if ignore_case else 0) | re.DOTALL)
+
+
+def _coerce(value: Any, sample: Any) -> Any:
+    """Converts a filter value sent as text to the type of the column it is compared with"""
+    if isinstance(value, str) and isinstance(sample, (int, float)) and not isinstance(sample, bool):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+class FakeQuery:
+    """
+    Records a chain of postgrest query-builder calls and evaluates it against the in-memory tables of a
+    FakeSupabase when executed. Every execute() counts as one round trip.
+    """
+
+    def __init__(self, client: 'FakeSupabase', table: str):
+        self.client = client
+        self.table = table
+        self.method = 'GET'
+        self.columns = '*'
+        self.count_mode = None
+        self.filters = []
+        self.or_groups = []
+        self.orders = []
+        self.row_limit = None
+        self.row_offset = 0
+        self.single_row = False
+        self.payload = None
+        self.upsert_keys = None
+        self.url_parts = []
+
+    def _add(self, column: str, operator: str, target: Any, text: str):
+        self.filters.append((column, operator, target))
+        self.url_parts.append(f"{column}={operator}.{text}")
+        return self
+
+    # Reads and writes
+    def select(self, *columns, count: Optional[str] = None):
+        self.columns = ','.join(columns) if columns else '*'
+        self.count_mode = count
+        self.url_parts.append(f"select={self.columns}")
+        return self
+
+    def insert(self, rows, **kwargs):
+        self.method, self.payload = 'POST', rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = '', ignore_duplicates: bool = False, **kwargs):
+        self.method, self.payload = 'POST', rows
+        self.upsert_keys = ([key.strip() for key in on_conflict.split(',')] if on_conflict else ['id'],
+                            ignore_duplicates)
+        return self
+
+    def update(self, values, **kwargs):
+        self.method, self.payload = 'PATCH', values
+        return self
+
+    def delete(self, **kwargs):
+        self.method = 'DELETE'
+        return self
+
+    # Filters
+    def eq(self, column, value):
+        return self._add(column, 'eq', value, value)
+
+    def neq(self, column, value):
+        return self._add(column, 'neq', value, value)
+
+    def gt(self, column, value):
+        return self._add(column, 'gt', value, value)
+
+    def gte(self, column, value):
+        return self._add(column, 'gte', value, value)
+
+    def lt(self, column, value):
+        return self._add(column, 'lt', value, value)
+
+    def lte(self, column, value):
+        return self._add(column, 'lte', value, value)
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._add(column, 'in', set(values), f"({','.join(str(value) for value in values)})")
+
+    def is_(self, column, value):
+        target = None if value in (None, 'null') else value
+        return self._add(column, 'is', target, 'null' if target is None else value)
+
+    def like(self, column, pattern):
+        return self._add(column, 'like', _like_pattern(pattern, False), pattern)
+
+    def ilike(self, column, pattern):
+        return self._add(column, 'ilike', _like_pattern(pattern, True), pattern)
+
+    def filter(self, column, operator, criteria):
+        if operator in ('like', 'ilike'):
+            return getattr(self, operator)(column, criteria)
+        if operator == 'in':
+            return self.in_(column, criteria.strip('()').split(','))
+        return self._add(column, operator, criteria, criteria)
+
+    def match(self, query: Dict[str, Any]):
+        for column, value in query.items():
+            self.eq(column, value)
+        return self
+
+    def or_(self, filters: str, reference_table: Optional[str] = None):
+        group = []
+        for condition in _split_top_level(filters):
+            column, operator, value = condition.split('.', 2)
+            if operator == 'in':
+                target = set(value.strip('()').split(','))
+            elif operator in ('like', 'ilike'):
+                target = _like_pattern(value, operator == 'ilike')
+            elif operator == 'is':
+                target = None if value == 'null' else value
+            else:
+                target = value
+            group.append((column, operator, target))
+        self.or_groups.append(group)
+        self.url_parts.append(f"or=({filters})")
+        return self
+
+    # Modifiers
+    def order(self, column, desc: bool = False, nullsfirst: bool = False, foreign_table: Optional[str] = None):
+        self.orders.append((column, desc))
+        self.url_parts.append(f"order={column}.{'desc' if desc else 'asc'}")
+        return self
+
+    def limit(self, size: int, foreign_table: Optional[str] = None):
+        self.row_limit = size
+        self.url_parts.append(f"limit={size}")
+        return self
+
+    def offset(self, size: int):
+        self.row_offset = size
+        self.url_parts.append(f"offset={size}")
+        return self
+
+    def range(self, start: int, end: int, foreign_table: Optional[str] = None):
+        self.row_offset, self.row_limit = start, end - start + 1
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    def maybe_single(self):
+        self.single_row = True
+        return self
+
+    # Evaluation
+    def _matches(self, row: Dict[str, Any], column: str, operator: str, target: Any) -> bool:
+        if '.' in column and column not in row:
+            # A filter on an embedded resource, e.g. owners.user_name next to owners!inner(user_name)
+            relation, column = column.split('.', 1)
+            related, _ = self._embed(row, relation, column)
+            related = related if isinstance(related, list) else [related] if related else []
+            return any(self._matches(item, column, operator, target) for item in related)
+
+        value = row.get(column)
+        if operator == 'in':
+            return value in target or str(value) in target
+        if operator in ('like', 'ilike', 'is'):
+            return OPERATORS[operator](value, target)
+        return OPERATORS[operator](value, _coerce(target, value))
+
+    def _candidates(self) -> List[Dict[str, Any]]:
+        """Narrows the table through the most selective indexed equality or in filter"""
+        best = None
+        for column, operator, target in self.filters:
+            if '.' in column:
+                continue
+            if operator == 'eq':
+                rows = self.client.index(self.table, column).get(target, [])
+            elif operator == 'in' and len(target) < 1000:
+                index = self.client.index(self.table, column)
+                rows = [row for value in target for row in index.get(value, [])]
+            else:
+                continue
+            if best is None or len(rows) < len(best):
+                best = rows
+        return self.client.tables.get(self.table, []) if best is None else best
+
+    def _filtered(self) -> List[Dict[str, Any]]:
+        rows = []
+        for row in self._candidates():
+            if not all(self._matches(row, column, operator, target) for column, operator, target in self.filters):
+                continue
+            if not all(any(self._matches(row, *condition) for condition in group) for group in self.or_groups):
+                continue
+            rows.append(row)
+        return rows
+
+    def _embed(self, row: Dict[str, Any], relation: str, columns: str) -> Any:
+        """Resolves an embedded resource such as borrowers(name) through a foreign key or a reverse one"""
+        alias, _, relation = relation.rpartition(':')
+        table = relation.split('!')[0]
+        foreign_key = f"{_singular(table)}_id"
+
+        if foreign_key in row:
+            related = self.client.index(table, 'id').get(row[foreign_key], [])
+            return (self._project(related[0], columns) if related else None), alias or table
+
+        reverse_key = f"{_singular(self.table)}_id"
+        related = self.client.index(table, reverse_key).get(row.get('id'), [])
+        return [self._project(item, columns, table) for item in related], alias or table
+
+    def _project(self, row: Dict[str, Any], columns: str, table: Optional[str] = None) -> Dict[str, Any]:
+        projected = {}
+        for column in _split_top_level(columns):
+            if column == '*':
+                projected.update(row)
+            elif '(' in column:
+                relation, inner = column.split('(', 1)
+                query = self if table is None else FakeQuery(self.client, table)
+                value, name = query._embed(row, relation.strip(), inner[:-1])
+                projected[name] = value
+            else:
+                alias, _, source = column.rpartition(':')
+                projected[alias or source] = row.get(source)
+        return projected
+
+    def _write(self) -> List[Dict[str, Any]]:
+        table = self.client.tables.setdefault(self.table, [])
+
+        if self.method == 'POST':
+            written = []
+            for values in (self.payload if isinstance(self.payload, list) else [self.payload]):
+                row = dict(values)
+                if self.upsert_keys:
+                    keys, ignore_duplicates = self.upsert_keys
+                    existing = [item for item in table if all(item.get(key) == row.get(key) for key in keys)]
+                    if existing:
+                        if not ignore_duplicates:
+                            existing[0].update(row)
+                            written.append(existing[0])
+                        continue
+                row.setdefault('id', str(uuid.uuid4()))
+                table.append(row)
+                written.append(row)
+            self.client.invalidate(self.table)
+            return written
+
+        matched = self._filtered()
+        if self.method == 'PATCH':
+            for row in matched:
+                row.update(self.payload)
+        else:
+            removed = {id(row) for row in matched}
+            table[:] = [row for row in table if id(row) not in removed]
+        self.client.invalidate(self.table)
+        return matched
+
+    def execute(self) -> FakeResponse:
+        if self.method != 'GET':
+            rows = self._write()
+        else:
+            rows = self._filtered()
+            for column, desc in reversed(self.orders):
+                rows = sorted(rows, key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+
+        total = len(rows)
+        end = None if self.row_limit is None else self.row_offset + self.row_limit
+        if self.client.max_rows is not None:
+            end = min(end if end is not None else total, self.row_offset + self.client.max_rows)
+        rows = rows[self.row_offset:end]
+
+        data = [self._project(row, self.columns) for row in rows]
+        if self.single_row:
+            data = data[0] if data else None
+
+        self.client.record(self, data, total)
+        return FakeResponse(data, total if self.count_mode else None)
+
+
+class FakeRpc:
+    """Stands in for a postgrest RPC call; functions are registered on the FakeSupabase"""
+
+    def __init__(self, client: 'FakeSupabase', name: str, params: Dict[str, Any]):
+        self.client = client
+        self.table = f"rpc/{name}"
+        self.method = 'POST'
+        self.url_parts = []
+        self.name = name
+        self.params = params
+
+    def execute(self) -> FakeResponse:
+        function = self.client.functions.get(self.name)
+        data = function(self.client, **self.params) if function else None
+        self.client.record(self, data, len(data) if isinstance(data, list) else 1)
+        return FakeResponse(data)
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the Supabase client's PostgREST surface. It answers table() and rpc() calls from
+    seeded rows and records every round trip with the rows and bytes it would have moved, so service
+    classes can be benchmarked offline. Equality lookups go through per-column hash indexes, like the
+    database's own indexes, so N+1 query patterns stay cheap enough to count at 100k loans.
+    """
+
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]], max_rows: Optional[int] = None):
+        self.tables = tables
+        self.functions: Dict[str, Callable] = {}
+        self.max_rows = max_rows
+        self.queries: List[Dict[str, Any]] = []
+        self._indexes: Dict[tuple, Dict[Any, List[Dict[str, Any]]]] = {}
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    from_ = table
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> FakeRpc:
+        return FakeRpc(self, name, params or {})
+
+    def index(self, table: str, column: str) -> Dict[Any, List[Dict[str, Any]]]:
+        """Returns the rows of a table grouped by the value of a column, built on first use"""
+        key = (table, column)
+        if key not in self._indexes:
+            index = {}
+            for row in self.tables.get(table, []):
+                index.setdefault(row.get(column), []).append(row)
+            self._indexes[key] = index
+        return self._indexes[key]
+
+    def invalidate(self, table: str) -> None:
+        for key in [key for key in self._indexes if key[0] == table]:
+            del self._indexes[key]
+
+    def record(self, query, data: Any, matched: int) -> None:
+        record = {
+            'table': query.table,
+            'method': query.method,
+            'rows': len(data) if isinstance(data, list) else int(data is not None),
+            'matched': matched,
+            'bytes': len(json.dumps(data, default=str)),
+            'url_bytes': len('&'.join(query.url_parts))
+        }
+        self.queries.append(record)
+
+        # Counted by the query profiler too, so route query budgets hold when an app runs on this client
+        query_profiler.record_query({
+            'method': query.method, 'table': query.table, 'select': getattr(query, 'columns', None),
+            'filters': list(query.url_parts), 'status': 200, 'rows': record['rows'],
+            'bytes': record['bytes'], 'ms': 0.0
+        })
+
+    def reset(self) -> None:
+        self.queries = []
+
+
+def synthetic_business(loan_count: int, business_id: Optional[str] = None, seed: int = 0,
+                       today: Optional[datetime] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Returns the rows of one synthetic business with about loan_count loans spread over the last two years,
+    2.5 loans per borrower, 1.5 repayments per loan and the matching files, expenses and capital rows.
+    """
+    rng = random.Random(seed)
+    business_id = business_id or str(uuid.UUID(int=rng.getrandbits(128)))
+    today = today or datetime.now(UTC)
+
+    def timestamp(days_ago: float) -> str:
+        return (today - timedelta(days=days_ago)).isoformat()
+
+    borrowers = []
+    for number in range(max(1, int(loan_count / 2.5))):
+        borrowers.append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'business_id': business_id,
+            'name': f"Borrower {number}",
+            'nrc_number': f"{rng.randint(100000, 999999)}/{rng.randint(10, 99)}/1",
+            'gender': rng.choice(['Male', 'Female']),
+            'location': rng.choice(LOCATIONS),
+            'occupation': rng.choice(OCCUPATIONS),
+            'birth_date': f"{rng.randint(1950, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            'created_at': timestamp(rng.uniform(0, 730))
+        })
+
+    loans, repayments, files = [], [], []
+    for number in range(loan_count):
+        borrower = rng.choice(borrowers)
+        created = rng.uniform(0, 730)
+        duration = rng.choice([7, 14, 30, 60, 90])
+        amount = round(rng.uniform(200, 20000), 2)
+        loan_id = number + 1
+        loans.append({
+            'id': loan_id,
+            'borrower_id': borrower['id'],
+            'business_id': business_id,
+            'amount': amount,
+            'status': rng.choice(LOAN_STATUSES),
+            'interest_rate': rng.choice([10.0, 15.0, 20.0, 25.0]),
+            'duration_days': duration,
+            'due_date': (today - timedelta(days=created - duration)).date().isoformat(),
+            'transaction_costs': round(rng.uniform(0, 50), 2),
+            'loan_reason': rng.choice(LOAN_REASONS),
+            'created_at': timestamp(created)
+        })
+        for _ in range(rng.choice([0, 1, 2, 3])):
+            repayments.append({
+                'id': len(repayments) + 1,
+                'loan_id': loan_id,
+                'borrower_id': borrower['id'],
+                'business_id': business_id,
+                'amount': round(amount / 3, 2),
+                'discount': rng.choice([0.0, 0.0, 0.0, 25.0]),
+                'status': 'Completed',
+                'repayment_date': timestamp(max(created - rng.uniform(0, duration), 0))[:10],
+                'created_at': timestamp(max(created - rng.uniform(0, duration), 0))
+            })
+        photos = [f"https://storage.example/collateral/{loan_id}_{index}.jpg" for index in range(rng.randint(0, 3))]
+        files.append({
+            'id': loan_id,
+            'loan_id': loan_id,
+            'business_id': business_id,
+            'docs': [f"https://storage.example/contracts/{loan_id}.pdf"],
+            'photos': photos,
+            'thumbnails': [url.replace('.jpg', '_thumbnail.jpg') for url in photos]
+        })
+
+    owners = [{'id': str(uuid.UUID(int=rng.getrandbits(128))), 'business_id': business_id,
+               'user_name': f"owner{number}"} for number in range(3)]
+
+    expenses, injections, disbursements, capital_transactions = [], [], [], []
+    for number in range(max(1, loan_count // 10)):
+        expenses.append({'id': number + 1, 'business_id': business_id, 'name': rng.choice(['Rent', 'Fuel', 'Salaries']),
+                         'amount': round(rng.uniform(50, 5000), 2), 'created_at': timestamp(rng.uniform(0, 730))})
+    for number in range(max(1, loan_count // 100)):
+        owner = rng.choice(owners)
+        injection = {'id': number + 1, 'business_id': business_id, 'owner_id': owner['id'],
+                     'amount': round(rng.uniform(10000, 100000), 2), 'created_at': timestamp(rng.uniform(0, 730))}
+        disbursement = {'id': number + 1, 'business_id': business_id, 'owner_id': owner['id'],
+                        'amount': round(rng.uniform(1000, 10000), 2), 'created_at': timestamp(rng.uniform(0, 730))}
+        injections.append(injection)
+        disbursements.append(disbursement)
+        for kind, row in (('injection', injection), ('disbursement', disbursement)):
+            capital_transactions.append(dict(row, id=len(capital_transactions) + 1, type=kind))
+
+    return {
+        'borrowers': borrowers,
+        'loans': loans,
+        'repayments': repayments,
+        'files': files,
+        'expenses': expenses,
+        'owners': owners,
+        'injections': injections,
+        'disbursements': disbursements,
+        'capital_transactions': capital_transactions
+    }
+
+
+def seed_client(loan_count: int, seed: int = 0, max_rows: Optional[int] = None):
+    """
+    Returns a FakeSupabase holding a business with loan_count loans plus a neighbour a tenth of its size,
+    so every query also has to filter by business, and the id of the benchmarked business.
+    """
+    today = datetime.now(UTC)
+    business = synthetic_business(loan_count, seed=seed, today=today)
+    neighbour = synthetic_business(max(1, loan_count // 10), seed=seed + 1, today=today)
+
+    tables = {}
+    for rows in (business, neighbour):
+        loan_offset = len(tables.get('loans', []))
+        for name, table in rows.items():
+            # Keep integer ids unique across both businesses
+            id_offset = len(tables.get(name, []))
+            for row in table:
+                if isinstance(row['id'], int):
+                    row['id'] += id_offset
+                if 'loan_id' in row:
+                    row['loan_id'] += loan_offset
+            tables.setdefault(name, []).extend(table)
+
+    return FakeSupabase(tables, max_rows=max_rows), business['loans'][0]['business_id']
+
+
+def _tool(cls, client: FakeSupabase):
+    """Creates a service-class instance that talks to the fake client instead of Supabase"""
+    tool = cls.__new__(cls)
+    tool.supabase = client
+    return tool
+
+
+def _overview(client, business_id):
+    tool = _tool(OverviewMetrics, client)
+    period = 'Last 30 Days'
+
+    tool.available_cash(business_id)
+    for metric in ('total_disbursed', 'total_repaid', 'outstanding_balance', 'expected_interest',
+                   'average_loan_size', 'average_duration', 'active_loans', 'default_rate',
+                   'total_transaction_costs', 'total_discounts_given', 'total_period_expenses'):
+        getattr(tool, metric)(period, business_id)
+    tool.recent_borrowers(business_id)
+    tool.borrowers_by_location(period, business_id)
+    tool.weekly_loans_due(business_id)
+
+
+def _customer_analytics(client, business_id):
+    tool = _tool(CustomerAnalytics, client)
+    gender, month, year = 'All', 'All Months', datetime.now().year
+
+    tool.total_customers(gender, month, year, business_id)
+    tool.best_location(gender, year, month, business_id)
+    tool.worst_location(gender, year, month, business_id)
+    tool.average_loan_amount(gender, year, month, business_id)
+    tool.loans_by_location_chart(gender, year, month, business_id)
+    tool.loans_by_occupation_chart(gender, year, month, business_id)
+    tool.age_group_radial_bar_chart(gender, year, month, business_id)
+    tool.location_performance_ranking(gender, year, month, business_id)
+
+
+def _business_analytics(client, business_id):
+    tool = _tool(BusinessAnalytics, client)
+    gender, month, year = 'All', 'All Months', datetime.now().year
+
+    tool.total_loans_issued(gender, month, year, business_id)
+    tool.total_revenue_generated(gender, month, year, business_id)
+    tool.default_rate(gender, month, year, business_id)
+    tool.active_portfolio(gender, month, year, business_id)
+    tool.loan_reason_trend_chart(gender, year, 'Business', business_id)
+    tool.interest_vs_transaction_costs_chart(gender, year, business_id)
+    tool.loan_repayments_vs_expenses_chart(gender, year, business_id)
+
+
+def _filtered_loans(client, business_id):
+    _tool(Loans, client).filtered_loans(business_id, None, None, 'All Loans')
+
+
+def _csv_range():
+    today = datetime.now(UTC)
+    return (today - timedelta(days=365)).date().isoformat(), today.date().isoformat()
+
+
+def _loans_csv(client, business_id):
+    start_date, end_date = _csv_range()
+    _tool(Loans, client).download_csv(business_id, start_date, end_date)
+
+
+def _expenses_csv(client, business_id):
+    start_date, end_date = _csv_range()
+    _tool(Expenses, client).download_csv(business_id, start_date, end_date)
+
+
+def _capital_csv(client, business_id):
+    start_date, end_date = _csv_range()
+    _tool(CapitalFunctions, client).download_capital_transactions(start_date, end_date, business_id, 'owner1')
+
+
+# Each scenario makes the service calls of one page or download, in the order its route makes them
+SCENARIOS = {
+    'overview': _overview,
+    'customer_analytics': _customer_analytics,
+    'business_analytics': _business_analytics,
+    'filtered_loans': _filtered_loans,
+    'loans_csv': _loans_csv,
+    'expenses_csv': _expenses_csv,
+    'capital_csv': _capital_csv,
+}
+
+
+def run_scenario(name: str, client: FakeSupabase, business_id: str, rtt_ms: float = DEFAULT_RTT_MS) -> Dict[str, Any]:
+    """
+    Runs one scenario against a seeded fake client and returns its round trips, rows and bytes transferred,
+    the in-process time, and an estimate of the time against a real database rtt_ms away.
+    """
+    client.reset()
+    app = Flask(__name__)
+
+    # The services print debug output; keep it out of the report and off the clock as far as possible
+    with app.test_request_context(), contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        SCENARIOS[name](client, business_id)
+        seconds = time.perf_counter() - started
+
+    queries = client.queries
+    return {
+        'scenario': name,
+        'round_trips': len(queries),
+        'rows': sum(query['rows'] for query in queries),
+        'kb': round(sum(query['bytes'] for query in queries) / 1024, 1),
+        'max_url_kb': round(max((query['url_bytes'] for query in queries), default=0) / 1024, 1),
+        'seconds': round(seconds, 4),
+        'estimated_seconds': round(seconds + len(queries) * rtt_ms / 1000, 4)
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def load_history(path: str) -> List[Dict[str, Any]]:
+    """Returns the recorded benchmark runs, oldest first"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as history:
+        return [json.loads(line) for line in history if line.strip()]
+
+
+def find_regressions(results: List[Dict[str, Any]], previous: Optional[Dict[str, Any]],
+                     tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Compares results with the previous run: any extra round trip is a regression, and so is estimated time
+    more than tolerance above the previous value.
+    """
+    if not previous:
+        return []
+
+    baseline = {(result['scenario'], result['loans']): result for result in previous['results']}
+    regressions = []
+
+    for result in results:
+        before = baseline.get((result['scenario'], result['loans']))
+        if not before:
+            continue
+        label = f"{result['scenario']} @ {result['loans']:,} loans"
+        if result['round_trips'] > before['round_trips']:
+            regressions.append(f"{label}: round trips {before['round_trips']:,} -> {result['round_trips']:,}")
+        if result['estimated_seconds'] > before['estimated_seconds'] * (1 + tolerance):
+            regressions.append(f"{label}: estimated {before['estimated_seconds']:.2f}s -> "
+                               f"{result['estimated_seconds']:.2f}s")
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark dashboard pages and CSV exports against an in-memory Supabase.')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma-separated loan counts per business')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated scenario names')
+    parser.add_argument('--rtt-ms', type=float, default=DEFAULT_RTT_MS, help='modelled round-trip time')
+    parser.add_argument('--max-rows', type=int, default=None,
+                        help='cap rows per response like PostgREST max-rows (Supabase defaults to 1000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--history', default=DEFAULT_HISTORY_PATH, help='JSON-lines file runs are appended to')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--no-record', action='store_true', help='compare with history without appending this run')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 on a regression')
+    parser.add_argument('--log-level', default='ERROR', help='log level of the benchmarked services')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    preload_lazy_modules()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        client, business_id = seed_client(size, seed=args.seed, max_rows=args.max_rows)
+        print(f"{size:,} loans, {len(client.tables['borrowers']):,} borrowers, "
+              f"{len(client.tables['repayments']):,} repayments")
+
+        for name in scenarios:
+            result = dict(run_scenario(name, client, business_id, args.rtt_ms), loans=size)
+            results.append(result)
+            print(f"  {name:<20} {result['round_trips']:>8,} trips {result['rows']:>10,} rows "
+                  f"{result['kb']:>10,.1f} KB  max url {result['max_url_kb']:>7,.1f} KB  "
+                  f"{result['seconds']:>7.2f}s  est. {result['estimated_seconds']:>8.2f}s")
+
+    history = load_history(args.history)
+    comparable = [run for run in history if run.get('rtt_ms') == args.rtt_ms and run.get('max_rows') == args.max_rows]
+    regressions = find_regressions(results, comparable[-1] if comparable else None, args.tolerance)
+
+    if regressions:
+        print(f"\nRegressions against {comparable[-1].get('commit') or 'the previous run'}:")
+        for regression in regressions:
+            print(f"  {regression}")
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+        with open(args.history, 'a') as history_file:
+            history_file.write(json.dumps({
+                'run_at': datetime.now(UTC).isoformat(),
+                'commit': _git_commit(),
+                'rtt_ms': args.rtt_ms,
+                'max_rows': args.max_rows,
+                'results': results
+            }) + '\n')
+
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
@@ -1,4 +1,9 @@
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
 from datetime import date, timedelta, datetime, UTC
 from dotenv import load_dotenv
 import os
@@ -25,7 +30,8 @@ class BorrowerInformation:
             logger.error(f"Failed to initialize Supabase client: {e}")
             raise
 
-    def borrower_standings(self):
+    @staticmethod
+    def borrower_standings():
         """Returns a dictionary of borrower standing categories mapped to their percentage thresholds."""
         borrower_standings = {
             'perfect standing': 100,  # 100% repayment rate (always pays on time)
@@ -35,7 +41,8 @@ class BorrowerInformation:
         }
         return borrower_standings
 
-    def risk_standings(self):
+    @staticmethod
+    def risk_standings():
         """returns a dictionary that holds the keys of risk assessment of the borrower"""
         risk_card = {
             'cannot_loan': (81, 100, 0),
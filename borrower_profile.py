@@ -0,0 +1,336 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
+from datetime import datetime, timezone
+import os
+import logging
+
+from borrower_information import BorrowerInformation
+
+# Set up logging
+logging.basicConfig(level=logging.ERROR)
+logger = logging.getLogger(__name__)
+
+
+class BorrowerProfile:
+    """Loads a borrower's loans and repayments once and derives the borrower information cards from them"""
+
+    def __init__(self):
+        try:
+            url = os.getenv("SUPABASE_URL")
+            service_role_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+            if not url or not service_role_key:
+                raise ValueError("SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY is not set.")
+
+            self.supabase: Client = create_client(url, service_role_key)
+            self.borrower_information_tool = BorrowerInformation()
+        except Exception as e:
+            logger.error(f"Failed to initialize Supabase client: {e}")
+            raise
+
+    def load(self, borrower_id, business_id):
+        """
+        Returns every card of the borrower information page for a specific business, or None when the
+        borrower does not belong to the business. Costs two round trips: the borrower row with its stored
+        risk, then the borrower's loans with their repayments embedded.
+        """
+
+        if not borrower_id or not business_id:
+            logger.error("borrower_id and business_id are required for the borrower profile")
+            return None
+
+        try:
+            borrower_response = (
+                self.supabase
+                .table('borrowers')
+                .select('*, borrower_risk(*)')
+                .eq('id', borrower_id)
+                .eq('business_id', business_id)
+                .limit(1)
+                .execute()
+            )
+
+            if not borrower_response.data:
+                logger.info(f"Borrower {borrower_id} not found in business {business_id}")
+                return None
+
+            borrower_data = borrower_response.data[0]
+            stored_risk = borrower_data.pop('borrower_risk', None)
+            if isinstance(stored_risk, list):
+                stored_risk = stored_risk[0] if stored_risk else None
+
+            loans_response = (
+                self.supabase
+                .table('loans')
+                .select('*, repayments(amount, discount, repayment_date, business_id)')
+                .eq('borrower_id', borrower_id)
+                .eq('business_id', business_id)
+                .order('created_at', desc=True)
+                .execute()
+            )
+
+            loans = loans_response.data or []
+
+            # Keep only the repayments recorded under this business
+            for loan in loans:
+                loan['repayments'] = [
+                    repayment for repayment in (loan.get('repayments') or [])
+                    if str(repayment.get('business_id')) == str(business_id)
+                ]
+
+            # The oldest loan is the one the payment history card has always been based on
+            loan_id = loans[-1].get('id') if loans else None
+
+            return {
+                'borrower_data': borrower_data,
+                'loan_id': loan_id,
+                'payment_history': self.payment_history(loans[-1] if loans else None),
+                'outstanding_debts': self.outstanding_debts(loans),
+                'default_assessment': (self.stored_assessment(stored_risk) if self.risk_is_current(stored_risk, loans)
+                                       else self.default_assessment(loans)),
+                'credit_status': self.credit_status(loans),
+                'recent_borrower_history': self.recent_history(loans)
+            }
+
+        except Exception as e:
+            logger.error(f"Error loading profile for borrower {borrower_id} in business {business_id}: {e}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return None
+
+    def _sum_amounts(self, rows, field='amount'):
+        """Sums a numeric field over rows, skipping values that cannot be converted"""
+        total = 0
+        for row in rows:
+            try:
+                value = row.get(field)
+                if value is not None and value != '':
+                    total += float(value)
+            except (ValueError, TypeError):
+                continue
+        return total
+
+    def payment_history(self, loan):
+        """Payment history card for a single loan, matching BorrowerInformation.get_borrower_payment_history"""
+
+        if not loan:
+            return {
+                'status': 'Standing Not Determined Yet',
+                'on_time_payments': 0,
+                'late_payments': 0,
+                'last_repayment_date': None
+            }
+
+        today_date = datetime.today().strftime("%Y-%m-%d")
+        due_date = loan.get('due_date')
+        total_due_loans = 1 if due_date and due_date[:10] < today_date else 0
+
+        repayment_data = sorted(loan.get('repayments') or [], key=lambda r: r.get('repayment_date') or '')
+        on_time_repayments = len(repayment_data)
+        last_repayment_date = repayment_data[-1]['repayment_date'] if repayment_data else None
+
+        if total_due_loans == 0:
+            return {
+                'status': 'Standing Not Determined Yet',
+                'on_time_payments': on_time_repayments,
+                'late_payments': 0,
+                'last_repayment_date': last_repayment_date
+            }
+
+        repayment_percentage = (on_time_repayments / total_due_loans) * 100
+
+        status = 'bad standing'
+        for standing, threshold in self.borrower_information_tool.borrower_standings().items():
+            if repayment_percentage >= threshold:
+                status = standing
+                break
+
+        return {
+            'status': status,
+            'on_time_payments': on_time_repayments,
+            'late_payments': max(total_due_loans - on_time_repayments, 0),
+            'last_repayment_date': last_repayment_date
+        }
+
+    def outstanding_debts(self, loans):
+        """Outstanding debts card, matching BorrowerInformation.total_outstanding_debts"""
+
+        loan_data = [loan for loan in loans if loan.get('status') is not None and loan['status'] != 'Completed']
+
+        if not loan_data:
+            return {
+                'total_outstanding': 0,
+                'active_loans': 0,
+                'earliest_date': None
+            }
+
+        dates = []
+        for loan in loan_data:
+            try:
+                dates.append(datetime.strptime(loan['due_date'], '%Y-%m-%d').date())
+            except (KeyError, ValueError, TypeError):
+                continue
+
+        return {
+            'total_outstanding': self._sum_amounts(loan_data),
+            'active_loans': sum(1 for loan in loan_data if loan.get('status') and loan['status'] != 'Default'),
+            'earliest_date': min(dates).strftime('%Y-%m-%d') if dates else None
+        }
+
+    def default_assessment(self, loans):
+        """Default risk card, matching BorrowerInformation.default_risk_assessment"""
+
+        if not loans:
+            return {
+                'risk_level': 'no_risk',
+                'risk_score': 100,
+                'missed_payments': 0,
+                'customer_since': None
+            }
+
+        overdue_loans = sum(1 for loan in loans if loan.get('status') == 'Overdue')
+        default_percentage = overdue_loans / len(loans) * 100
+
+        risk_level = 'no_risk'
+        risk_score = 100
+        for level, (low, high, score) in self.borrower_information_tool.risk_standings().items():
+            if low <= default_percentage <= high:
+                risk_level = level
+                risk_score = score
+                break
+
+        borrower_dates = []
+        for loan in loans:
+            try:
+                borrower_dates.append(datetime.fromisoformat(loan['created_at']))
+            except (KeyError, ValueError, TypeError):
+                continue
+
+        earliest_date = min(borrower_dates).date() if borrower_dates else None
+
+        return {
+            'risk_level': risk_level,
+            'risk_score': risk_score,
+            'missed_payments': sum(1 for loan in loans if loan.get('status') in ('Overdue', 'Default')),
+            'customer_since': str(earliest_date) if earliest_date else None
+        }
+
+    def risk_is_current(self, stored_risk, loans):
+        """
+        Whether the stored risk row was computed after the borrower's latest loan was created. Loans created
+        outside the app's loan paths do not refresh it, so an older row is recomputed from the loans instead.
+        """
+        if not stored_risk:
+            return False
+
+        def parse(value):
+            # Loan timestamps may come back without an offset; the database stores them in UTC
+            moment = datetime.fromisoformat(value)
+            return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+        try:
+            updated_at = parse(stored_risk['updated_at'])
+        except (KeyError, ValueError, TypeError):
+            return False
+
+        for loan in loans:
+            try:
+                if parse(loan['created_at']) > updated_at:
+                    return False
+            except (KeyError, ValueError, TypeError):
+                continue
+        return True
+
+    def stored_assessment(self, stored_risk):
+        """Default risk card read from the borrower's row in the borrower_risk table"""
+        return {
+            'risk_level': stored_risk.get('risk_level', 'unknown'),
+            'risk_score': stored_risk.get('risk_score', 0),
+            'missed_payments': stored_risk.get('missed_payments', 0),
+            'customer_since': stored_risk.get('customer_since')
+        }
+
+    def credit_status(self, loans):
+        """Account status card, matching BorrowerInformation.account_status"""
+
+        if not loans:
+            return {
+                "total_loaned": 0,
+                "total_repaid": 0,
+                "credit_limit": 0,
+                "total_income_interest": 0,
+                "last_contract": None
+            }
+
+        loan_dates = []
+        for loan in loans:
+            try:
+                loan_dates.append(datetime.fromisoformat(loan['created_at']))
+            except (KeyError, ValueError, TypeError):
+                continue
+
+        latest_date = max(loan_dates).date() if loan_dates else None
+
+        total_loaned = self._sum_amounts(loans)
+        total_repaid = sum(self._sum_amounts(loan.get('repayments') or []) for loan in loans)
+
+        return {
+            "total_loaned": total_loaned,
+            "total_repaid": total_repaid,
+            "credit_limit": total_repaid * 2.5,
+            "total_income_interest": total_repaid - total_loaned,
+            "last_contract": str(latest_date) if latest_date else None
+        }
+
+    def recent_history(self, loans, limit=3):
+        """Recent loans table, matching BorrowerInformation.recent_borrower_history"""
+
+        recent_history = []
+
+        # Loans are already ordered newest first
+        for loan in loans[:limit]:
+            try:
+                created_at_date = None
+                if loan.get('created_at'):
+                    try:
+                        created_at_date = datetime.fromisoformat(loan['created_at']).date()
+                    except (ValueError, TypeError):
+                        created_at_date = None
+
+                loan_amount = 0
+                try:
+                    loan_amount = float(loan.get('amount', 0))
+                except (ValueError, TypeError):
+                    pass
+
+                interest_rate = 0
+                try:
+                    interest_rate = float(loan.get('interest_rate', 0))
+                except (ValueError, TypeError):
+                    pass
+
+                repaid_amount = self._sum_amounts(loan.get('repayments') or [])
+                total_due = loan_amount + (loan_amount * interest_rate / 100)
+
+                due_date = loan.get('due_date')
+                end_date = due_date[:10] if isinstance(due_date, str) else None
+
+                recent_history.append({
+                    'start_date': str(created_at_date) if created_at_date else None,
+                    'amount': loan_amount,
+                    'interest_rate': f"{interest_rate}%",
+                    'end_date': end_date,
+                    'status': loan.get('status', 'Unknown'),
+                    'repaid_amount': repaid_amount,
+                    'balance': round(total_due - repaid_amount, 2)
+                })
+
+            except Exception as e:
+                logger.error(f"Error processing loan data for profile: {e}")
+                continue
+
+        return recent_history
@@ -0,0 +1,167 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
+import os
+import logging
+
+from risk_scoring import PortfolioRiskScoring, book_arrays, score_book
+
+# Set up logging
+logging.basicConfig(level=logging.ERROR)
+logger = logging.getLogger(__name__)
+
+
+class BorrowerRisk:
+    """Maintains the persisted borrower_risk table so risk can be read and ranked without rescanning loans"""
+
+    # Rows sent per upsert when rebuilding a whole book
+    UPSERT_BATCH_SIZE = 500
+
+    def __init__(self):
+        try:
+            url = os.getenv("SUPABASE_URL")
+            service_role_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+            if not url or not service_role_key:
+                raise ValueError("SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY is not set.")
+
+            self.supabase: Client = create_client(url, service_role_key)
+        except Exception as e:
+            logger.error(f"Failed to initialize Supabase client: {e}")
+            raise
+
+    def _upsert(self, rows):
+        """Writes risk rows in batches and returns how many were written"""
+        written = 0
+        for start in range(0, len(rows), self.UPSERT_BATCH_SIZE):
+            batch = rows[start:start + self.UPSERT_BATCH_SIZE]
+            response = self.supabase.table('borrower_risk').upsert(batch, on_conflict='borrower_id').execute()
+            written += len(response.data) if response.data else 0
+        return written
+
+    def refresh_borrowers(self, borrower_ids, business_id):
+        """Recomputes and stores the risk rows of the given borrowers in one read and one write"""
+
+        borrower_ids = list(dict.fromkeys(borrower_id for borrower_id in borrower_ids if borrower_id is not None))
+
+        if not borrower_ids or not business_id:
+            return 0
+
+        try:
+            response = (
+                self.supabase
+                .table('loans')
+                .select('id, borrower_id, business_id, status, created_at, due_date, repayments(loan_id, repayment_date)')
+                .in_('borrower_id', borrower_ids)
+                .eq('business_id', business_id)
+                .execute()
+            )
+
+            loans = response.data or []
+            repayments = [repayment for loan in loans for repayment in (loan.pop('repayments', None) or [])]
+
+            rows = score_book(book_arrays(loans, repayments))
+            updated = self._upsert(rows)
+
+            logger.info(f"Refreshed risk for {updated} borrowers in business {business_id}")
+            return updated
+
+        except Exception as e:
+            logger.error(f"Error refreshing borrower risk for business {business_id}: {e}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return 0
+
+    def refresh_loans(self, loan_ids, business_id):
+        """Recomputes the risk rows of the borrowers owning the given loans"""
+
+        loan_ids = [loan_id for loan_id in loan_ids if loan_id]
+
+        if not loan_ids or not business_id:
+            return 0
+
+        try:
+            response = (
+                self.supabase
+                .table('loans')
+                .select('borrower_id')
+                .in_('id', loan_ids)
+                .eq('business_id', business_id)
+                .execute()
+            )
+
+            borrower_ids = [loan['borrower_id'] for loan in (response.data or [])]
+            return self.refresh_borrowers(borrower_ids, business_id)
+
+        except Exception as e:
+            logger.error(f"Error refreshing borrower risk for loans {loan_ids} in business {business_id}: {e}")
+            return 0
+
+    def rebuild(self, business_id=None):
+        """Recomputes the risk rows of every borrower of a business, or of every business when none is given"""
+
+        try:
+            scoring_tool = PortfolioRiskScoring()
+            rows = scoring_tool.score_business(business_id)
+            updated = self._upsert(rows)
+
+            logger.info(f"Rebuilt risk for {updated} borrowers" + (f" in business {business_id}" if business_id else ""))
+            return updated
+
+        except Exception as e:
+            logger.error(f"Error rebuilding borrower risk: {e}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return 0
+
+    def get_borrower_risk(self, borrower_id, business_id):
+        """Returns the stored risk row of a borrower for a specific business"""
+
+        if not borrower_id or not business_id:
+            return None
+
+        try:
+            response = (
+                self.supabase
+                .table('borrower_risk')
+                .select('*')
+                .eq('borrower_id', borrower_id)
+                .eq('business_id', business_id)
+                .limit(1)
+                .execute()
+            )
+            return response.data[0] if response.data else None
+
+        except Exception as e:
+            logger.error(f"Error reading risk for borrower {borrower_id} in business {business_id}: {e}")
+            return None
+
+    def ranked_borrowers(self, business_id, risk_level=None, standing=None, limit=50):
+        """Returns borrowers of a business ordered from riskiest to safest, optionally filtered by risk or standing"""
+
+        if not business_id:
+            logger.error("business_id is required for ranked borrowers")
+            return []
+
+        try:
+            query = (
+                self.supabase
+                .table('borrower_risk')
+                .select('*, borrowers(name, nrc_number)')
+                .eq('business_id', business_id)
+            )
+
+            if risk_level:
+                query = query.eq('risk_level', risk_level)
+            if standing:
+                query = query.eq('standing', standing)
+
+            response = query.order('risk_score').order('missed_payments', desc=True).limit(limit).execute()
+            return response.data or []
+
+        except Exception as e:
+            logger.error(f"Error ranking borrowers for business {business_id}: {e}")
+            return []
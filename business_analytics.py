@@ -1,12 +1,22 @@
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
 import datetime
 import os
 from calendar import monthrange
 from collections import Counter, defaultdict
+import logging
+
+from lazy_imports import lazy_import
+px = lazy_import('plotly.express')
+go = lazy_import('plotly.graph_objects')
+pd = lazy_import('pandas')
 
-import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
+# Set up logging
+logger = logging.getLogger(__name__)
 
 
 class BusinessAnalytics:
@@ -334,18 +344,15 @@ class BusinessAnalytics:
     def loan_repayments_vs_expenses(self, gender, year, business_id):
         """Returns data of total_repaid_loans vs total_expenses (including discounts) for a certain period"""
         try:
-            print(f"DEBUG: Starting with gender={gender}, year={year}, business_id={business_id}")
-
             year = self.validate_year(year)
-            print(f"DEBUG: Validated year: {year}")
 
             # Fix gender filter - handle 'All Genders' vs 'All'
             filter_gender = 'All' if gender == 'All Genders' else gender
             borrower_ids = self.get_borrower_ids(filter_gender, business_id)
-            print(f"DEBUG: Found borrower_ids: {borrower_ids}")
+            logger.debug("Repayments vs expenses for business %s, %s, %s: %d borrowers",
+                         business_id, filter_gender, year, len(borrower_ids))
 
             if not borrower_ids:
-                print("DEBUG: No borrower IDs found - returning empty dict")
                 return {}
 
             # Get ALL loan IDs for these borrowers (not time-limited)
@@ -356,10 +363,8 @@ class BusinessAnalytics:
                 .execute()
 
             all_loan_ids = [loan['id'] for loan in all_loans_response.data if loan and 'id' in loan]
-            print(f"DEBUG: Total loan IDs for borrowers: {len(all_loan_ids)}")
 
             if not all_loan_ids:
-                print("DEBUG: No loan IDs found for borrowers")
                 return {}
 
             monthly_data = {}
@@ -372,7 +377,6 @@ class BusinessAnalytics:
 
                 try:
                     start, end = self.month_map(year)[month_name]
-                    print(f"DEBUG: Processing {month_name} - Date range: {start} to {end}")
 
                     # Get repayments MADE during this month (using created_at)
                     repayments_response = self.supabase.table('repayments') \
@@ -383,9 +387,6 @@ class BusinessAnalytics:
                         .lte('created_at', end) \
                         .execute()
 
-                    print(f"DEBUG: Repayments response for {month_name}: {repayments_response}")
-                    print(f"DEBUG: Repayments data for {month_name}: {repayments_response.data}")
-
                     total_repaid = 0
                     total_discount = 0
 
@@ -394,20 +395,13 @@ class BusinessAnalytics:
                             if not row:
                                 continue
                             try:
-                                amount = float(row.get('amount') or 0)
-                                discount = float(row.get('discount') or 0)
-                                total_repaid += amount
-                                total_discount += discount
-                                print(f"DEBUG: Processing repayment - amount: {amount}, discount: {discount}")
+                                total_repaid += float(row.get('amount') or 0)
+                                total_discount += float(row.get('discount') or 0)
                             except (ValueError, TypeError) as calc_error:
-                                print(f"Error calculating repayment values: {str(calc_error)}")
+                                logger.warning("Invalid repayment values %s: %s", row, calc_error)
                                 continue
-                    else:
-                        print(f"DEBUG: No repayments found for {month_name}")
 
                     # Get expense data from the expenses table for the same period (using created_at)
-                    print(f"DEBUG: Querying expenses for date range: {start} to {end}")
-
                     expenses_response = self.supabase.table('expenses') \
                         .select('amount, created_at') \
                         .eq('business_id', business_id) \
@@ -415,48 +409,38 @@ class BusinessAnalytics:
                         .lte('created_at', end) \
                         .execute()
 
-                    print(f"DEBUG: Expenses response for {month_name}: {expenses_response}")
-                    print(f"DEBUG: Expenses data for {month_name}: {expenses_response.data}")
-
                     total_expense = 0
                     if expenses_response and expenses_response.data:
                         for row in expenses_response.data:
                             try:
-                                expense_amount = float(row.get('amount') or 0)
-                                total_expense += expense_amount
-                                print(f"DEBUG: Processing expense - amount: {expense_amount}")
+                                total_expense += float(row.get('amount') or 0)
                             except (ValueError, TypeError) as expense_error:
-                                print(f"DEBUG: Error processing expense: {expense_error}")
+                                logger.warning("Invalid expense values %s: %s", row, expense_error)
                                 continue
-                    else:
-                        print(f"DEBUG: No expenses found for {month_name}")
 
                     # Include the discount as an expense
                     total_expenses_combined = total_expense + total_discount
 
-                    print(f"DEBUG: {month_name} totals - repaid: {total_repaid}, expenses: {total_expenses_combined}")
+                    logger.debug("%s: %d repayments, %d expenses, repaid %.2f, expenses %.2f", month_name,
+                                 len(repayments_response.data or []), len(expenses_response.data or []),
+                                 total_repaid, total_expenses_combined)
 
                     monthly_data[month_name] = {
                         'total_repaid': float(total_repaid),
                         'total_expenses': float(total_expenses_combined)
                     }
 
-                except Exception as month_error:
-                    print(f"Error processing {month_name}: {str(month_error)}")
-                    import traceback
-                    traceback.print_exc()
+                except Exception:
+                    logger.exception("Error processing %s for business %s", month_name, business_id)
                     monthly_data[month_name] = {
                         'total_repaid': 0,
                         'total_expenses': 0
                     }
 
-            print(f"DEBUG: Final monthly_data: {monthly_data}")
             return monthly_data
 
-        except Exception as e:
-            print(f"Error generating loan repayments vs expense data: {str(e)}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error generating loan repayments vs expense data for business %s", business_id)
             return {}
 
     def loan_reason_trend_chart(self, gender, year, loan_reason, business_id):
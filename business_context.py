@@ -0,0 +1,152 @@
+import functools
+import logging
+import os
+from typing import Any, Dict, Optional, TYPE_CHECKING
+
+from flask import flash, g, has_request_context, redirect, session, url_for
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from caching import TTLCache
+from query_profiler import create_client
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Columns of business_users that make up a business's context; never the password
+CONTEXT_COLUMNS = 'id, business_name, email, paid, plan'
+
+# What each subscription plan includes, as listed on the subscription page
+PLAN_LIMITS: Dict[Optional[str], Dict[str, bool]] = {
+    None: {
+        'dashboard': False, 'advanced_analytics': False, 'ai_chatbot': False, 'whatsapp_reminders': False,
+        'quickbooks': False, 'custom_integrations': False
+    },
+    'Basic': {
+        'dashboard': True, 'advanced_analytics': False, 'ai_chatbot': False, 'whatsapp_reminders': False,
+        'quickbooks': False, 'custom_integrations': False
+    },
+    'Professional': {
+        'dashboard': True, 'advanced_analytics': True, 'ai_chatbot': True, 'whatsapp_reminders': True,
+        'quickbooks': True, 'custom_integrations': False
+    },
+    'Enterprise': {
+        'dashboard': True, 'advanced_analytics': True, 'ai_chatbot': True, 'whatsapp_reminders': True,
+        'quickbooks': True, 'custom_integrations': True
+    }
+}
+
+# Contexts are reused for a short while only, since a change recorded by another process is not
+# invalidated here; BUSINESS_CONTEXT_TTL sets the seconds. Only paid businesses are cached: a payment
+# completes in whichever worker polls it, and an unpaid context cached in another worker would keep
+# sending the business back to the subscription page until it expired.
+_contexts = TTLCache('business_context', float(os.getenv('BUSINESS_CONTEXT_TTL', '30')))
+
+
+def context_from_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Builds a business context from a business_users row"""
+    paid = bool(row.get('paid'))
+    plan = row.get('plan') or ('Basic' if paid else None)
+
+    return {
+        'id': row.get('id'),
+        'name': row.get('business_name'),
+        'email': row.get('email'),
+        'paid': paid,
+        'plan': plan,
+        'limits': PLAN_LIMITS.get(plan if paid else None, PLAN_LIMITS['Basic'])
+    }
+
+
+def _remember(context: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Caches a context if its business has paid, and returns it"""
+    if context and context['paid']:
+        _contexts.set(context['id'], context)
+    return context
+
+
+def remember_business_context(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Caches the context of a business_users row already read elsewhere, e.g. at login, and returns it"""
+    return _remember(context_from_row(row))
+
+
+def invalidate_business_context(business_id) -> None:
+    """Drops a business's cached context, e.g. after its payment status changed"""
+    _contexts.invalidate(business_id)
+    if has_request_context() and (g.get('business_context') or {}).get('id') == business_id:
+        g.pop('business_context')
+
+
+class BusinessContext:
+    """Loads a business's row, paid status and plan limits with one query and caches them per business"""
+
+    def __init__(self):
+        url = os.getenv("SUPABASE_URL")
+        service_role_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+        if not url or not service_role_key:
+            raise ValueError("SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY is not set.")
+
+        self.supabase: Client = create_client(url, service_role_key)
+
+    def _fetch(self, business_id) -> Optional[Dict[str, Any]]:
+        response = (
+            self.supabase.table('business_users')
+            .select(CONTEXT_COLUMNS)
+            .eq('id', business_id)
+            .limit(1)
+            .execute()
+        )
+        if not response.data:
+            logger.warning("Business %s not found", business_id)
+            return None
+        return context_from_row(response.data[0])
+
+    def load(self, business_id) -> Optional[Dict[str, Any]]:
+        """Returns the business's context, from the cache when it is fresh enough; unpaid ones are re-read"""
+        return _contexts.get(business_id) or _remember(self._fetch(business_id))
+
+
+def current_business() -> Optional[Dict[str, Any]]:
+    """
+    Returns the context of the business in the session, loaded at most once per request, or None when no
+    business is logged in. Routes use it for the paid status and plan instead of querying business_users.
+    """
+    if 'business_context' in g:
+        return g.business_context
+
+    business_data = session.get('business_data') or session.get('pending_business_data') or {}
+    business_id = business_data.get('id')
+
+    g.business_context = BusinessContext().load(business_id) if business_id else None
+    return g.business_context
+
+
+def business_required(feature: str = 'dashboard'):
+    """
+    Route decorator that lets a request through only when a business is logged in, has paid, and its plan
+    includes the given feature from PLAN_LIMITS. The view then reads the business from current_business().
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            business = current_business() if 'business_data' in session else None
+
+            if not business:
+                flash('Business session expired. Please log into business first', 'error')
+                return redirect(url_for('business_login'))
+
+            if not business['paid']:
+                flash('Please complete your subscription to access the dashboard.', 'warning')
+                return redirect(url_for('subscription'))
+
+            if not business['limits'].get(feature):
+                flash(f"Your {business['plan']} plan does not include this feature. Upgrade to use it.", 'warning')
+                return redirect(url_for('subscription'))
+
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
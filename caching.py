@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, Callable, Tuple
+
+from metrics import record_cache
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Every cache of this process, so their locks can be replaced after a fork
+_caches = weakref.WeakSet()
+
+
+class RefreshAheadValue:
+    """
+    One value fetched from a slow service and kept until it expires, such as an API token or an exchange
+    rate. The loader returns the value and the time.time() at which it expires. Once a value has used up
+    refresh_ahead of its lifetime it is still returned, and a background thread fetches the next one, so
+    callers only wait on the loader for the very first value or after one has fully expired.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Tuple[Any, float]], refresh_ahead: float = 0.2):
+        self.name = name
+        self.loader = loader
+        self.refresh_ahead = refresh_ahead
+
+        self._value = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        _caches.add(self)
+
+    def _store(self, value: Any, expires_at: float) -> None:
+        loaded_at = time.time()
+        self._value = value
+        self._expires_at = expires_at
+        self._refresh_at = loaded_at + max(expires_at - loaded_at, 0) * (1 - self.refresh_ahead)
+
+    def _refresh(self) -> None:
+        """Background refresh; a failure leaves the current value in place until it expires"""
+        try:
+            value, expires_at = self.loader()
+            with self._lock:
+                self._store(value, expires_at)
+            logger.debug("Refreshed %s ahead of expiry", self.name)
+        except Exception as e:
+            logger.warning("Refreshing %s ahead of expiry failed: %s", self.name, e)
+        finally:
+            self._refreshing = False
+
+    def get(self) -> Any:
+        """Returns the current value, loading it now only if there is no unexpired one"""
+        now = time.time()
+
+        if now < self._expires_at:
+            record_cache(self.name, True)
+            if now >= self._refresh_at and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, name=f"refresh-{self.name}", daemon=True).start()
+            return self._value
+
+        record_cache(self.name, False)
+        with self._lock:
+            # Another thread may have loaded it while this one waited for the lock
+            if time.time() >= self._expires_at:
+                self._store(*self.loader())
+            return self._value
+
+    def invalidate(self) -> None:
+        """Drops the value, e.g. after the service rejected it, so the next get() loads a new one"""
+        with self._lock:
+            self._expires_at = 0.0
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+
+def _reset_caches_after_fork() -> None:
+    """A lock held or a refresh running in the parent at fork time must not block the child"""
+    for cache in list(_caches):
+        cache._after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_caches_after_fork)
+
+
+def parse_expiry(expiry: Any, default_ttl: float) -> float:
+    """
+    Turns an API's expiry field (ISO 8601 text, or epoch seconds or milliseconds) into a time.time()
+    value, falling back to default_ttl seconds from now when it is missing or unreadable.
+    """
+    from datetime import datetime
+
+    try:
+        if isinstance(expiry, (int, float)):
+            return expiry / 1000 if expiry > 1e12 else float(expiry)
+        if isinstance(expiry, str) and expiry:
+            return datetime.fromisoformat(expiry.replace('Z', '+00:00')).timestamp()
+    except (TypeError, ValueError):
+        logger.warning("Unreadable expiry %r, assuming %s seconds", expiry, default_ttl)
+
+    return time.time() + default_ttl
+
+
+
+class TTLCache:
+    """
+    Values kept per key for ttl seconds, for data that may be slightly stale, such as a business's paid
+    status. Each process has its own copy, so a change made through another process is only seen once the
+    entry expires; changes made in this process should invalidate the key.
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: int = 10000):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def get(self, key: Any) -> Any:
+        """Returns the cached value for the key, or None if there is none or it has expired"""
+        entry = self._entries.get(key)
+        hit = entry is not None and time.monotonic() < entry[0]
+        record_cache(self.name, hit)
+        return entry[1] if hit else None
+
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                self._entries = {k: entry for k, entry in self._entries.items() if entry[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def get_or_load(self, key: Any, loader: Callable[[], Any]) -> Any:
+        """Returns the cached value, or loads, caches and returns it; None results are not cached"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, key: Any) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
@@ -1,4 +1,9 @@
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
 import datetime
 import os
 import logging
@@ -7,14 +12,37 @@ from flask import send_file, make_response
 import io
 import tempfile
 import os
-import pandas
+from lazy_imports import lazy_import
+pandas = lazy_import('pandas')
 from datetime import datetime
 
+from document_store import DocumentStore
+from upload_streams import spool_upload, UploadTooLargeError, MAX_TRANSACTION_FILE_BYTES
+
 
 # Set up logging
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+# Capital transactions with the name of their owner, fetched in the same request
+TRANSACTION_COLUMNS = '*, owners(user_name)'
+TRANSACTION_COLUMNS_BY_OWNER = '*, owners!inner(user_name)'
+
+# Transactions listed on the capital transactions page
+RECENT_TRANSACTIONS = 50
+
+
+def _with_owner_names(transactions):
+    """Replaces the owner_id and embedded owner of each transaction with the owner's user_name"""
+    for transaction in transactions:
+        owner = transaction.pop('owners', None) or {}
+        owner_id = transaction.pop('owner_id', None)
+
+        # Default to owner_id if no user_name found
+        transaction['owner_name'] = owner.get('user_name') or owner_id
+
+    return transactions
+
 
 class CapitalFunctions:
     def __init__(self):
@@ -26,6 +54,7 @@ class CapitalFunctions:
                 raise ValueError("SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY is not set.")
 
             self.supabase: Client = create_client(url, service_role_key)
+            self.document_store = DocumentStore(self.supabase)
         except Exception as e:
             logger.error(f"Failed to initialize Supabase client: {e}")
             raise
@@ -136,57 +165,36 @@ class CapitalFunctions:
                 logger.warning(f"Owner user_name not found for ID: {owner_id} in business {business_id}")
                 return None
 
-            # Construct filename safely
+            # Get the file extension safely
             filename_parts = transaction_file_obj.filename.split('.')
             if len(filename_parts) < 2:
                 logger.warning("File has no extension")
                 return None
 
             file_extension = filename_parts[-1]
-            filename = f"equity_transactions/business_{business_id}_user_{owner_user_name}.{file_extension}"
-
-            # Read file content safely
-            try:
-                file_bytes = transaction_file_obj.read()
-                if not file_bytes:
-                    logger.warning("File is empty")
-                    return None
-            except Exception as e:
-                logger.error(f"Error reading file: {e}")
-                return None
-
-            # Reset file pointer for potential re-reading
-            try:
-                transaction_file_obj.seek(0)
-            except Exception as e:
-                logger.warning(f"Could not reset file pointer: {e}")
 
             # Get content type safely
             content_type = getattr(transaction_file_obj, 'content_type', 'application/octet-stream')
 
-            # Upload the file
+            # Stream the file through a temporary file and store it under its content hash, so files of
+            # different transactions never overwrite each other and identical files are stored once
             try:
-                upload_response = self.supabase.storage.from_('equity').upload(
-                    filename,
-                    file_bytes,
-                    {"content-type": content_type}
-                )
-
-                # Check for upload errors
-                if hasattr(upload_response, 'error') and upload_response.error:
-                    logger.error(f"Storage upload error: {upload_response.error}")
-                    return None
-
-            except Exception as e:
-                logger.error(f"Error uploading file to storage: {e}")
-                return None
+                with spool_upload(transaction_file_obj, MAX_TRANSACTION_FILE_BYTES) as spooled_path:
+                    if not spooled_path:
+                        logger.warning("File is empty")
+                        return None
+
+                    public_url = self.document_store.store(
+                        'equity', business_id, 'equity_transactions', spooled_path,
+                        content_type, file_extension, original_name=transaction_file_obj.filename
+                    )
 
-            # Get the public URL
-            try:
-                public_url = self.supabase.storage.from_('equity').get_public_url(filename)
+                if not public_url:
+                    logger.error(f"Storage upload failed for transaction file of {owner_user_name}")
                 return public_url
-            except Exception as e:
-                logger.error(f"Error getting public URL: {e}")
+
+            except UploadTooLargeError as e:
+                logger.warning(f"Rejected transaction file: {e}")
                 return None
 
         except Exception as e:
@@ -343,18 +351,18 @@ class CapitalFunctions:
             logger.error(f"Error while recording capital injection: {e}")
             return None
 
-    def capital_transactions(self, range, business_id):
+    def capital_transactions(self, business_id, limit=RECENT_TRANSACTIONS):
         """Returns the recent capital transactions with owner names for a specific business."""
 
         try:
-            # Step 1: Fetch capital transactions for specific business
+            # Owner names are embedded in the same query instead of looked up per transaction
             response = (
                 self.supabase
                 .table('capital_transactions')
-                .select('*')
+                .select(TRANSACTION_COLUMNS)
                 .eq('business_id', business_id)
                 .order('created_at', desc=True)
-                .limit(range)
+                .limit(limit)
                 .execute()
             )
 
@@ -364,33 +372,7 @@ class CapitalFunctions:
                 print("No capital transactions found.")
                 return []
 
-            # Step 2: Replace owner_id with user_name
-            enriched_data = []
-            for transaction in data:
-                owner_id = transaction.get('owner_id')
-
-                owner_response = (
-                    self.supabase
-                    .table('owners')
-                    .select('user_name')
-                    .eq('id', owner_id)
-                    .eq('business_id', business_id)
-                    .limit(1)
-                    .execute()
-                )
-
-                # Default to owner_id if no user_name found
-                user_name = (
-                    owner_response.data[0]['user_name']
-                    if owner_response.data
-                    else owner_id
-                )
-
-                transaction['owner_name'] = user_name
-                transaction.pop('owner_id', None)  # Remove owner_id if you only want name
-                enriched_data.append(transaction)
-
-            return enriched_data
+            return _with_owner_names(data)
 
         except Exception as e:
             print(f'Exception while fetching capital transactions: {e}')
@@ -400,11 +382,11 @@ class CapitalFunctions:
         """Returns capital transactions filtered by any combination of date range, username, and/or amount for a specific business."""
 
         try:
-            # Step 1: Start base query for specific business
+            # Filtering by owner name joins owners as an inner join, so only that owner's transactions come back
             query = (
                 self.supabase
                 .table('capital_transactions')
-                .select('*')
+                .select(TRANSACTION_COLUMNS_BY_OWNER if user_name else TRANSACTION_COLUMNS)
                 .eq('business_id', business_id)
             )
 
@@ -412,52 +394,20 @@ class CapitalFunctions:
                 query = query.gte('created_at', start_date)
             if end_date:
                 query = query.lte('created_at', end_date)
+            if user_name:
+                # Case-insensitive match on the whole name
+                query = query.ilike('owners.user_name', user_name.strip())
+            if amount is not None:
+                query = query.eq('amount', float(amount))
 
-            # Step 2: Execute query
-            response = query.execute()
+            response = query.order('created_at', desc=True).execute()
             transactions = response.data if hasattr(response, 'data') else []
 
             if not transactions:
                 print("No transactions found.")
                 return []
 
-            filtered_data = []
-
-            for txn in transactions:
-                owner_id = txn.get('owner_id')
-
-                match_user = True
-                match_amount = True
-
-                # Step 3: Filter by user_name if provided
-                if user_name:
-                    owner_response = (
-                        self.supabase
-                        .table('owners')
-                        .select('user_name')
-                        .eq('id', owner_id)
-                        .eq('business_id', business_id)
-                        .limit(1)
-                        .execute()
-                    )
-                    if owner_response.data:
-                        db_user_name = owner_response.data[0]['user_name']
-                        match_user = db_user_name.lower() == user_name.lower()
-                    else:
-                        match_user = False
-
-                # Step 4: Filter by amount if provided
-                if amount is not None:
-                    match_amount = float(txn.get('amount', 0)) == float(amount)
-
-                # Step 5: Append if all matches are satisfied
-                if match_user and match_amount:
-                    if user_name:
-                        txn['owner_name'] = user_name
-                        txn.pop('owner_id', None)
-                    filtered_data.append(txn)
-
-            return filtered_data
+            return _with_owner_names(transactions)
 
         except Exception as e:
             print(f"Exception while fetching transactions: {e}")
@@ -1,6 +1,12 @@
-import plotly.express as px
-import pandas as pd
-from supabase import create_client, Client
+from lazy_imports import lazy_import
+px = lazy_import('plotly.express')
+pd = lazy_import('pandas')
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
 from datetime import date, timedelta, datetime, UTC
 from dotenv import load_dotenv
 import os
@@ -0,0 +1,40 @@
+import contextvars
+import logging
+import os
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Shared by every request of the process and replaced after a fork, so requests do not start new threads
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv('DASHBOARD_QUERY_THREADS', '32')),
+                               thread_name_prefix='dashboard-query')
+
+
+def _reset_executor() -> None:
+    """Threads do not survive a fork, so a forked worker gets its own pool"""
+    global _executor
+    _executor = ThreadPoolExecutor(max_workers=int(os.getenv('DASHBOARD_QUERY_THREADS', '32')),
+                                   thread_name_prefix='dashboard-query')
+
+
+os.register_at_fork(after_in_child=_reset_executor)
+
+
+def gather_calls(calls: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+    """
+    Runs independent service calls concurrently from a sync view and returns their results by name.
+
+    Dashboard routes spend nearly all their time waiting on Supabase, one query after another; this lets
+    those waits overlap so the page takes about as long as its slowest query rather than their sum. Each
+    call runs on the shared pool with a copy of the caller's context, so Flask's request context and the
+    query profiler still see the Supabase round trips it makes. The first call to raise fails the whole
+    gather.
+    """
+    if len(calls) < 2:
+        return {name: call() for name, call in calls.items()}
+
+    futures = {name: _executor.submit(contextvars.copy_context().run, call) for name, call in calls.items()}
+    wait(futures.values(), return_when=FIRST_EXCEPTION)
+    return {name: future.result() for name, future in futures.items()}
@@ -1,6 +1,9 @@
-from numpy.ma.extras import average
-from supabase import create_client, Client
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
 import datetime
 import os
 from calendar import monthrange
@@ -8,9 +11,10 @@ from collections import Counter
 from collections import defaultdict
 import logging
 
-import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
+from lazy_imports import lazy_import
+px = lazy_import('plotly.express')
+go = lazy_import('plotly.graph_objects')
+pd = lazy_import('pandas')
 
 
 class CustomerAnalytics:
@@ -0,0 +1,154 @@
+from datetime import datetime, UTC
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from metrics import record_upload
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bytes hashed at a time when hashing a file on disk
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(content: Union[bytes, str]) -> str:
+    """Returns the SHA-256 hex digest of bytes, or of the file at a path read in chunks"""
+    digest = hashlib.sha256()
+
+    if isinstance(content, str):
+        with open(content, 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    else:
+        digest.update(content)
+
+    return digest.hexdigest()
+
+
+class DocumentStore:
+    """
+    Stores uploaded documents in Supabase storage under the SHA-256 of their content. Every stored object is
+    recorded in the document_index table, so identical bytes uploaded again for the same business reuse the
+    existing URL instead of being uploaded a second time, and a retried upload always writes the same object.
+    """
+
+    # Attempts per storage upload before giving up
+    UPLOAD_ATTEMPTS = 3
+    UPLOAD_RETRY_DELAY = 0.5
+
+    def __init__(self, supabase: 'Client'):
+        self.supabase = supabase
+
+    def lookup(self, bucket: str, business_id, sha256: str, variants: List[str]) -> Dict[str, str]:
+        """Returns the URLs already stored for a content hash in a bucket, keyed by variant"""
+        try:
+            response = (
+                self.supabase
+                .table('document_index')
+                .select('variant, url')
+                .eq('business_id', business_id)
+                .eq('bucket', bucket)
+                .eq('sha256', sha256)
+                .in_('variant', variants)
+                .execute()
+            )
+            return {row['variant']: row['url'] for row in (response.data or [])}
+
+        except Exception as e:
+            logger.warning(f"Could not read document index for {bucket} {sha256}: {str(e)}")
+            return {}
+
+    def _upload(self, bucket: str, path: str, content: Union[bytes, str], content_type: str) -> Optional[str]:
+        """
+        Uploads content to a storage bucket, retrying failed attempts, and returns its public URL. Content is
+        either bytes or the path of a file, which is streamed from disk rather than read into memory.
+        """
+
+        # The path is derived from the content, so overwriting an existing object is always safe
+        file_options = {"content-type": content_type, "upsert": "true"}
+
+        for attempt in range(1, self.UPLOAD_ATTEMPTS + 1):
+            started = time.perf_counter()
+            try:
+                if isinstance(content, str):
+                    with open(content, 'rb') as file:
+                        self.supabase.storage.from_(bucket).upload(path, file, dict(file_options))
+                else:
+                    self.supabase.storage.from_(bucket).upload(path, content, dict(file_options))
+
+                record_upload(bucket, time.perf_counter() - started, True)
+                public_url = self.supabase.storage.from_(bucket).get_public_url(path)
+
+                if public_url:
+                    logger.info(f"File uploaded successfully to {bucket}: {path}")
+                    return public_url
+
+                logger.error(f"Failed to get public URL for {bucket} file: {path}")
+                return None
+
+            except Exception as e:
+                record_upload(bucket, time.perf_counter() - started, False)
+                logger.warning(f"Upload attempt {attempt}/{self.UPLOAD_ATTEMPTS} failed for {bucket} file {path}: {str(e)}")
+                if attempt < self.UPLOAD_ATTEMPTS:
+                    time.sleep(self.UPLOAD_RETRY_DELAY * attempt)
+
+        logger.error(f"Giving up on {bucket} file {path} after {self.UPLOAD_ATTEMPTS} attempts")
+        return None
+
+    def _record(self, bucket: str, business_id, sha256: str, variant: str, path: str, url: str,
+                size: int, original_name: Optional[str]) -> None:
+        """Adds a stored object to the document index; an existing entry for the same content is kept"""
+        try:
+            self.supabase.table('document_index').upsert({
+                'business_id': business_id,
+                'bucket': bucket,
+                'sha256': sha256,
+                'variant': variant,
+                'path': path,
+                'url': url,
+                'size_bytes': size,
+                'original_name': original_name,
+                'created_at': datetime.now(UTC).isoformat()
+            }, on_conflict='business_id,bucket,sha256,variant', ignore_duplicates=True).execute()
+
+        except Exception as e:
+            # The object is stored either way; it will just be uploaded again next time
+            logger.warning(f"Could not record {bucket} file {path} in document index: {str(e)}")
+
+    def store(self, bucket: str, business_id, folder: str, content: Union[bytes, str], content_type: str,
+              extension: str, sha256: Optional[str] = None, variant: str = 'original',
+              original_name: Optional[str] = None) -> Optional[str]:
+        """
+        Stores content (bytes or a file path) in a bucket unless the business already stored the same bytes
+        there, and returns its public URL. Derived files such as thumbnails pass the hash of their source
+        together with a variant name, so they can be found again without being regenerated.
+        """
+
+        if not business_id:
+            logger.error("business_id is required to store a document")
+            return None
+
+        sha256 = sha256 or content_hash(content)
+
+        existing = self.lookup(bucket, business_id, sha256, [variant])
+        if variant in existing:
+            logger.info(f"Reusing stored {bucket} file for {sha256} ({variant})")
+            return existing[variant]
+
+        suffix = '' if variant == 'original' else f"_{variant}"
+        path = f"{folder}/business_{business_id}/{sha256}{suffix}.{extension.lower()}"
+
+        url = self._upload(bucket, path, content, content_type)
+        if not url:
+            return None
+
+        size = len(content) if isinstance(content, bytes) else os.path.getsize(content)
+        self._record(bucket, business_id, sha256, variant, path, url, size, original_name)
+        return url
@@ -0,0 +1,274 @@
+import logging
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from email.message import EmailMessage
+from typing import Dict, Iterator, List, Optional
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Where the queue database lives, email_queue.sqlite3 in EMAIL_QUEUE_DIR or instance/email_queue next to
+# this file. It must survive restarts for queued emails to be sent after one. Until an email is sent its
+# body is stored there as written, password-recovery emails included, so the directory and file are
+# created readable by the app's user only.
+DEFAULT_QUEUE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'email_queue')
+
+
+class SmtpConnection:
+    """
+    One SMTP connection kept open between batches and closed after IDLE_TIMEOUT seconds without use. The
+    server, port and credentials come from SMTP_HOST, SMTP_PORT, SMTP_SSL, SENDER_EMAIL and EMAIL_PASSWORD;
+    point SMTP_HOST at fake_smtp.py to try the app without sending real mail.
+    """
+
+    IDLE_TIMEOUT = 60
+
+    def __init__(self):
+        self.host = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+        self.port = int(os.getenv('SMTP_PORT', '465'))
+        self.use_ssl = os.getenv('SMTP_SSL', 'true' if self.port == 465 else 'false').lower() in ('1', 'true')
+        self.sender_email = os.getenv('SENDER_EMAIL')
+        self.password = os.getenv('EMAIL_PASSWORD') or os.getenv('EMAIL_KEY')
+
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _open(self) -> smtplib.SMTP:
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        smtp = smtp_class(self.host, self.port, timeout=30)
+        if self.sender_email and self.password:
+            smtp.login(self.sender_email, self.password)
+        return smtp
+
+    def _connection(self) -> smtplib.SMTP:
+        """Returns the open connection, reopening it if it sat idle too long"""
+        self.close_if_idle()
+
+        if self._smtp is None:
+            self._smtp = self._open()
+        return self._smtp
+
+    def send(self, msg: EmailMessage) -> None:
+        """Sends one message, reconnecting once if the connection turns out to be broken"""
+        try:
+            self._connection().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.close()
+            self._connection().send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self) -> None:
+        if self._smtp is not None and time.monotonic() - self._last_used > self.IDLE_TIMEOUT:
+            self.close()
+
+    def close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+class EmailQueue:
+    """
+    Durable SQLite-backed queue of outgoing emails such as receipts and password emails. Request handlers
+    only record the email and return; a background worker thread sends due emails in batches over one
+    SMTP connection, with retries. Sent emails are deleted and failed ones have their body cleared, so
+    the queue never keeps passwords longer than it takes to deliver them.
+    """
+
+    # Attempts per email, and the delay before the n-th retry is RETRY_DELAY * 2 ** (n - 1) seconds
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 30
+
+    # An email still marked sending after this many seconds is assumed lost with its process and is retried
+    JOB_TIMEOUT = 300
+
+    # Most emails sent per batch, and seconds the worker sleeps when no email is due
+    BATCH_SIZE = 20
+    POLL_INTERVAL = 5
+
+    def __init__(self, queue_dir: Optional[str] = None):
+        self.queue_dir = queue_dir or os.getenv('EMAIL_QUEUE_DIR', DEFAULT_QUEUE_DIR)
+        self.db_path = os.path.join(self.queue_dir, 'email_queue.sqlite3')
+
+        os.makedirs(self.queue_dir, mode=0o700, exist_ok=True)
+
+        self._wakeup = threading.Event()
+        self._worker_lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._smtp = None
+
+        with self._connect() as conn:
+            conn.execute("""
+                create table if not exists emails (
+                    id integer primary key autoincrement,
+                    kind text not null,
+                    recipient text not null,
+                    subject text not null,
+                    body text not null,
+                    status text not null default 'pending',
+                    attempts integer not null default 0,
+                    next_attempt_at real not null,
+                    last_error text,
+                    created_at real not null,
+                    updated_at real not null
+                )
+            """)
+            conn.execute("create index if not exists emails_due_idx on emails (status, next_attempt_at)")
+
+        os.chmod(self.db_path, 0o600)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Opens an autocommit connection to the queue database and closes it afterwards"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.row_factory = sqlite3.Row
+            conn.execute('pragma journal_mode=wal')
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, recipient: str, subject: str, body: str, kind: str = 'email') -> int:
+        """Records an email to be sent by the worker and returns its id"""
+        now = time.time()
+
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "insert into emails (kind, recipient, subject, body, next_attempt_at, created_at, updated_at) "
+                "values (?, ?, ?, ?, ?, ?, ?)", (kind, recipient, subject, body, now, now, now)
+            )
+            email_id = cursor.lastrowid
+
+        logger.info("Queued %s email %s", kind, email_id)
+
+        self.start_worker()
+        self._wakeup.set()
+        return email_id
+
+    def _claim(self) -> List[sqlite3.Row]:
+        """Marks up to BATCH_SIZE due emails as sending and returns them"""
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute('begin immediate')
+            try:
+                emails = conn.execute(
+                    "select * from emails where (status = 'pending' and next_attempt_at <= ?) "
+                    "or (status = 'sending' and updated_at <= ?) order by id limit ?",
+                    (now, now - self.JOB_TIMEOUT, self.BATCH_SIZE)
+                ).fetchall()
+
+                if emails:
+                    conn.execute(
+                        f"update emails set status = 'sending', attempts = attempts + 1, updated_at = ? "
+                        f"where id in ({','.join('?' * len(emails))})", (now, *(email['id'] for email in emails))
+                    )
+                conn.execute('commit')
+            except Exception:
+                conn.execute('rollback')
+                raise
+
+        return emails
+
+    def _sent(self, email_id: int) -> None:
+        with self._connect() as conn:
+            conn.execute("delete from emails where id = ?", (email_id,))
+
+    def _failed(self, email: sqlite3.Row, error: str) -> None:
+        """Schedules a retry, or gives up on the email and clears its body after the last attempt"""
+        attempts = email['attempts'] + 1
+        now = time.time()
+
+        with self._connect() as conn:
+            if attempts >= self.MAX_ATTEMPTS:
+                conn.execute("update emails set status = 'failed', body = '', last_error = ?, updated_at = ? "
+                             "where id = ?", (error, now, email['id']))
+                logger.error("%s email %s failed after %s attempts: %s", email['kind'], email['id'], attempts, error)
+            else:
+                retry_at = now + self.RETRY_DELAY * 2 ** (attempts - 1)
+                conn.execute("update emails set status = 'pending', last_error = ?, next_attempt_at = ?, "
+                             "updated_at = ? where id = ?", (error, retry_at, now, email['id']))
+                logger.warning("%s email %s will be retried: %s", email['kind'], email['id'], error)
+
+    def _message(self, email: sqlite3.Row) -> EmailMessage:
+        msg = EmailMessage()
+        msg['Subject'] = email['subject']
+        msg['From'] = self._smtp.sender_email
+        msg['To'] = email['recipient']
+        msg.set_content(email['body'])
+        return msg
+
+    def run_pending(self) -> int:
+        """Sends every email that is currently due and returns how many were sent"""
+        if self._smtp is None:
+            self._smtp = SmtpConnection()
+
+        sent = 0
+        while True:
+            emails = self._claim()
+            if not emails:
+                self._smtp.close_if_idle()
+                return sent
+
+            batch_sent = 0
+            for email in emails:
+                try:
+                    self._smtp.send(self._message(email))
+                    self._sent(email['id'])
+                    batch_sent += 1
+                except Exception as e:
+                    self._failed(email, str(e))
+
+            sent += batch_sent
+            logger.info("Sent %s out of %s queued emails", batch_sent, len(emails))
+
+    def _work(self) -> None:
+        """Worker thread loop"""
+        while True:
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Email queue worker error: {e}")
+
+            self._wakeup.wait(self.POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def start_worker(self) -> None:
+        """Starts the background worker of this process if it is not already running"""
+        with self._worker_lock:
+            # A worker thread does not survive a fork, so each process starts its own
+            if self._worker and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+
+            self._smtp = None
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._work, name='email-queue-worker', daemon=True)
+            self._worker.start()
+
+    def email_counts(self) -> Dict[str, int]:
+        """Returns the number of queued emails in each status"""
+        with self._connect() as conn:
+            rows = conn.execute("select status, count(*) as total from emails group by status").fetchall()
+        return {row['status']: row['total'] for row in rows}
+
+
+_email_queue = None
+_email_queue_lock = threading.Lock()
+
+
+def get_email_queue() -> EmailQueue:
+    """Returns the process-wide email queue, created on first use"""
+    global _email_queue
+
+    with _email_queue_lock:
+        if _email_queue is None:
+            _email_queue = EmailQueue()
+        return _email_queue
@@ -1,9 +1,15 @@
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
 import datetime
 import os
 import logging
 
-import pandas as pd
+from lazy_imports import lazy_import
+pd = lazy_import('pandas')
 import io
 from flask import send_file, make_response
 
@@ -0,0 +1,127 @@
+"""
+Local stand-in for the SMTP server, for trying receipts and password emails without sending real mail.
+Point the email queue at it with
+
+    SMTP_HOST=127.0.0.1 SMTP_PORT=8925 SMTP_SSL=false
+
+It accepts any login and logs every message it receives, or writes them to --mail-dir as .eml files.
+"""
+import base64
+import logging
+import os
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+from typing import List, Optional
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class FakeSmtp:
+    """Messages received so far"""
+
+    def __init__(self, mail_dir: Optional[str] = None):
+        self.mail_dir = mail_dir
+        self.messages: List[bytes] = []
+        self.connections = 0
+        self._lock = threading.Lock()
+
+        if mail_dir:
+            os.makedirs(mail_dir, exist_ok=True)
+
+    def deliver(self, data: bytes) -> None:
+        with self._lock:
+            self.messages.append(data)
+            number = len(self.messages)
+
+        message = message_from_bytes(data)
+        logger.info("Message %s to %s: %s", number, message['To'], message['Subject'])
+
+        if self.mail_dir:
+            with open(os.path.join(self.mail_dir, f"{time.time():.6f}-{number}.eml"), 'wb') as file:
+                file.write(data)
+
+
+def make_handler(fake: FakeSmtp):
+    class Handler(socketserver.StreamRequestHandler):
+        def _reply(self, line: str) -> None:
+            self.wfile.write(f"{line}\r\n".encode())
+
+        def _read_data(self) -> bytes:
+            lines = []
+            while True:
+                line = self.rfile.readline()
+                if not line or line in (b'.\r\n', b'.\n'):
+                    break
+                # Undo the dot-stuffing of lines that start with a dot
+                lines.append(line[1:] if line.startswith(b'..') else line)
+            return b''.join(lines)
+
+        def handle(self):
+            with fake._lock:
+                fake.connections += 1
+            self._reply('220 fake-smtp ready')
+
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+
+                command = line.decode(errors='replace').strip()
+                verb = command.split(' ', 1)[0].upper()
+
+                if verb == 'EHLO':
+                    self._reply('250-fake-smtp')
+                    self._reply('250 AUTH PLAIN LOGIN')
+                elif verb == 'HELO':
+                    self._reply('250 fake-smtp')
+                elif verb == 'AUTH':
+                    if command.upper().startswith('AUTH LOGIN'):
+                        # Username and password prompts; any credentials are accepted
+                        for prompt in ('VXNlcm5hbWU6', 'UGFzc3dvcmQ6'):
+                            self._reply(f'334 {prompt}')
+                            base64.b64decode(self.rfile.readline().strip() or b'')
+                    self._reply('235 Authentication successful')
+                elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                    self._reply('250 OK')
+                elif verb == 'DATA':
+                    self._reply('354 End data with <CR><LF>.<CR><LF>')
+                    fake.deliver(self._read_data())
+                    self._reply('250 OK: queued')
+                elif verb == 'QUIT':
+                    self._reply('221 Bye')
+                    return
+                else:
+                    self._reply('502 Command not implemented')
+
+    return Handler
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(port: int = 8925, mail_dir: Optional[str] = None) -> socketserver.ThreadingTCPServer:
+    """Starts the fake server on a background thread and returns it; its .fake holds the received messages"""
+    fake = FakeSmtp(mail_dir)
+    server = _Server(('127.0.0.1', port), make_handler(fake))
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, name='fake-smtp', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a local fake SMTP server that keeps what it receives.')
+    parser.add_argument('--port', type=int, default=8925)
+    parser.add_argument('--mail-dir', help='directory to write received messages to as .eml files')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = _Server(('127.0.0.1', args.port), make_handler(FakeSmtp(args.mail_dir)))
+    logger.info("Fake SMTP server listening on 127.0.0.1:%s", args.port)
+    server.serve_forever()
@@ -0,0 +1,135 @@
+"""
+Local stand-in for the TuMeNy payment API and the exchange-rate API, for trying the subscription flow
+without real money. Point the app at it with
+
+    TUMENY_BASE_URL=http://127.0.0.1:8900 EXCHANGE_RATE_URL=http://127.0.0.1:8900/rate
+
+Every payment stays pending for --approve-after seconds and then ends with --outcome. With --webhook-url
+set, the server also sends the callback TuMeNy would send when a payment finishes.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib import request as urllib_request
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class FakeTumeny:
+    """Payments created so far and how they resolve"""
+
+    def __init__(self, approve_after: float = 15, outcome: str = 'success', webhook_url: Optional[str] = None,
+                 conversion_rate: float = 26.5):
+        self.approve_after = approve_after
+        self.outcome = outcome
+        self.webhook_url = webhook_url
+        self.conversion_rate = conversion_rate
+        self.payments: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def create_payment(self, payload: Dict) -> Dict:
+        payment = dict(payload, id=str(uuid.uuid4()), status='PENDING', created=time.time())
+        with self._lock:
+            self.payments[payment['id']] = payment
+
+        if self.webhook_url:
+            threading.Timer(self.approve_after, self._send_callback, args=(payment['id'],)).start()
+        return payment
+
+    def get_payment(self, payment_id: str) -> Optional[Dict]:
+        with self._lock:
+            payment = self.payments.get(payment_id)
+            if payment and time.time() - payment['created'] >= self.approve_after:
+                payment['status'] = self.outcome.upper()
+            return dict(payment) if payment else None
+
+    def _send_callback(self, payment_id: str) -> None:
+        payment = self.get_payment(payment_id)
+        body = json.dumps({'payment': {'id': payment_id, 'status': payment['status']}}).encode()
+        callback = urllib_request.Request(self.webhook_url, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            urllib_request.urlopen(callback, timeout=10).close()
+        except Exception as e:
+            logger.warning("Callback for payment %s failed: %s", payment_id, e)
+
+
+def make_handler(fake: FakeTumeny):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: Dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self) -> bool:
+            return self.headers.get('Authorization', '').startswith('Bearer fake-token-')
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length) or b'{}')
+
+            if self.path == '/api/token':
+                if not self.headers.get('apiKey') or not self.headers.get('apiSecret'):
+                    return self._send(401, {'message': 'Missing API credentials'})
+                expires = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 3600))
+                return self._send(200, {'token': f"fake-token-{uuid.uuid4().hex}", 'expireAt': expires})
+
+            if self.path == '/api/v1/payment':
+                if not self._authorized():
+                    return self._send(401, {'message': 'Unauthorized'})
+                return self._send(200, {'payment': fake.create_payment(payload)})
+
+            self._send(404, {'message': 'Not found'})
+
+        def do_GET(self):
+            if self.path.startswith('/rate'):
+                return self._send(200, {'result': 'success', 'conversion_rate': fake.conversion_rate})
+
+            if self.path.startswith('/api/v1/payment/'):
+                if not self._authorized():
+                    return self._send(401, {'message': 'Unauthorized'})
+                payment = fake.get_payment(self.path.rsplit('/', 1)[-1])
+                if not payment:
+                    return self._send(404, {'message': 'Payment not found'})
+                return self._send(200, {'payment': payment})
+
+            self._send(404, {'message': 'Not found'})
+
+        def log_message(self, format, *args):
+            logger.info("%s %s", self.address_string(), format % args)
+
+    return Handler
+
+
+def serve(port: int = 8900, **options) -> ThreadingHTTPServer:
+    """Starts the fake server on a background thread and returns it; its .fake holds the payments"""
+    fake = FakeTumeny(**options)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(fake))
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, name='fake-tumeny', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a local fake of the TuMeNy payment API.')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--approve-after', type=float, default=15, help='seconds each payment stays pending')
+    parser.add_argument('--outcome', choices=['success', 'failed'], default='success')
+    parser.add_argument('--webhook-url', help="the app's /webhooks/tumeny URL, to receive callbacks")
+    parser.add_argument('--conversion-rate', type=float, default=26.5, help='USD to ZMW rate served at /rate')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(FakeTumeny(
+        args.approve_after, args.outcome, args.webhook_url, args.conversion_rate)))
+    logger.info("Fake TuMeNy listening on http://127.0.0.1:%s", args.port)
+    server.serve_forever()
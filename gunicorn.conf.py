@@ -0,0 +1,80 @@
+"""
+Gunicorn settings for the container. Every setting can be overridden with the environment variable
+named next to it, or on the gunicorn command line.
+
+By default the app is preloaded: the master imports main, the heavy libraries and every template once,
+and the workers forked from it share those pages copy-on-write. Each worker then starts its own
+background threads in post_fork, and Supabase clients are recreated in each worker on first use
+(query_profiler resets them after a fork).
+"""
+import multiprocessing
+import os
+import shutil
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes')
+
+
+bind = f":{os.getenv('PORT', '8080')}"
+
+# gthread serves several requests per worker while they wait on Supabase; gevent needs gevent installed
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '200'))
+
+preload_app = _env_bool('GUNICORN_PRELOAD', True)
+
+# Loan uploads and analytics pages can take a while on large businesses
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers now and then so slow leaks cannot build up; jitter keeps them from restarting together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+# The worker heartbeat file lives in memory; a disk-backed /tmp can stall workers in containers
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+
+if worker_class == 'gevent':
+    # Patch before main and its libraries are imported, which happens in the master when preloading
+    from gevent import monkey
+    monkey.patch_all()
+
+# The container runs behind the platform's load balancer, which appends the client to X-Forwarded-For;
+# trusting that one hop gives rate limits the real client address. Set TRUSTED_PROXY_HOPS=0 when gunicorn
+# is exposed directly, or raise it when more proxies sit in front.
+os.environ.setdefault('TRUSTED_PROXY_HOPS', '1')
+
+# Several workers each write their metrics here and /metrics merges them (see metrics.py). This file is
+# read before the app is preloaded, so files left by a previous run are cleared before anything writes.
+if workers > 1:
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus_multiproc')
+
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def when_ready(server):
+    """Loads the heavy libraries and templates in the master so every worker inherits them"""
+    if preload_app and _env_bool('GUNICORN_WARM_APP', True):
+        import main
+        main.warm_app(main.app)
+
+
+def post_fork(server, worker):
+    """Starts the worker's background threads; connections are opened by the worker itself on first use"""
+    import main
+    main.init_process()
+
+
+def child_exit(server, worker):
+    """Removes the exited worker's live metric files"""
+    import metrics
+    metrics.mark_process_dead(worker.pid)
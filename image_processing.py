@@ -0,0 +1,77 @@
+import io
+import logging
+from typing import Any, Dict, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    logging.warning("Pillow not installed. Collateral photos will be stored at their original size.")
+    Image = None
+    ImageOps = None
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Longest side, in pixels, of the stored collateral photo and of its list-view thumbnail
+WEB_MAX_SIZE = 1600
+THUMBNAIL_MAX_SIZE = 320
+
+WEB_QUALITY = 80
+THUMBNAIL_QUALITY = 70
+
+# Refuse to decode images larger than this many pixels (about a 100 MP photo)
+MAX_IMAGE_PIXELS = 100_000_000
+
+if Image is not None:
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+def image_processing_available() -> bool:
+    """Returns whether Pillow is installed so images can be resized"""
+    return Image is not None
+
+
+def _encode_jpeg(image, max_size: int, quality: int) -> bytes:
+    """Shrinks a copy of the image to fit max_size and returns it as progressive JPEG bytes"""
+    resized = image.copy()
+    resized.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    resized.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def process_collateral_image(file_obj: Any) -> Optional[Dict[str, bytes]]:
+    """
+    Decodes an uploaded collateral photo and returns a web-size JPEG and a thumbnail JPEG, keyed 'web' and
+    'thumbnail'. Camera orientation is applied and metadata is dropped. Returns None when Pillow is not
+    installed or the file is not a readable image, in which case the original file should be stored as is.
+    """
+
+    if not image_processing_available():
+        return None
+
+    try:
+        with Image.open(file_obj) as source:
+            image = ImageOps.exif_transpose(source)
+
+            if image.mode not in ('RGB', 'L'):
+                # Flatten transparency onto white, since JPEG has no alpha channel
+                rgba = image.convert('RGBA')
+                image = Image.new('RGB', rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel('A'))
+
+            return {
+                'web': _encode_jpeg(image, WEB_MAX_SIZE, WEB_QUALITY),
+                'thumbnail': _encode_jpeg(image, THUMBNAIL_MAX_SIZE, THUMBNAIL_QUALITY)
+            }
+
+    except Exception as e:
+        logger.warning(f"Could not process collateral image {getattr(file_obj, 'filename', '')}: {str(e)}")
+        return None
+
+    finally:
+        # Leave the file readable from the start in case the original has to be stored instead
+        if hasattr(file_obj, 'seek'):
+            file_obj.seek(0)
@@ -0,0 +1,114 @@
+import importlib
+import logging
+import sys
+import threading
+import time
+import types
+from typing import Dict
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds each lazily imported module took to load on first use
+_load_times: Dict[str, float] = {}
+_lock = threading.RLock()
+
+# One placeholder per module name, shared by every module that lazily imports it
+_lazy_modules: Dict[str, 'LazyModule'] = {}
+
+
+class LazyModule(types.ModuleType):
+    """
+    Placeholder for a module that is imported the first time one of its attributes is used. The import
+    happens under a lock, so threads racing for the first use all wait for one complete import.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module = None
+
+    def _load(self) -> types.ModuleType:
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self.__name__)
+                    _load_times[self.__name__] = time.perf_counter() - started
+                    logger.info("Lazily imported %s in %.0f ms", self.__name__, _load_times[self.__name__] * 1000)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name: str):
+    """
+    Returns a module that is only imported when one of its attributes is first used, so heavy libraries
+    such as pandas and plotly stay out of worker boot. Use it as a drop-in for a module-level import:
+    pd = lazy_import('pandas'). A module that is already imported is returned as it is.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    with _lock:
+        if name not in _lazy_modules:
+            _lazy_modules[name] = LazyModule(name)
+        return _lazy_modules[name]
+
+
+def preload_lazy_modules() -> None:
+    """Imports every lazily imported module now, e.g. before timing code or to share them across forks"""
+    for module in list(_lazy_modules.values()):
+        module._load()
+
+
+def lazy_import_times() -> Dict[str, float]:
+    """Returns the seconds spent loading each lazily imported module that has been used so far"""
+    return dict(_load_times)
+
+
+def import_profile(module: str = 'main', top: int = 25):
+    """
+    Imports a module in a fresh interpreter with -X importtime and returns its total import time in
+    seconds together with the slowest top-level modules and packages as (name, seconds) pairs. Times are
+    cumulative, so a package includes the packages it imported first (pandas includes numpy).
+    """
+    import subprocess
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    packages: Dict[str, float] = {}
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        seconds = int(cumulative) / 1_000_000
+
+        if name == module:
+            total = seconds
+        elif '.' not in name and not name.startswith('_'):
+            packages[name] = max(packages.get(name, 0), seconds)
+
+    return total, sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Report where import time goes when a module is loaded.')
+    parser.add_argument('module', nargs='?', default='main')
+    parser.add_argument('--top', type=int, default=25)
+    args = parser.parse_args()
+
+    total, packages = import_profile(args.module, args.top)
+    print(f"import {args.module}: {total:.2f}s")
+    for package, seconds in packages:
+        print(f"  {package:<30} {seconds * 1000:>8.0f} ms")
@@ -1,13 +1,24 @@
-from supabase import create_client, Client
+from query_profiler import create_client
+from metrics import timed
 from datetime import date, timedelta, datetime, UTC, timezone
-from dotenv import load_dotenv
 import os
 import json
 import logging
-from typing import Optional, List, Dict, Any, Union
-import pandas as pd
+from typing import Optional, List, Dict, Any, Union, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from concurrent.futures import ThreadPoolExecutor
+from lazy_imports import lazy_import
+pd = lazy_import('pandas')
 import io
 from flask import send_file, make_response
+from borrower_risk import BorrowerRisk
+from image_processing import process_collateral_image
+from document_store import DocumentStore, content_hash
+from upload_queue import get_upload_queue
+from upload_streams import spool_upload, UploadTooLargeError, MAX_CONTRACT_BYTES, MAX_COLLATERAL_BYTES
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -22,11 +33,11 @@ class LoansError(Exception):
 class Loans:
     """Contains metrics for the overview dashboard"""
 
+    # Storage uploads run in parallel per loan submission
+    UPLOAD_CONCURRENCY = 10
+
     def __init__(self):
         try:
-            # Load environment variables
-            load_dotenv()
-
             url = os.getenv("SUPABASE_URL")
             service_role_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
@@ -34,6 +45,8 @@ class Loans:
                 raise LoansError("SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY is not set in environment variables.")
 
             self.supabase: Client = create_client(url, service_role_key)
+            self.document_store = DocumentStore(self.supabase)
+            self.risk_tool = BorrowerRisk()
 
             # Test connection
             self._test_connection()
@@ -99,6 +112,7 @@ class Loans:
             logger.error(f"Error fetching borrower identity for id {borrower_id}, business_id {business_id}: {str(e)}")
             return {'name': 'Unknown', 'nrc': 'Unknown'}
 
+    @timed()
     def old_borrower_loan(self, borrower_id, business_id, amount: float,
                           transaction_costs: float,
                           interest_rate: float, duration_days: int, due_date: str,
@@ -107,114 +121,51 @@ class Loans:
                           loan_reason: Optional[str] = None) -> Optional[int]:
         """Registers a loan for an already existing borrower in the database for a specific business."""
 
-        print(f"=== old_borrower_loan METHOD DEBUG ===")
-        print(f"Received parameters:")
-        print(f"  borrower_id: {borrower_id} (type: {type(borrower_id)})")
-        print(f"  business_id: {business_id} (type: {type(business_id)})")
-        print(f"  amount: {amount} (type: {type(amount)})")
-        print(f"  transaction_costs: {transaction_costs} (type: {type(transaction_costs)})")
-        print(f"  interest_rate: {interest_rate} (type: {type(interest_rate)})")
-        print(f"  duration_days: {duration_days} (type: {type(duration_days)})")
-        print(f"  due_date: {due_date} (type: {type(due_date)})")
-        print(f"  loan_reason: {loan_reason}")
-        print(f"  contract_file_obj: {contract_file_obj}")
-        print(f"  collateral_files_list: {collateral_files_list}")
-
-        # Input validation with detailed logging
-        print("=== INPUT VALIDATION ===")
-
+        logger.debug("old_borrower_loan called", extra={
+            'borrower_id': borrower_id,
+            'business_id': business_id,
+            'amount': amount,
+            'interest_rate': interest_rate,
+            'duration_days': duration_days,
+            'due_date': due_date,
+            'loan_reason': loan_reason,
+            'collateral_files': len(collateral_files_list or [])
+        })
+
+        # Input validation
         if not borrower_id:
-            print("VALIDATION FAILED: borrower_id is required")
             logger.error("borrower_id is required")
             return None
-        print(f"✓ borrower_id validation passed: {borrower_id}")
 
         if not business_id:
-            print("VALIDATION FAILED: business_id is required")
             logger.error("business_id is required")
             return None
-        print(f"✓ business_id validation passed: {business_id}")
 
         if not isinstance(amount, (int, float)) or amount <= 0:
-            print(f"VALIDATION FAILED: Invalid amount: {amount} (type: {type(amount)})")
-            logger.error(f"Invalid amount: {amount}")
+            logger.error("Invalid amount: %r", amount)
             return None
-        print(f"✓ amount validation passed: {amount}")
 
         if not isinstance(interest_rate, (int, float)) or interest_rate < 0:
-            print(f"VALIDATION FAILED: Invalid interest_rate: {interest_rate} (type: {type(interest_rate)})")
-            logger.error(f"Invalid interest_rate: {interest_rate}")
+            logger.error("Invalid interest_rate: %r", interest_rate)
             return None
-        print(f"✓ interest_rate validation passed: {interest_rate}")
 
         if not isinstance(duration_days, int) or duration_days <= 0:
-            print(f"VALIDATION FAILED: Invalid duration_days: {duration_days} (type: {type(duration_days)})")
-            logger.error(f"Invalid duration_days: {duration_days}")
+            logger.error("Invalid duration_days: %r", duration_days)
             return None
-        print(f"✓ duration_days validation passed: {duration_days}")
-
-        print("All input validations passed!")
 
         # Verify borrower exists for this business
-        print("=== BORROWER VERIFICATION ===")
         try:
             borrower_check = self.borrower_identity(borrower_id, business_id)
-            print(f"Borrower check result: {borrower_check}")
 
             if borrower_check['name'] == 'Unknown':
-                print(
-                    f"BORROWER VERIFICATION FAILED: Borrower with id {borrower_id} does not exist for business_id {business_id}")
-                logger.error(f"Borrower with id {borrower_id} does not exist for business_id {business_id}")
+                logger.error("Borrower with id %s does not exist for business_id %s", borrower_id, business_id)
                 return None
-            print(f"✓ Borrower verification passed: {borrower_check['name']}")
         except Exception as borrower_error:
-            print(f"BORROWER VERIFICATION ERROR: {borrower_error}")
-            logger.error(f"Error verifying borrower: {borrower_error}")
+            logger.error("Error verifying borrower %s: %s", borrower_id, borrower_error)
             return None
 
-        contract_file_url = None
-        collateral_file_urls = []
-
         try:
-            # Upload contract file if provided
-            print("=== FILE UPLOAD SECTION ===")
-            if contract_file_obj:
-                print(f"Uploading contract file: {getattr(contract_file_obj, 'filename', 'unknown')}")
-                try:
-                    contract_file_url = self.upload_contract_file(contract_file_obj, borrower_id)
-                    if contract_file_url:
-                        print(f"✓ Contract file uploaded successfully: {contract_file_url}")
-                        logger.info(f"Contract file uploaded: {contract_file_url}")
-                    else:
-                        print("⚠ Contract file upload failed")
-                        logger.warning("Contract file upload failed")
-                except Exception as contract_error:
-                    print(f"CONTRACT UPLOAD ERROR: {contract_error}")
-                    logger.error(f"Contract upload error: {contract_error}")
-                    # Don't return None here - continue with loan creation
-            else:
-                print("No contract file provided")
-
-            # Upload collateral files if provided
-            if collateral_files_list and len(collateral_files_list) > 0:
-                print(f"Uploading {len(collateral_files_list)} collateral files")
-                try:
-                    collateral_file_urls = self.upload_collateral_files_list(collateral_files_list, borrower_id)
-                    if collateral_file_urls:
-                        print(f"✓ Collateral files uploaded successfully: {len(collateral_file_urls)} files")
-                        logger.info(f"Collateral files uploaded: {len(collateral_file_urls)} files")
-                    else:
-                        print("⚠ Collateral files upload failed")
-                        logger.warning("Collateral files upload failed")
-                except Exception as collateral_error:
-                    print(f"COLLATERAL UPLOAD ERROR: {collateral_error}")
-                    logger.error(f"Collateral upload error: {collateral_error}")
-                    # Don't return None here - continue with loan creation
-            else:
-                print("No collateral files provided")
-
             # Prepare loan data
-            print("=== PREPARING LOAN DATA ===")
             data = {
                 'borrower_id': borrower_id,
                 'business_id': business_id,
@@ -227,250 +178,280 @@ class Loans:
                 'loan_reason': loan_reason if loan_reason else 'Not specified'
             }
 
-            print(f"Loan data prepared: {data}")
-
             # Insert loan data
-            print("=== DATABASE INSERTION ===")
-            logger.info(f"Inserting loan data for borrower {borrower_id} in business {business_id}")
-
             try:
                 response = self.supabase.table('loans').insert(data).execute()
-                print(f"Database response: {response}")
-                print(f"Response has data attribute: {hasattr(response, 'data')}")
-                if hasattr(response, 'data'):
-                    print(f"Response data: {response.data}")
-                    print(f"Response data type: {type(response.data)}")
-                    print(f"Response data length: {len(response.data) if response.data else 'None'}")
             except Exception as db_error:
-                print(f"DATABASE INSERTION ERROR: {db_error}")
-                logger.error(f"Database insertion error: {db_error}")
+                logger.error("Database insertion error for borrower %s: %s", borrower_id, db_error)
                 return None
 
             # Check response
             if not hasattr(response, 'data') or not response.data:
-                print("LOAN INSERTION FAILED: No data returned from database")
                 logger.error("Loan insertion failed - no data returned")
                 return None
 
             if len(response.data) == 0 or 'id' not in response.data[0]:
-                print("LOAN INSERTION FAILED: No ID returned from database")
-                print(f"Response data content: {response.data}")
                 logger.error("Loan insertion failed - no ID returned")
                 return None
 
             loan_id = response.data[0]['id']
-            print(f"✓ LOAN CREATED SUCCESSFULLY with ID: {loan_id}")
-            logger.info(f"Loan created successfully with ID: {loan_id}")
-
-            # Insert file data if we have either contract or collateral files
-            if contract_file_url or collateral_file_urls:
-                print("=== INSERTING FILE DATA ===")
-                file_data = {
-                    'loan_id': loan_id,
-                    'business_id': business_id,
-                    'docs': [contract_file_url] if contract_file_url else [],
-                    'photos': collateral_file_urls if collateral_file_urls else []
-                }
+            logger.info("Loan %s created for borrower %s in business %s", loan_id, borrower_id, business_id)
 
-                try:
-                    print(f"File data to insert: {file_data}")
-                    logger.info(f"Inserting file data for loan {loan_id}")
-                    file_upload_response = self.supabase.table('files').insert(file_data).execute()
+            # A new loan changes the borrower's exposure, so their stored risk is recomputed
+            self.risk_tool.refresh_borrowers([borrower_id], business_id)
 
-                    if hasattr(file_upload_response, 'data') and file_upload_response.data:
-                        print("✓ File data inserted successfully")
-                        logger.info("File data inserted successfully")
-                    else:
-                        print("⚠ File data insertion may have failed")
-                        logger.warning("File data insertion may have failed")
+            # Upload the contract and collateral files after the loan exists, in the background when possible
+            if contract_file_obj or collateral_files_list:
+                nrc_number = borrower_check['nrc'] if borrower_check['nrc'] != 'Unknown' else None
 
-                except Exception as file_error:
-                    print(f"FILE DATA INSERTION ERROR: {file_error}")
-                    logger.error(f"Error inserting file data: {str(file_error)}")
+                try:
+                    job_id = get_upload_queue().enqueue_loan_files(
+                        loan_id, borrower_id, business_id,
+                        contract_file_obj=contract_file_obj,
+                        collateral_files_list=collateral_files_list,
+                        nrc_number=nrc_number
+                    )
+                    logger.debug("Loan %s files queued for upload as job %s", loan_id, job_id)
+
+                except Exception as queue_error:
+                    # Without a usable queue the files are uploaded before responding, as before
+                    logger.warning("Upload queue unavailable, uploading loan %s files now: %s", loan_id, queue_error)
+                    contract_file_url, collateral_file_urls, thumbnail_urls = self.upload_loan_files(
+                        borrower_id, business_id,
+                        contract_file_obj=contract_file_obj,
+                        collateral_files_list=collateral_files_list,
+                        nrc_number=nrc_number
+                    )
                     # Don't return None here - loan was created successfully
+                    self.save_loan_files(loan_id, business_id, contract_file_url, collateral_file_urls, thumbnail_urls)
 
-            print(f"=== FINAL RESULT: RETURNING LOAN_ID {loan_id} ===")
             return loan_id
 
-        except Exception as e:
-            print(f"CRITICAL ERROR in old_borrower_loan: {e}")
-            logger.error(f"Error creating loan for borrower {borrower_id} in business {business_id}: {str(e)}")
-            import traceback
-            print(f"Full traceback: {traceback.format_exc()}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+        except Exception:
+            logger.exception("Error creating loan for borrower %s in business %s", borrower_id, business_id)
             return None
 
-    def upload_contract_file(self, contract_file_obj: Any, borrower_id,
-                             business_id) -> Optional[str]:
-        """Uploads the contract file to the Supabase bucket and returns the file URL for a specific business."""
+    def save_loan_files(self, loan_id, business_id, contract_file_url: Optional[str],
+                        collateral_file_urls: List[str], thumbnail_urls: List[str]) -> bool:
+        """Inserts the files row of a loan for a specific business; returns True when there was nothing to save"""
 
-        if not contract_file_obj or not hasattr(contract_file_obj, 'filename'):
-            logger.error("Invalid contract file object")
-            return None
+        # Insert file data if we have either contract or collateral files
+        if not contract_file_url and not collateral_file_urls:
+            return True
 
-        if not contract_file_obj.filename:
-            logger.error("Contract file has no filename")
-            return None
-
-        if not business_id:
-            logger.error("business_id is required for contract file upload")
-            return None
+        file_data = {
+            'loan_id': loan_id,
+            'business_id': business_id,
+            'docs': [contract_file_url] if contract_file_url else [],
+            'photos': collateral_file_urls if collateral_file_urls else [],
+            'thumbnails': thumbnail_urls if thumbnail_urls else []
+        }
 
         try:
-            # Get borrower NRC for the specific business
-            nrc_response = (
-                self.supabase
-                .table('borrowers')
-                .select('nrc_number')
-                .eq('id', borrower_id)
-                .eq('business_id', business_id)
-                .execute()
-            )
-
-            if not hasattr(nrc_response, 'data') or not nrc_response.data:
-                logger.error(f"Borrower with id {borrower_id} not found for business {business_id} for contract upload")
-                return None
-
-            nrc_number = nrc_response.data[0].get('nrc_number')
-            if not nrc_number:
-                logger.error(f"No NRC number found for borrower {borrower_id} in business {business_id}")
-                return None
-
-            # Construct filename with business_id for better organization
-            file_parts = contract_file_obj.filename.split('.')
-            file_extension = file_parts[-1] if len(file_parts) > 1 else 'pdf'
-            filename = f"loan_contract/business_{business_id}/nrc_{nrc_number}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_extension}"
+            logger.info(f"Inserting file data for loan {loan_id}")
+            file_upload_response = self.supabase.table('files').insert(file_data).execute()
+
+            if hasattr(file_upload_response, 'data') and file_upload_response.data:
+                logger.info("File data inserted successfully")
+                return True
+
+            logger.warning("File data insertion may have failed")
+            return False
+
+        except Exception as file_error:
+            logger.error(f"Error inserting file data for loan {loan_id}: {str(file_error)}")
+            return False
+
+    def _borrower_nrc(self, borrower_id, business_id) -> Optional[str]:
+        """Returns the NRC number of a borrower of the business, or None if the borrower is unknown"""
+        nrc_response = (
+            self.supabase
+            .table('borrowers')
+            .select('nrc_number')
+            .eq('id', borrower_id)
+            .eq('business_id', business_id)
+            .execute()
+        )
+
+        if not hasattr(nrc_response, 'data') or not nrc_response.data:
+            logger.error(f"Borrower with id {borrower_id} not found for business {business_id} for file upload")
+            return None
 
-            # Read file content
-            file_bytes = contract_file_obj.read()
-            if not file_bytes:
-                logger.error("Contract file is empty")
-                return None
+        nrc_number = nrc_response.data[0].get('nrc_number')
+        if not nrc_number:
+            logger.error(f"No NRC number found for borrower {borrower_id} in business {business_id}")
+            return None
 
-            # Reset file pointer for potential re-reading
-            if hasattr(contract_file_obj, 'seek'):
-                contract_file_obj.seek(0)
+        return nrc_number
 
-            # Upload the file
-            content_type = getattr(contract_file_obj, 'content_type', 'application/octet-stream')
+    def _file_extension(self, file_obj: Any, default: str) -> str:
+        """Returns the extension of an uploaded file's name, or the default when it has none"""
+        file_parts = file_obj.filename.split('.')
+        return file_parts[-1] if len(file_parts) > 1 else default
 
-            upload_response = self.supabase.storage.from_('contracts').upload(
-                filename,
-                file_bytes,
-                {"content-type": content_type}
-            )
+    def _upload_file(self, bucket: str, folder: str, file_obj: Any, business_id, max_bytes: int,
+                     default_extension: str) -> Optional[str]:
+        """Streams one uploaded file to the document store unchanged and returns its public URL"""
 
-            # Get the public URL
-            public_url = self.supabase.storage.from_('contracts').get_public_url(filename)
+        content_type = getattr(file_obj, 'content_type', None) or 'application/octet-stream'
 
-            if public_url:
-                logger.info(f"Contract file uploaded successfully for business {business_id}: {filename}")
-                return public_url
-            else:
-                logger.error("Failed to get public URL for contract file")
-                return None
+        try:
+            with spool_upload(file_obj, max_bytes) as path:
+                if not path:
+                    logger.warning(f"File {file_obj.filename} is empty, skipping")
+                    return None
+
+                return self.document_store.store(
+                    bucket, business_id, folder, path, content_type,
+                    self._file_extension(file_obj, default_extension), original_name=file_obj.filename
+                )
 
-        except Exception as e:
-            logger.error(
-                f"Error uploading contract file for borrower {borrower_id} in business {business_id}: {str(e)}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
+        except UploadTooLargeError as e:
+            logger.error(f"Rejected {bucket} file {file_obj.filename}: {str(e)}")
             return None
 
-    def upload_collateral_files_list(self, collateral_files_list: List[Any], borrower_id,
-                                     business_id) -> List[str]:
-        """Uploads collateral files to the Supabase bucket and returns list of file URLs for a specific business."""
+    def _upload_collateral(self, file_obj: Any, business_id) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Stores a collateral photo as a web-size JPEG plus a thumbnail and returns both URLs. Photos the business
+        already uploaded are neither processed nor uploaded again. Files that cannot be processed as images,
+        such as PDFs, are stored unchanged and get no thumbnail.
+        """
 
-        if not collateral_files_list:
-            logger.info("No collateral files provided")
-            return []
+        folder = 'collateral'
+
+        try:
+            with spool_upload(file_obj, MAX_COLLATERAL_BYTES) as path:
+                if not path:
+                    logger.warning(f"Collateral file {file_obj.filename} is empty, skipping")
+                    return None, None
+
+                sha256 = content_hash(path)
+                stored = self.document_store.lookup('collaterals', business_id, sha256, ['web', 'thumbnail', 'original'])
+
+                if 'web' in stored:
+                    return stored['web'], stored.get('thumbnail', stored['web'])
+                if 'original' in stored:
+                    return stored['original'], None
+
+                images = process_collateral_image(path)
+
+                if not images:
+                    content_type = getattr(file_obj, 'content_type', None) or 'application/octet-stream'
+                    photo_url = self.document_store.store(
+                        'collaterals', business_id, folder, path, content_type,
+                        self._file_extension(file_obj, 'jpg'), sha256=sha256, original_name=file_obj.filename
+                    )
+                    return photo_url, None
+
+        except UploadTooLargeError as e:
+            logger.error(f"Rejected collateral file {file_obj.filename}: {str(e)}")
+            return None, None
+
+        photo_url = self.document_store.store(
+            'collaterals', business_id, folder, images['web'], 'image/jpeg', 'jpg',
+            sha256=sha256, variant='web', original_name=file_obj.filename
+        )
+        if not photo_url:
+            return None, None
+
+        thumbnail_url = self.document_store.store(
+            'collaterals', business_id, folder, images['thumbnail'], 'image/jpeg', 'jpg',
+            sha256=sha256, variant='thumbnail', original_name=file_obj.filename
+        )
+        return photo_url, thumbnail_url or photo_url
+
+    def upload_loan_files(self, borrower_id, business_id, contract_file_obj: Optional[Any] = None,
+                          collateral_files_list: Optional[List[Any]] = None,
+                          nrc_number: Optional[str] = None) -> Tuple[Optional[str], List[str], List[str]]:
+        """
+        Uploads a loan's contract and collateral files in parallel for a specific business and returns the
+        contract URL, the collateral photo URLs and the matching thumbnail URLs, in upload order. Nothing is
+        uploaded unless the borrower belongs to the business, which is checked through the borrower's NRC
+        unless it is passed in.
+        """
 
         if not business_id:
-            logger.error("business_id is required for collateral files upload")
-            return []
+            logger.error("business_id is required for loan file uploads")
+            return None, [], []
 
-        try:
-            # Get borrower NRC for the specific business
-            nrc_response = (
-                self.supabase
-                .table('borrowers')
-                .select('nrc_number')
-                .eq('id', borrower_id)
-                .eq('business_id', business_id)
-                .execute()
-            )
+        has_contract = bool(contract_file_obj and getattr(contract_file_obj, 'filename', None))
+        collateral_files = []
+        for index, file_obj in enumerate(collateral_files_list or []):
+            # Skip invalid files
+            if not file_obj or not hasattr(file_obj, 'filename') or not file_obj.filename:
+                logger.warning(f"Skipping invalid collateral file at index {index}")
+                continue
+            collateral_files.append((index, file_obj))
 
-            if not hasattr(nrc_response, 'data') or not nrc_response.data:
-                logger.error(
-                    f"Borrower with id {borrower_id} not found for business {business_id} for collateral upload")
-                return []
+        if not has_contract and not collateral_files:
+            return None, [], []
 
-            nrc_number = nrc_response.data[0].get('nrc_number')
+        try:
+            nrc_number = nrc_number or self._borrower_nrc(borrower_id, business_id)
             if not nrc_number:
-                logger.error(f"No NRC number found for borrower {borrower_id} in business {business_id}")
-                return []
+                return None, [], []
 
-            uploaded_urls = []
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            uploads = []
 
-            # Upload each collateral file
-            for index, file_obj in enumerate(collateral_files_list):
-                try:
-                    # Skip invalid files
-                    if not file_obj or not hasattr(file_obj, 'filename') or not file_obj.filename:
-                        logger.warning(f"Skipping invalid collateral file at index {index}")
-                        continue
-
-                    # Construct filename with business_id for better organization
-                    file_parts = file_obj.filename.split('.')
-                    file_extension = file_parts[-1] if len(file_parts) > 1 else 'jpg'
-                    filename = f"collateral/business_{business_id}/nrc_{nrc_number}_collateral_{index + 1}_{timestamp}.{file_extension}"
-
-                    # Read file content
-                    file_bytes = file_obj.read()
-                    if not file_bytes:
-                        logger.warning(f"Collateral file at index {index} is empty, skipping")
-                        continue
-
-                    # Reset file pointer for potential re-reading
-                    if hasattr(file_obj, 'seek'):
-                        file_obj.seek(0)
-
-                    logger.info(f"Uploading collateral file for business {business_id}: {filename}")
-
-                    content_type = getattr(file_obj, 'content_type', 'application/octet-stream')
-
-                    upload_response = self.supabase.storage.from_('collaterals').upload(
-                        filename,
-                        file_bytes,
-                        {"content-type": content_type}
-                    )
+            # Files are stored under their content hash, so identical re-uploads reuse the stored copy
+            if has_contract:
+                uploads.append(lambda: self._upload_file('contracts', 'loan_contract', contract_file_obj, business_id,
+                                                         MAX_CONTRACT_BYTES, 'pdf'))
 
-                    # Get the public URL
-                    public_url = self.supabase.storage.from_('collaterals').get_public_url(filename)
+            for _, file_obj in collateral_files:
+                uploads.append(lambda file_obj=file_obj: self._upload_collateral(file_obj, business_id))
 
-                    if public_url:
-                        uploaded_urls.append(public_url)
-                        logger.info(f"Collateral file uploaded successfully: {filename}")
-                    else:
-                        logger.error(f"Failed to get public URL for collateral file: {filename}")
+            # Collateral photos are resized on the worker threads too, alongside the other uploads
+            workers = min(self.UPLOAD_CONCURRENCY, len(uploads))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda upload: upload(), uploads))
 
-                except Exception as file_error:
-                    logger.error(
-                        f"Error uploading collateral file at index {index} for business {business_id}: {str(file_error)}")
-                    continue
+            contract_file_url = results.pop(0) if has_contract else None
+            collateral_results = [(photo_url, thumbnail_url) for photo_url, thumbnail_url in results if photo_url]
+            collateral_file_urls = [photo_url for photo_url, _ in collateral_results]
+            thumbnail_urls = [thumbnail_url for _, thumbnail_url in collateral_results]
 
             logger.info(
-                f"Successfully uploaded {len(uploaded_urls)} out of {len(collateral_files_list)} collateral files for business {business_id}")
-            return uploaded_urls
+                f"Uploaded {'a' if contract_file_url else 'no'} contract and {len(collateral_file_urls)} out of "
+                f"{len(collateral_files)} collateral files for business {business_id}")
+            return contract_file_url, collateral_file_urls, thumbnail_urls
 
         except Exception as e:
-            logger.error(
-                f"Error uploading collateral files for borrower {borrower_id} in business {business_id}: {str(e)}")
+            logger.error(f"Error uploading loan files for borrower {borrower_id} in business {business_id}: {str(e)}")
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
+            return None, [], []
+
+    def upload_contract_file(self, contract_file_obj: Any, borrower_id,
+                             business_id, nrc_number: Optional[str] = None) -> Optional[str]:
+        """Uploads the contract file to the Supabase bucket and returns the file URL for a specific business."""
+
+        if not contract_file_obj or not hasattr(contract_file_obj, 'filename'):
+            logger.error("Invalid contract file object")
+            return None
+
+        if not contract_file_obj.filename:
+            logger.error("Contract file has no filename")
+            return None
+
+        contract_file_url, _, _ = self.upload_loan_files(
+            borrower_id, business_id, contract_file_obj=contract_file_obj, nrc_number=nrc_number
+        )
+        return contract_file_url
+
+    def upload_collateral_files_list(self, collateral_files_list: List[Any], borrower_id,
+                                     business_id, nrc_number: Optional[str] = None) -> List[str]:
+        """Uploads collateral files to the Supabase bucket and returns list of file URLs for a specific business."""
+
+        if not collateral_files_list:
+            logger.info("No collateral files provided")
             return []
 
+        _, collateral_file_urls, _ = self.upload_loan_files(
+            borrower_id, business_id, collateral_files_list=collateral_files_list, nrc_number=nrc_number
+        )
+        return collateral_file_urls
+
     def update_overdue_loans(self, business_id) -> int:
         """Updates overdue loans for a specific business and returns the count of updated loans"""
 
@@ -486,7 +467,7 @@ class Loans:
             response = (
                 self.supabase
                 .table('loans')
-                .select('id, due_date')
+                .select('id, borrower_id, due_date')
                 .eq('status', 'Active')
                 .eq('business_id', business_id)
                 .execute()
@@ -506,6 +487,7 @@ class Loans:
             logger.info(f"Found {len(loans)} active loans to check for business {business_id}")
 
             overdue_ids = []
+            overdue_borrower_ids = []
             invalid_dates_count = 0
 
             for loan in loans:
@@ -531,6 +513,7 @@ class Loans:
                     # Check if overdue
                     if due_date < now:
                         overdue_ids.append(loan_id)
+                        overdue_borrower_ids.append(loan.get('borrower_id'))
                         logger.debug(f"Loan {loan_id} is overdue (due: {due_date}) for business {business_id}")
 
                 except ValueError as date_error:
@@ -560,6 +543,13 @@ class Loans:
                     updated_count = len(update_response.data) if update_response.data else len(overdue_ids)
                     logger.info(
                         f"Successfully updated {updated_count} loans to overdue status for business {business_id}")
+
+                    # Borrowers with newly overdue loans move risk band
+                    try:
+                        self.risk_tool.refresh_borrowers(overdue_borrower_ids, business_id)
+                    except Exception as risk_error:
+                        logger.error(f"Error refreshing borrower risk for business {business_id}: {risk_error}")
+
                     return updated_count
                 else:
                     logger.error(f"Update response indicates failure for business {business_id}")
@@ -648,6 +638,7 @@ class Loans:
                 'error': error_msg
             }
 
+    @timed()
     def filtered_loans(self, business_id, from_date=None, to_date=None, loan_type='All Loans'):
         """Returns loan information according to the filters for a specific business"""
 
@@ -712,7 +703,7 @@ class Loans:
                     file_info = (
                         self.supabase
                         .table('files')
-                        .select('docs', 'photos')
+                        .select('docs', 'photos', 'thumbnails')
                         .eq('loan_id', loan['id'])
                         .eq('business_id', business_id)
                         .limit(1)
@@ -726,6 +717,10 @@ class Loans:
 
                     collateral_photos = file_data.get('photos', []) if isinstance(file_data.get('photos'), list) else []
 
+                    # Loans uploaded before thumbnails existed fall back to the full photos
+                    thumbnails = file_data.get('thumbnails') if isinstance(file_data.get('thumbnails'), list) else []
+                    collateral_thumbnails = thumbnails if len(thumbnails) == len(collateral_photos) else collateral_photos
+
                     filtered_loans.append({
                         'name': borrower_name,
                         'nrc_number': nrc_number,
@@ -734,7 +729,8 @@ class Loans:
                         'issue_date': loan['created_at'],
                         'due_date': loan['due_date'],
                         'contract': contract,
-                        'collateral_photos': collateral_photos
+                        'collateral_photos': collateral_photos,
+                        'collateral_thumbnails': collateral_thumbnails
                     })
                 except Exception as e:
                     logger.error(f"Error processing loan data for business {business_id}: {e}")
@@ -845,7 +841,7 @@ class Loans:
                     file_info = (
                         self.supabase
                         .table('files')
-                        .select('docs', 'photos')
+                        .select('docs', 'photos', 'thumbnails')
                         .eq('loan_id', loan['id'])
                         .eq('business_id', business_id)
                         .limit(1)
@@ -862,6 +858,10 @@ class Loans:
 
                     collateral_photos = file_data.get('photos', []) if isinstance(file_data.get('photos'), list) else []
 
+                    # Loans uploaded before thumbnails existed fall back to the full photos
+                    thumbnails = file_data.get('thumbnails') if isinstance(file_data.get('thumbnails'), list) else []
+                    collateral_thumbnails = thumbnails if len(thumbnails) == len(collateral_photos) else collateral_photos
+
                     # Determine loan status based on due date
                     from datetime import datetime
                     current_date = datetime.now()
@@ -882,7 +882,8 @@ class Loans:
                         'issue_date': loan['created_at'],
                         'due_date': loan['due_date'],
                         'contract': contract,
-                        'collateral_photos': collateral_photos
+                        'collateral_photos': collateral_photos,
+                        'collateral_thumbnails': collateral_thumbnails
                     }
 
                     logger.debug(f"✅ Added result for business {business_id}: {result_item}")
@@ -937,6 +938,7 @@ class Loans:
             logger.error(f"Traceback: {traceback.format_exc()}")
             return None
 
+    @timed()
     def download_csv(self, business_id, start_date, end_date):
         """Returns a Flask CSV download response of capital transactions for a specific business."""
 
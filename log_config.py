@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, UTC
+from typing import Dict, Optional
+
+# Attributes every LogRecord has; anything else on a record was passed through extra= and is a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+def record_fields(record: logging.LogRecord) -> Dict[str, object]:
+    """Returns the structured fields attached to a record with extra="""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    """Plain log lines with the structured fields appended as key=value pairs"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value!r}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, UTC).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Lets through only a random share of DEBUG records; INFO and above always pass"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+def _parse_levels(spec: str) -> Dict[str, int]:
+    """Parses LOG_LEVELS, e.g. 'loans=DEBUG,werkzeug=WARNING', into logger names and levels"""
+    levels = {}
+    for item in spec.split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """
+    Replaces the per-module basicConfig setups with one handler configured from the environment:
+    LOG_LEVEL sets the default level (INFO), LOG_LEVELS overrides it per module, LOG_FORMAT=json switches
+    to JSON lines and LOG_DEBUG_SAMPLE_RATE keeps only that share of DEBUG records.
+
+    Debug calls on a logger below its level return before formatting anything, so hot paths log with
+    lazy %-style arguments and wrap any expensive debug-only work in logger.isEnabledFor(logging.DEBUG).
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT', '').lower() == 'json' else TextFormatter())
+
+    sample_rate = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1'))
+    if sample_rate < 1:
+        handler.addFilter(DebugSampler(sample_rate))
+
+    # force replaces whatever handler the first module-level basicConfig call installed
+    logging.basicConfig(level=(level or os.getenv('LOG_LEVEL', 'INFO')).upper(), handlers=[handler], force=True)
+
+    for name, module_level in _parse_levels(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(module_level)
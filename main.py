@@ -4,32 +4,42 @@ from dotenv import load_dotenv
 from charts import Charts
 from registration import Registration
 from borrower_information import BorrowerInformation
+from borrower_profile import BorrowerProfile
+from borrower_risk import BorrowerRisk
 from loans import Loans
 import os
 from flask_wtf.csrf import CSRFProtect, generate_csrf
+from werkzeug.middleware.proxy_fix import ProxyFix
 from user_authentication import UserAuthentication
 from customer_analytics import CustomerAnalytics
 from datetime import datetime
 from business_analytics import BusinessAnalytics
 from capital_functions import CapitalFunctions
-from settings import Settings
-import traceback
+from settings import MAX_KEYS_PER_BATCH, Settings
+import click
 from repayment import Repayment
 from expenses import Expenses
-from subscription import Subscriptions
+from subscription import PENDING, Subscriptions
+from upload_streams import MAX_REQUEST_BYTES
+from upload_queue import get_upload_queue
+from payment_poller import get_payment_poller
+from email_queue import get_email_queue
+from business_context import business_required, current_business, invalidate_business_context
+from rate_limit import TRUSTED_PROXY_HOPS, auth_attempt_allowed
+import query_profiler
+import metrics
+from query_profiler import query_budget
+from concurrent_queries import gather_calls
+import logging
+from log_config import configure_logging
+from lazy_imports import preload_lazy_modules
+import time
 
 
-from dotenv import load_dotenv
 load_dotenv()
-import secrets
-print(secrets.token_hex(16))
-
-
-
+configure_logging()
+logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-app.secret_key = os.getenv('FLASK_SECRET_KEY')
-csrf = CSRFProtect(app)
 
 from datetime import datetime
 
@@ -39,13 +49,87 @@ def datetimeformat(value):
     except Exception:
         return value
 
-app.jinja_env.filters['datetimeformat'] = datetimeformat
+
+csrf = CSRFProtect()
+
+
+def configure_app(flask_app: Flask) -> None:
+    """
+    Applies the configuration and extensions of the app to the module-level Flask object its routes are
+    registered on. Nothing here starts threads or opens connections, so it is safe to run in a gunicorn
+    master that preloads the app before forking workers.
+    """
+    flask_app.secret_key = os.getenv('FLASK_SECRET_KEY')
+    # Behind a load balancer, take the client address and scheme from the X-Forwarded-* headers it adds,
+    # so per-client limits see each client rather than the balancer
+    if TRUSTED_PROXY_HOPS:
+        flask_app.wsgi_app = ProxyFix(flask_app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+    # Werkzeug spools large form uploads to disk; this caps the request body so oversized uploads get a 413
+    flask_app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+    csrf.init_app(flask_app)
+    query_profiler.init_app(flask_app)
+    metrics.init_app(flask_app)
+    flask_app.jinja_env.filters['datetimeformat'] = datetimeformat
+
+
+def warm_app(flask_app: Flask) -> None:
+    """Imports the lazily loaded libraries and compiles every template, e.g. once in a preloading master"""
+    started = time.perf_counter()
+    preload_lazy_modules()
+    for template in flask_app.jinja_env.list_templates():
+        flask_app.jinja_env.get_template(template)
+    logger.info("Warmed app in %.2fs", time.perf_counter() - started)
+
+
+def init_process() -> None:
+    """
+    Starts the background work of one server process. It runs from the server entry points only, gunicorn's
+    post_fork hook and the development server below, so importing main (e.g. for a flask CLI command) never
+    starts workers that would claim queued jobs and die with the command.
+    """
+    # Resume loan document uploads that were still queued when the app last stopped
+    get_upload_queue().start_worker()
+
+    # Follow subscription payments that were still pending, and any started from now on
+    get_payment_poller().start_worker()
+
+    # Send emails that were still queued when the app last stopped
+    get_email_queue().start_worker()
+
+
+app = Flask(__name__)
+configure_app(app)
 
 @app.context_processor
 def inject_csrf_token():
     return dict(csrf_token=generate_csrf())
 
 
+@app.context_processor
+def inject_business():
+    # The logged-in business's plan and limits, so templates can show what the plan includes
+    return dict(business=current_business() if 'business_data' in session else None)
+
+
+@app.cli.command('rebuild-borrower-risk')
+@click.option('--business-id', default=None, help='Only rebuild the borrowers of this business.')
+def rebuild_borrower_risk(business_id):
+    """Recomputes the borrower_risk table from the loans and repayments tables."""
+    risk_tool = BorrowerRisk()
+    updated = risk_tool.rebuild(business_id)
+    click.echo(f'Rebuilt risk for {updated} borrowers')
+
+
+@app.cli.command('sweep-secret-keys')
+@click.option('--hours', default=24, show_default=True, help='Delete secret keys older than this many hours.')
+def sweep_secret_keys(hours):
+    """Deletes expired secret keys of every business; schedule it where pg_cron is not available."""
+    result = Settings().sweep_expired_keys(hours)
+    if not result['success']:
+        raise click.ClickException(result['message'])
+    click.echo(result['message'])
+
+
 @app.route('/')
 def user_auth():
     return render_template('user_login_signup.html')
@@ -60,6 +144,10 @@ def business_login():
     business_email = request.form.get('business_email')
     business_password = request.form.get('business_password')
 
+    if not auth_attempt_allowed('business_login', business_email):
+        flash('Too many login attempts. Please wait a minute and try again.', 'error')
+        return render_template("user_login_signup.html"), 429
+
     auth = UserAuthentication()
 
     try:
@@ -67,12 +155,9 @@ def business_login():
 
         if result.get("success", False):
             business_data = result.get('business_data', {})
-            business_id = business_data.get('id')
-
-            subscription_tool = Subscriptions()
 
-            # Check if business has paid
-            if not subscription_tool.check_business_pay_status(business_id):
+            # Check if business has paid; read from the same row as the login, so no second query
+            if not result['business_context']['paid']:
                 # Store business data in session for subscription flow
                 session['pending_business_data'] = business_data
                 session['business_data'] = business_data  # Also store here to avoid session expired errors
@@ -91,8 +176,8 @@ def business_login():
             flash('Wrong business credentials', 'error')
             return render_template("user_login_signup.html")
 
-    except Exception as e:
-        print(f'Exception: {e}')
+    except Exception:
+        logger.exception("Business login failed")
         flash('An error occurred during business login', 'error')
         return render_template("user_login_signup.html")
 
@@ -139,9 +224,10 @@ def subscription():
                 flash('Invalid amount format.', 'error')
                 return render_template('subscription.html')
 
-            # Handle payment
+            # Request the payment and return straight away; the customer approves it on their phone while
+            # the page polls subscription_status
             subscription_tool = Subscriptions()
-            result = subscription_tool.buy_plan(
+            payment_id = subscription_tool.buy_plan(
                 business_id=business_id,
                 amount=float(amount_clean),
                 first_name=first_name,
@@ -151,34 +237,83 @@ def subscription():
                 plan=plan
             )
 
-            if result:
-                # Payment succeeded - now store the business data properly
-                session['business_data'] = business_data  # Move from pending to active
-                session.pop('pending_business_data', None)  # Clean up pending data
-
-                session['subscription_data'] = {
-                    'plan': plan,
-                    'amount': amount,
-                    'email': email,
-                    'first_name': first_name,
-                    'last_name': last_name,
-                    'business_data': business_data
-                }
-
+            if payment_id:
+                get_payment_poller().wake()
                 flash('Payment request sent successfully! Please check your phone for the mobile money prompt.',
                       'success')
-                return redirect(url_for('subscription_success'))
+                return render_template('subscription.html', pending_payment_id=payment_id)
             else:
-                # Payment failed or timed out
-                flash('Payment was not completed or timed out. Please try again.', 'error')
+                flash('Payment could not be started. Please try again.', 'error')
                 return render_template('subscription.html')
 
-        except Exception as e:
-            print(f'Subscription error: {e}')
+        except Exception:
+            logger.exception("Subscription error", extra={'business_id': business_id})
             flash('An error occurred while processing your request. Please try again.', 'error')
             return render_template('subscription.html')
 
 
+@app.route('/subscription/status/<payment_id>')
+@query_budget(1)
+def subscription_status(payment_id):
+    """Lightweight status of a pending subscription payment, polled by the subscription page"""
+    business_data = session.get('business_data') or session.get('pending_business_data')
+    if not business_data or not business_data.get('id'):
+        return jsonify({'status': 'unknown', 'error': 'Business session expired'}), 401
+
+    payment = Subscriptions().payment_status(payment_id, business_data['id'])
+    if not payment:
+        return jsonify({'status': 'unknown', 'error': 'Payment not found'}), 404
+
+    if payment['status'] != 'success':
+        return jsonify({'status': payment['status']})
+
+    # Another worker may have completed the payment, leaving a stale unpaid context cached in this one
+    invalidate_business_context(business_data['id'])
+
+    # Payment succeeded - now store the business data properly
+    session['business_data'] = business_data  # Move from pending to active
+    session.pop('pending_business_data', None)  # Clean up pending data
+
+    session['subscription_data'] = {
+        'plan': payment['plan'],
+        'amount': payment['amount'],
+        'email': payment['email'],
+        'first_name': payment['first_name'],
+        'last_name': payment['last_name'],
+        'business_data': business_data
+    }
+
+    return jsonify({'status': 'success', 'redirect': url_for('subscription_success')})
+
+
+@app.route('/webhooks/tumeny', methods=['POST'])
+@csrf.exempt
+def tumeny_webhook():
+    """
+    Payment callback from TuMeNy. The body only tells us which payment changed; its status is read back
+    from TuMeNy before anything is recorded, so a forged callback cannot mark a business as paid. Only
+    payments we have recorded as pending are checked, so forged ids cost one indexed read, not a TuMeNy call.
+    """
+    data = request.get_json(silent=True) or {}
+    payment = data.get('payment') if isinstance(data.get('payment'), dict) else data
+    payment_id = payment.get('id') or payment.get('payment_id')
+
+    if not payment_id:
+        return jsonify({'received': False, 'error': 'Missing payment id'}), 400
+
+    subscriptions = Subscriptions()
+
+    stored_status = subscriptions.stored_status(payment_id)
+    if stored_status is None:
+        return jsonify({'received': False, 'error': 'Unknown payment'}), 404
+    if stored_status != PENDING:
+        return jsonify({'received': True, 'status': stored_status})
+
+    status = subscriptions.refresh_payment(payment_id)
+    logger.info("TuMeNy callback for payment %s: %s", payment_id, status)
+    return jsonify({'received': True, 'status': status})
+
+
 @app.route('/subscription-success')
 def subscription_success():
     """Display subscription success page"""
@@ -214,8 +349,8 @@ def business_signup():
         else:
             flash(f'Error signing up {business_name}', 'error')
             return render_template("user_login_signup.html")
-    except Exception as e:
-        print(f'Exception: {e}')
+    except Exception:
+        logger.exception("Business signup failed")
         flash('An error occurred during business signup', 'error')
         return render_template("user_login_signup.html")
 
@@ -246,7 +381,7 @@ def enterprise_request():
             flash('Failed to send enterprise request. Please try again later.', 'error')
 
     except Exception as e:
-        print(f'Exception: {e}')
+        logger.exception("Enterprise request failed")
         flash(f'Unexpected error: {e}', 'error')
 
     # Redirect back to subscription or dashboard page
@@ -254,12 +389,19 @@ def enterprise_request():
 
 
 @app.route("/login", methods=["GET", "POST"])
+@query_budget(2)
 def login():
     # Check if business is logged in at the start
     if 'business_data' not in session:
         flash('Please log into business first', 'error')
         return redirect(url_for('business_login'))
 
+    # Paid status comes from the business context cached when the business logged in
+    business = current_business()
+    if not business or not business['paid']:
+        flash('Please complete your subscription to access the dashboard.', 'warning')
+        return redirect(url_for('subscription'))
+
     if request.method == "GET":
         return render_template("user_login_signup.html",
                                show_user_login=True,
@@ -269,6 +411,12 @@ def login():
     auth = UserAuthentication()
     email = request.form["email"]
     password = request.form["password"]
+
+    # Rejected before the password is hashed or the user looked up
+    if not auth_attempt_allowed('login', email):
+        flash("Too many login attempts. Please wait a minute and try again.", "error")
+        return redirect(url_for("login"))
+
     response = auth.login(email, password)
 
     if response.get("success", False):
@@ -289,6 +437,11 @@ def signup():
         password = request.form["password"]
         secret_key = request.form["secret_key"]
 
+        # Limits secret key guessing as well as the password hashing each attempt costs
+        if not auth_attempt_allowed('signup', email):
+            flash("Too many sign up attempts. Please wait a minute and try again.", "error")
+            return render_template("user_login_signup.html"), 429
+
         response = auth.sign_up(name, email, password, secret_key)
 
         # Check if signup was successful
@@ -312,7 +465,10 @@ def signup():
 def business_forgot_password():
     if request.method == 'POST':
         email = request.form.get('email')
-        print(email)
+
+        if not auth_attempt_allowed('forgot_password', email):
+            flash('Too many password requests. Please wait a minute and try again.', 'error')
+            return redirect(url_for('business_login'))
 
         auth_tool = UserAuthentication()
         try:
@@ -324,8 +480,8 @@ def business_forgot_password():
             flash('PASSWORD SENT TO YOUR EMAIL SUCCESSFULLY', 'success')
             return redirect(url_for('business_login'))
 
-        except Exception as e:
-            print(f'Exception: {e}')
+        except Exception:
+            logger.exception("Password recovery failed")
             flash('An error occurred. Please try again.', 'error')
             return redirect(url_for('business_login'))
 
@@ -348,9 +504,13 @@ def user_forgot_password():
     if request.method == 'POST':
         email = request.form.get('email')
 
+        if not auth_attempt_allowed('forgot_password', email):
+            flash('Too many password requests. Please wait a minute and try again.', 'error')
+            return redirect(url_for('business_login'))
+
         auth_tool = UserAuthentication()
         try:
-            result = auth_tool.email_retrieved_user_password(business_id, email)
+            result = auth_tool.email_retrieved_user_password(email=email, business_id=business_id)
             if not result:
                 flash('FAILED TO SEND PASSWORD', 'error')
                 return redirect(url_for('business_login'))  # Changed this line
@@ -358,8 +518,8 @@ def user_forgot_password():
             flash('PASSWORD SENT TO YOUR EMAIL SUCCESSFULLY', 'success')
             return redirect(url_for('business_login'))
 
-        except Exception as e:
-            print(f'Exception: {e}')
+        except Exception:
+            logger.exception("Password recovery failed")
             flash('An error occurred. Please try again.', 'error')
             return redirect(url_for('business_login'))
 
@@ -375,17 +535,10 @@ def unauthorized_access():
 
 
 @app.route('/overview_dashboard', methods=['GET', 'POST'])
+@business_required()
+@query_budget(28)
 def overview_dashboard():
-    # Get business_id from session
-    if 'business_data' not in session:
-        flash('Business session expired. Please log into business first', 'error')
-        return redirect(url_for('business_login'))
-
-    business_id = session['business_data'].get('id')
-
-    if not business_id:
-        flash('Business ID not found in session', 'error')
-        return redirect(url_for('business_login'))
+    business_id = current_business()['id']
 
     loan_tool = Loans()
     loan_tool.update_overdue_loans(business_id)
@@ -400,24 +553,42 @@ def overview_dashboard():
         chart_tool = Charts()
 
         try:
+            # The figures are independent queries, so they are fetched concurrently
+            results = gather_calls({
+                'total_disbursed': lambda: overview_tool.total_disbursed(selected_period, business_id),
+                'total_repaid': lambda: overview_tool.total_repaid(selected_period, business_id),
+                'outstanding_balance': lambda: overview_tool.outstanding_balance(selected_period, business_id),
+                'expected_interest': lambda: overview_tool.expected_interest(selected_period, business_id),
+                'average_loan_size': lambda: overview_tool.average_loan_size(selected_period, business_id),
+                'average_duration': lambda: overview_tool.average_duration(selected_period, business_id),
+                'active_loans': lambda: overview_tool.active_loans(selected_period, business_id),
+                'default_rate': lambda: overview_tool.default_rate(selected_period, business_id),
+                'transaction_costs': lambda: overview_tool.total_transaction_costs(selected_period, business_id),
+                'discount_costs': lambda: overview_tool.total_discounts_given(selected_period, business_id),
+                'expense_costs': lambda: overview_tool.total_period_expenses(selected_period, business_id),
+                'available_cash': lambda: overview_tool.available_cash(business_id),
+                'gender_chart': lambda: chart_tool.borrowers_by_gender(selected_period),
+                'status_distribution_chart': lambda: chart_tool.loan_status_distribution(selected_period)
+            })
+
             response_data = {
                 'success': True,
-                'total_disbursed': f"ZMK {overview_tool.total_disbursed(selected_period, business_id):,.2f}",
-                'total_repaid': f"ZMK {overview_tool.total_repaid(selected_period, business_id):,.2f}",
-                'outstanding_balance': f"ZMK {overview_tool.outstanding_balance(selected_period, business_id):,.2f}",
-                'expected_interest': f"ZMK {overview_tool.expected_interest(selected_period, business_id):,.2f}",
-                'average_loan_size': f"ZMK {overview_tool.average_loan_size(selected_period, business_id):,.2f}",
-                'average_duration': f"{overview_tool.average_duration(selected_period, business_id):,.0f} days",
-                'active_loans': f"{overview_tool.active_loans(selected_period, business_id):,}",
-                'default_rate': f"{overview_tool.default_rate(selected_period, business_id)}%",
-                'transaction_costs': f"ZMK{overview_tool.total_transaction_costs(selected_period, business_id)}",
-                'discount_costs': f"ZMK{overview_tool.total_discounts_given(selected_period, business_id)}",
-                 'expense_costs' : f"ZMK{overview_tool.total_period_expenses(selected_period, business_id)}",
-
-                'available_cash': overview_tool.available_cash(business_id),
-                'gender_chart': chart_tool.borrowers_by_gender(selected_period),
+                'total_disbursed': f"ZMK {results['total_disbursed']:,.2f}",
+                'total_repaid': f"ZMK {results['total_repaid']:,.2f}",
+                'outstanding_balance': f"ZMK {results['outstanding_balance']:,.2f}",
+                'expected_interest': f"ZMK {results['expected_interest']:,.2f}",
+                'average_loan_size': f"ZMK {results['average_loan_size']:,.2f}",
+                'average_duration': f"{results['average_duration']:,.0f} days",
+                'active_loans': f"{results['active_loans']:,}",
+                'default_rate': f"{results['default_rate']}%",
+                'transaction_costs': f"ZMK{results['transaction_costs']}",
+                'discount_costs': f"ZMK{results['discount_costs']}",
+                 'expense_costs' : f"ZMK{results['expense_costs']}",
+
+                'available_cash': results['available_cash'],
+                'gender_chart': results['gender_chart'],
                 # Assuming Charts class also needs updating
-                'status_distribution_chart': chart_tool.loan_status_distribution(selected_period)
+                'status_distribution_chart': results['status_distribution_chart']
                 # Assuming Charts class also needs updating
             }
             return jsonify(response_data)
@@ -429,24 +600,45 @@ def overview_dashboard():
     overview_tool = OverviewMetrics()
     chart_tool = Charts()
 
-    available_cash = overview_tool.available_cash(business_id)
-    total_disbursed = f"ZMK {overview_tool.total_disbursed(selected_period, business_id):,.2f}"
-    total_repaid = f"ZMK {overview_tool.total_repaid(selected_period, business_id):,.2f}"
-    outstanding_balance = f"ZMK {overview_tool.outstanding_balance(selected_period, business_id):,.2f}"
-    expected_interest = f"ZMK {overview_tool.expected_interest(selected_period, business_id):,.2f}"
-    average_loan_size = f"ZMK {overview_tool.average_loan_size(selected_period, business_id):,.2f}"
-    average_duration = f"{overview_tool.average_duration(selected_period, business_id):,.0f} days"
-    active_loans = f"{overview_tool.active_loans(selected_period, business_id):,}"
-    default_rate = f"{overview_tool.default_rate(selected_period, business_id)}%"
-    transaction_costs = f"ZMK{overview_tool.total_transaction_costs(selected_period, business_id)}"
-    discount_costs = f"ZMK{overview_tool.total_discounts_given(selected_period, business_id)}"
-    expense_costs = f"ZMK{overview_tool.total_period_expenses(selected_period, business_id)}"
-
-    recent_borrowers = overview_tool.recent_borrowers(business_id)
-    location_summary = overview_tool.borrowers_by_location(selected_period, business_id)
-    weekly_loans_due = overview_tool.weekly_loans_due(business_id)
-    gender_chart = chart_tool.borrowers_by_gender(selected_period)  # May need business_id parameter
-    status_distribution_chart = chart_tool.loan_status_distribution(selected_period)  # May need business_id parameter
+    # Each figure, table and chart is an independent query, so they are fetched concurrently
+    results = gather_calls({
+        'available_cash': lambda: overview_tool.available_cash(business_id),
+        'total_disbursed': lambda: overview_tool.total_disbursed(selected_period, business_id),
+        'total_repaid': lambda: overview_tool.total_repaid(selected_period, business_id),
+        'outstanding_balance': lambda: overview_tool.outstanding_balance(selected_period, business_id),
+        'expected_interest': lambda: overview_tool.expected_interest(selected_period, business_id),
+        'average_loan_size': lambda: overview_tool.average_loan_size(selected_period, business_id),
+        'average_duration': lambda: overview_tool.average_duration(selected_period, business_id),
+        'active_loans': lambda: overview_tool.active_loans(selected_period, business_id),
+        'default_rate': lambda: overview_tool.default_rate(selected_period, business_id),
+        'transaction_costs': lambda: overview_tool.total_transaction_costs(selected_period, business_id),
+        'discount_costs': lambda: overview_tool.total_discounts_given(selected_period, business_id),
+        'expense_costs': lambda: overview_tool.total_period_expenses(selected_period, business_id),
+        'recent_borrowers': lambda: overview_tool.recent_borrowers(business_id),
+        'location_summary': lambda: overview_tool.borrowers_by_location(selected_period, business_id),
+        'weekly_loans_due': lambda: overview_tool.weekly_loans_due(business_id),
+        'gender_chart': lambda: chart_tool.borrowers_by_gender(selected_period),  # May need business_id parameter
+        'status_distribution_chart': lambda: chart_tool.loan_status_distribution(selected_period)  # May need business_id parameter
+    })
+
+    available_cash = results['available_cash']
+    total_disbursed = f"ZMK {results['total_disbursed']:,.2f}"
+    total_repaid = f"ZMK {results['total_repaid']:,.2f}"
+    outstanding_balance = f"ZMK {results['outstanding_balance']:,.2f}"
+    expected_interest = f"ZMK {results['expected_interest']:,.2f}"
+    average_loan_size = f"ZMK {results['average_loan_size']:,.2f}"
+    average_duration = f"{results['average_duration']:,.0f} days"
+    active_loans = f"{results['active_loans']:,}"
+    default_rate = f"{results['default_rate']}%"
+    transaction_costs = f"ZMK{results['transaction_costs']}"
+    discount_costs = f"ZMK{results['discount_costs']}"
+    expense_costs = f"ZMK{results['expense_costs']}"
+
+    recent_borrowers = results['recent_borrowers']
+    location_summary = results['location_summary']
+    weekly_loans_due = results['weekly_loans_due']
+    gender_chart = results['gender_chart']
+    status_distribution_chart = results['status_distribution_chart']
 
     formatted_cash = f"{available_cash:,.2f}"
 
@@ -527,7 +719,7 @@ def download_loans_csv():
         # Note: You'll need to update the Loans.download_csv() method to accept business_id
         return loans_tool.download_csv(business_id, start_date, end_date)
     except Exception as e:
-        print(f'Exception: {e}')
+        logger.exception("Loans CSV download failed", extra={'business_id': business_id})
         flash(f'Error: {e}')
         return redirect(request.referrer)
 
@@ -562,6 +754,7 @@ def search_borrower():
 
 
 @app.route('/borrower_information')
+@query_budget(2)
 def borrower_information():
     # Get business_id from session
     if 'business_data' not in session:
@@ -580,34 +773,23 @@ def borrower_information():
         flash('Borrower ID is required', 'error')
         return redirect(url_for('search_borrower'))
 
-    # get the loan_id using the borrower id
-    registration_tool = Registration()
-    # Note: You'll need to update these Registration methods to accept business_id
-    loan_id = registration_tool.get_loan_id(borrower_id, business_id)
-    borrower_data = registration_tool.get_borrower_data(borrower_id, business_id)
+    # Load the borrower, their loans and repayments once and derive every card from them
+    borrower_profile_tool = BorrowerProfile()
+    profile = borrower_profile_tool.load(borrower_id, business_id)
 
     # Verify that the borrower belongs to this business
-    if not borrower_data:
+    if not profile:
         flash('Borrower not found or does not belong to your business', 'error')
         return redirect(url_for('search_borrower'))
 
-    borrower_information_tool = BorrowerInformation()
-
-    # Note: You'll need to update these BorrowerInformation methods to accept business_id
-    payment_history = borrower_information_tool.get_borrower_payment_history(loan_id, business_id)
-    outstanding_debts = borrower_information_tool.total_outstanding_debts(borrower_id, business_id)
-    default_assessment = borrower_information_tool.default_risk_assessment(borrower_id, business_id)
-    credit_status = borrower_information_tool.account_status(borrower_id, business_id)
-    recent_borrower_history = borrower_information_tool.recent_borrower_history(borrower_id, business_id)
-
     return render_template(
         'borrower_information.html',
-        borrower_data=borrower_data,
-        payment_history=payment_history,
-        outstanding_debts=outstanding_debts,
-        default_assessment=default_assessment,
-        credit_status=credit_status,
-        recent_borrower_history=recent_borrower_history
+        borrower_data=profile['borrower_data'],
+        payment_history=profile['payment_history'],
+        outstanding_debts=profile['outstanding_debts'],
+        default_assessment=profile['default_assessment'],
+        credit_status=profile['credit_status'],
+        recent_borrower_history=profile['recent_borrower_history']
     )
 
 
@@ -632,6 +814,7 @@ def borrower_data():
 
 
 @app.route('/loan_form')
+@business_required()
 def loan_form():
     """Display the loan form"""
     if session.get("user", {}).get("role") != "admin":
@@ -639,16 +822,7 @@ def loan_form():
         flash("Access denied: Admins only.", "error")
         return render_template('unauthorized_access.html')
 
-    # Get business_id from session
-    if 'business_data' not in session:
-        flash('Business session expired. Please log into business first', 'error')
-        return redirect(url_for('business_login'))
-
-    business_id = session['business_data'].get('id')
-
-    if not business_id:
-        flash('Business ID not found in session', 'error')
-        return redirect(url_for('business_login'))
+    business_id = current_business()['id']
 
     borrower_id = request.args.get('borrower_id')
 
@@ -668,22 +842,14 @@ def loan_form():
 
 
 @app.route('/register_borrower', methods=['GET', 'POST'])
+@business_required()
 def register_borrower():
     if session.get("user", {}).get("role") != "admin":
         # Block access
         flash("Access denied: Admins only.", "error")
         return render_template('unauthorized_access.html')
 
-    # Get business_id from session
-    if 'business_data' not in session:
-        flash('Business session expired. Please log into business first', 'error')
-        return redirect(url_for('business_login'))
-
-    business_id = session['business_data'].get('id')
-
-    if not business_id:
-        flash('Business ID not found in session', 'error')
-        return redirect(url_for('business_login'))
+    business_id = current_business()['id']
 
     if request.method == 'GET':
         return render_template('register_new_borrower.html')
@@ -730,37 +896,16 @@ def register_borrower():
 
 
 @app.route('/submit-loan', methods=['POST'])
+@business_required()
 def submit_loan():
-    """Handle loan form submission with enhanced debugging"""
+    """Handle loan form submission"""
     if session.get("user", {}).get("role") != "admin":
         flash("Access denied: Admins only.", "error")
         return render_template('unauthorized_access.html')
 
-    # Get business_id from session
-    if 'business_data' not in session:
-        flash('Business session expired. Please log into business first', 'error')
-        return redirect(url_for('business_login'))
-
-    business_id = session['business_data'].get('id')
-
-    if not business_id:
-        flash('Business ID not found in session', 'error')
-        return redirect(url_for('business_login'))
+    business_id = current_business()['id']
 
     try:
-        # FIRST: Debug raw form data before processing
-        print("=== RAW FORM DATA DEBUG ===")
-        print("All form data:")
-        for key, value in request.form.items():
-            print(f"  {key}: '{value}' (type: {type(value)})")
-
-        print("\nAll files:")
-        for key, file in request.files.items():
-            if hasattr(file, 'filename'):
-                print(f"  {key}: {file.filename} (type: {type(file)})")
-            else:
-                print(f"  {key}: {file} (type: {type(file)})")
-
         # Get form data
         borrower_id = request.form.get('borrower_id')
         amount = float(request.form.get('amount', 0))
@@ -774,101 +919,13 @@ def submit_loan():
         contract_file = request.files.get('contract_file')
         collateral_images = request.files.getlist('collateral_images')
 
-        # Check if collateral_images is empty
-        print(f"\nCollateral images details:")
-        print(f"  Count: {len(collateral_images)}")
-        for i, img in enumerate(collateral_images):
-            if hasattr(img, 'filename') and img.filename:
-                # Only read size if file has content
-                try:
-                    current_pos = img.tell() if hasattr(img, 'tell') else 0
-                    img.seek(0, 2)  # Seek to end
-                    size = img.tell()
-                    img.seek(current_pos)  # Reset to original position
-                    print(f"  Image {i}: filename='{img.filename}', size={size}")
-                except:
-                    print(f"  Image {i}: filename='{img.filename}', size=unknown")
-            else:
-                print(f"  Image {i}: empty file")
-
-        # Specific checks for common issues
-        print("\n=== POTENTIAL ISSUES CHECK ===")
-
-        # Check if borrower_id is actually coming through
-        if not request.form.get('borrower_id'):
-            print("❌ CRITICAL: borrower_id is missing from form data!")
-        else:
-            print(f"✓ borrower_id found: {request.form.get('borrower_id')}")
-
-        # Check if amount is valid
-        try:
-            amount_raw = request.form.get('amount', 0)
-            amount_float = float(amount_raw)
-            if amount_float <= 0:
-                print(f"❌ CRITICAL: Amount is <= 0: {amount_float}")
-            else:
-                print(f"✓ Amount is valid: {amount_float}")
-        except ValueError as e:
-            print(f"❌ CRITICAL: Amount conversion failed: {e}")
-
-        # Check if interest_rate is valid
-        try:
-            interest_raw = request.form.get('interest_rate', 0)
-            interest_float = float(interest_raw)
-            if interest_float < 0:
-                print(f"❌ CRITICAL: Interest rate is < 0: {interest_float}")
-            else:
-                print(f"✓ Interest rate is valid: {interest_float}")
-        except ValueError as e:
-            print(f"❌ CRITICAL: Interest rate conversion failed: {e}")
-
-        # Check if duration_days is valid
-        try:
-            duration_raw = request.form.get('duration_days', 0)
-            duration_int = int(duration_raw)
-            if duration_int <= 0:
-                print(f"❌ CRITICAL: Duration is <= 0: {duration_int}")
-            else:
-                print(f"✓ Duration is valid: {duration_int}")
-        except ValueError as e:
-            print(f"❌ CRITICAL: Duration conversion failed: {e}")
-
-        # Check due_date
-        due_date_raw = request.form.get('due_date')
-        if not due_date_raw:
-            print("❌ CRITICAL: Due date is missing!")
-        else:
-            print(f"✓ Due date found: {due_date_raw}")
-
-        # Check contract file
-        contract_file_check = request.files.get('contract_file')
-        if not contract_file_check or contract_file_check.filename == '':
-            print("❌ CRITICAL: Contract file is missing!")
-        else:
-            print(f"✓ Contract file found: {contract_file_check.filename}")
-
-        # Check loan reason
-        loan_reason_raw = request.form.get('loan_reason')
-        if not loan_reason_raw:
-            print("❌ CRITICAL: Loan reason is missing!")
-        else:
-            print(f"✓ Loan reason found: {loan_reason_raw}")
-
-        print("=== END FORM VALIDATION CHECK ===\n")
-
-        # Enhanced debug prints
-        print(f"=== DETAILED LOAN SUBMISSION DEBUG ===")
-        print(f"business_id: {business_id} (type: {type(business_id)})")
-        print(f"borrower_id: {borrower_id} (type: {type(borrower_id)})")
-        print(f"amount: {amount} (type: {type(amount)})")
-        print(f"transaction_costs: {transaction_costs} (type: {type(transaction_costs)})")
-        print(f"interest_rate: {interest_rate} (type: {type(interest_rate)})")
-        print(f"duration_days: {duration_days} (type: {type(duration_days)})")
-        print(f"due_date: {due_date} (type: {type(due_date)})")
-        print(f"loan_reason: {loan_reason}")
-        print(f"contract_file: {contract_file}")
-        print(f"contract_file.filename: {contract_file.filename if contract_file else 'None'}")
-        print(f"collateral_images count: {len(collateral_images) if collateral_images else 0}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Loan form received", extra={
+                'business_id': business_id,
+                'form': {key: value for key, value in request.form.items() if key != 'csrf_token'},
+                'contract_file': contract_file.filename if contract_file else None,
+                'collateral_images': [img.filename for img in collateral_images if img.filename]
+            })
 
         # Validate required fields BEFORE calling the method
         missing_fields = []
@@ -886,39 +943,34 @@ def submit_loan():
             missing_fields.append("loan_reason")
 
         if missing_fields:
-            print(f"ERROR: Missing/invalid required fields: {missing_fields}")
+            logger.warning("Loan submission rejected, invalid fields: %s", missing_fields,
+                           extra={'business_id': business_id, 'borrower_id': borrower_id})
             flash(f'Invalid fields: {", ".join(missing_fields)}', 'error')
             return redirect(url_for('loan_form', borrower_id=borrower_id))
 
         if not contract_file or contract_file.filename == '':
-            print("ERROR: Missing contract file")
+            logger.warning("Loan submission rejected, missing contract file",
+                           extra={'business_id': business_id, 'borrower_id': borrower_id})
             flash('Contract file is required', 'error')
             return redirect(url_for('loan_form', borrower_id=borrower_id))
 
-        print("All validations passed, creating Loans instance...")
-
         # Submit loan with detailed error checking
         loan_tool = Loans()
 
         # First, let's verify the borrower exists
-        print(f"Checking if borrower {borrower_id} exists for business {business_id}...")
         try:
             borrower_check = loan_tool.borrower_identity(borrower_id, business_id)
-            print(f"Borrower check result: {borrower_check}")
             if borrower_check.get('name') == 'Unknown':
-                print(f"ERROR: Borrower {borrower_id} not found for business {business_id}")
+                logger.warning("Borrower %s not found for business %s", borrower_id, business_id)
                 flash(f'Borrower with ID {borrower_id} not found for this business', 'error')
                 return redirect(url_for('loan_form', borrower_id=borrower_id))
         except Exception as borrower_error:
-            print(f"ERROR checking borrower: {borrower_error}")
+            logger.error("Error checking borrower %s: %s", borrower_id, borrower_error)
             flash('Error verifying borrower. Please try again.', 'error')
             return redirect(url_for('loan_form', borrower_id=borrower_id))
 
-        print("Borrower verified, calling old_borrower_loan method...")
-
         # Filter out empty collateral images
         valid_collateral_images = [img for img in collateral_images if img.filename]
-        print(f"Valid collateral images: {len(valid_collateral_images)}")
 
         loan_id = loan_tool.old_borrower_loan(
             borrower_id=borrower_id,
@@ -933,11 +985,12 @@ def submit_loan():
             collateral_files_list=valid_collateral_images if valid_collateral_images else None
         )
 
-        print(f"=== LOAN SUBMISSION RESULT ===")
-        print(f"loan_id returned: {loan_id} (type: {type(loan_id)})")
-
         if loan_id:
-            print("SUCCESS: Loan submitted successfully")
+            logger.info("Loan %s submitted", loan_id, extra={
+                'business_id': business_id,
+                'borrower_id': borrower_id,
+                'collateral_images': len(valid_collateral_images)
+            })
             flash('Loan application submitted successfully!', 'success')
 
             template_vars = {
@@ -948,47 +1001,29 @@ def submit_loan():
                 'interest_rate': interest_rate,
                 'due_date': due_date
             }
-            print(f"Template variables: {template_vars}")
 
             return render_template('successful_loan_submitted.html', **template_vars)
         else:
-            print("ERROR: Loan submission failed - loan_id is None")
-            print("This means one of the following failed:")
-            print("1. Input validation in old_borrower_loan method")
-            print("2. Borrower verification")
-            print("3. File upload")
-            print("4. Database insertion")
-            print("Check the logs above for specific error messages")
+            # old_borrower_loan logs which step (validation, borrower check or insert) failed
+            logger.error("Loan submission failed for borrower %s", borrower_id, extra={'business_id': business_id})
 
             flash('Error submitting loan application. Please check all fields and try again.', 'error')
             return redirect(url_for('loan_form', borrower_id=borrower_id))
 
     except ValueError as e:
-        print(f"ValueError in submit_loan: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.warning("Invalid loan form values: %s", e, extra={'business_id': business_id})
         flash('Invalid input values. Please check your entries.', 'error')
         return redirect(url_for('loan_form', borrower_id=borrower_id))
-    except Exception as e:
-        print(f"CRITICAL ERROR in submit_loan: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Unexpected error in submit_loan", extra={'business_id': business_id})
         flash('An unexpected error occurred. Please try again.', 'error')
         return redirect(url_for('loan_form', borrower_id=borrower_id))
 
 
 @app.route('/customer_analytics_dashboard', methods=['POST', 'GET'])
+@business_required()
 def customer_analytics_dashboard():
-    # Get business_id from session
-    if 'business_data' not in session:
-        flash('Business session expired. Please log into business first', 'error')
-        return redirect(url_for('business_login'))
-
-    business_id = session['business_data'].get('id')
-
-    if not business_id:
-        flash('Business ID not found in session', 'error')
-        return redirect(url_for('business_login'))
+    business_id = current_business()['id']
 
     try:
         # Get form data with proper error handling
@@ -996,23 +1031,15 @@ def customer_analytics_dashboard():
         month = request.form.get('months')
         year_str = request.form.get('year')
 
-        # Debug: Print what we're getting from the form
-        print(f"Debug - Business ID: {business_id}")
-        print(f"Debug - Gender: {gender}, Month: {month}, Year: {year_str}")
-        print(f"Debug - All form data: {dict(request.form)}")
-
         # Validate and convert year
         if year_str is None or year_str == '':
-            # Provide default year or handle the error
             year = datetime.now().year  # Use current year as default
-            print(f"Warning: No year provided, using default: {year}")
         else:
             try:
                 year = int(year_str)
             except (ValueError, TypeError) as e:
-                print(f"Error converting year to int: {e}")
+                logger.warning("Invalid year %r, using the current year: %s", year_str, e)
                 year = datetime.now().year  # Use current year as fallback
-                print(f"Using fallback year: {year}")
 
         # Validate other required fields
         if gender is None:
@@ -1020,24 +1047,38 @@ def customer_analytics_dashboard():
         if month is None:
             month = "All Months"  # Default value
 
-        print(f"Final values - Business ID: {business_id}, Gender: {gender}, Month: {month}, Year: {year}")
+        logger.debug("Customer analytics filters", extra={
+            'business_id': business_id, 'gender': gender, 'month': month, 'year': year
+        })
 
         # Initialize analytics tool
         customer_analytics_tool = CustomerAnalytics()
 
-        # kpi cards data variables - Note: You'll need to update all these methods to accept business_id
-        total_customers = customer_analytics_tool.total_customers(gender, month, year, business_id)
-        best_location = customer_analytics_tool.best_location(gender, year, month, business_id)
-        worst_location = customer_analytics_tool.worst_location(gender, year, month, business_id)
-        average_amount = customer_analytics_tool.average_loan_amount(gender, year, month, business_id)
-
-        # chart variables - Note: You'll need to update all these methods to accept business_id
-        loans_location_chart = customer_analytics_tool.loans_by_location_chart(gender, year, month, business_id)
-        loans_occupation_chart = customer_analytics_tool.loans_by_occupation_chart(gender, year, month, business_id)
-        age_group_chart = customer_analytics_tool.age_group_radial_bar_chart(gender, year, month, business_id)
-
-        # location performance kpi cards - Note: You'll need to update this method to accept business_id
-        location_scores = customer_analytics_tool.location_performance_ranking(gender, year, month, business_id)
+        # kpi cards, charts and location ranking are independent queries, so they are fetched concurrently
+        results = gather_calls({
+            'total_customers': lambda: customer_analytics_tool.total_customers(gender, month, year, business_id),
+            'best_location': lambda: customer_analytics_tool.best_location(gender, year, month, business_id),
+            'worst_location': lambda: customer_analytics_tool.worst_location(gender, year, month, business_id),
+            'average_amount': lambda: customer_analytics_tool.average_loan_amount(gender, year, month, business_id),
+            'loans_location_chart': lambda: customer_analytics_tool.loans_by_location_chart(gender, year, month, business_id),
+            'loans_occupation_chart': lambda: customer_analytics_tool.loans_by_occupation_chart(gender, year, month, business_id),
+            'age_group_chart': lambda: customer_analytics_tool.age_group_radial_bar_chart(gender, year, month, business_id),
+            'location_scores': lambda: customer_analytics_tool.location_performance_ranking(gender, year, month, business_id)
+        })
+
+        # kpi cards data variables
+        total_customers = results['total_customers']
+        best_location = results['best_location']
+        worst_location = results['worst_location']
+        average_amount = results['average_amount']
+
+        # chart variables
+        loans_location_chart = results['loans_location_chart']
+        loans_occupation_chart = results['loans_occupation_chart']
+        age_group_chart = results['age_group_chart']
+
+        # location performance kpi cards
+        location_scores = results['location_scores']
 
         return render_template(
             'customer_analytics.html',
@@ -1058,10 +1099,7 @@ def customer_analytics_dashboard():
         )
 
     except Exception as e:
-        # Log the full error for debugging
-        print(f"Error in customer_analytics_dashboard: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in customer_analytics_dashboard", extra={'business_id': business_id})
 
         # Return error page or default values
         return render_template(
@@ -1075,18 +1113,10 @@ def customer_analytics_dashboard():
 
 
 @app.route('/business_analytics_dashboard', methods=['POST', 'GET'])
+@business_required()
 def business_analytics():
     try:
-        # Get business_id from session
-        if 'business_data' not in session:
-            flash('Business session expired. Please log into business first', 'error')
-            return redirect(url_for('business_login'))
-
-        business_id = session['business_data'].get('id')
-
-        if not business_id:
-            flash('Business ID not found in session', 'error')
-            return redirect(url_for('business_login'))
+        business_id = current_business()['id']
 
         # Get form data with proper error handling
         gender = request.form.get('gender')
@@ -1094,23 +1124,16 @@ def business_analytics():
         year_str = request.form.get('year')
         loan_reason = request.form.get('loan_reason')
 
-        # Debug: Print what we're getting from the form
-        print(f"Debug - Gender: {gender}, Month: {month}, Year: {year_str}, Loan Reason: {loan_reason}")
-        print(f"Debug - Business ID: {business_id}")
-        print(f"Debug - All form data: {dict(request.form)}")
-
         # Validate and convert year
         if year_str is None or year_str == '':
             # Provide default year or handle the error
             year = datetime.now().year  # Use current year as default
-            print(f"Warning: No year provided, using default: {year}")
         else:
             try:
                 year = int(year_str)
-            except (ValueError, TypeError) as e:
-                print(f"Error converting year to int: {e}")
+            except (ValueError, TypeError):
+                logger.warning("Invalid year %r in business analytics filter, using the current year", year_str)
                 year = datetime.now().year  # Use current year as fallback
-                print(f"Using fallback year: {year}")
 
         # Validate other required fields
         if gender is None:
@@ -1118,23 +1141,34 @@ def business_analytics():
         if month is None:
             month = "All Months"  # Default value
 
-        print(f"Final values - Gender: {gender}, Month: {month}, Year: {year}, Loan Reason: {loan_reason}, Business ID: {business_id}")
-
         business_analytics_tool = BusinessAnalytics()
 
-        # Pass business_id to all method calls
-        total_loans_issued = business_analytics_tool.total_loans_issued(gender, month, year, business_id)
-        revenue_generated = business_analytics_tool.total_revenue_generated(gender, month, year, business_id)
-        default_rate = business_analytics_tool.default_rate(gender, month, year, business_id)
-        active_portfolio = business_analytics_tool.active_portfolio(gender, month, year, business_id)
+        # Pass business_id to all method calls; they are independent queries, so they run concurrently
+        calls = {
+            'total_loans_issued': lambda: business_analytics_tool.total_loans_issued(gender, month, year, business_id),
+            'revenue_generated': lambda: business_analytics_tool.total_revenue_generated(gender, month, year, business_id),
+            'default_rate': lambda: business_analytics_tool.default_rate(gender, month, year, business_id),
+            'active_portfolio': lambda: business_analytics_tool.active_portfolio(gender, month, year, business_id),
+            'interest_vs_transaction_costs_chart':
+                lambda: business_analytics_tool.interest_vs_transaction_costs_chart(gender, year, business_id),
+            'loan_repayments_vs_expenses_chart':
+                lambda: business_analytics_tool.loan_repayments_vs_expenses_chart(gender, year, business_id)
+        }
 
         # Only generate chart if loan_reason is provided
-        loan_reason_trend_chart = None
         if loan_reason:
-            loan_reason_trend_chart = business_analytics_tool.loan_reason_trend_chart(gender, year, loan_reason, business_id)
+            calls['loan_reason_trend_chart'] = \
+                lambda: business_analytics_tool.loan_reason_trend_chart(gender, year, loan_reason, business_id)
 
-        interest_vs_transaction_costs_chart = business_analytics_tool.interest_vs_transaction_costs_chart(gender, year, business_id)
-        loan_repayments_vs_expenses_chart = business_analytics_tool.loan_repayments_vs_expenses_chart(gender, year, business_id)
+        results = gather_calls(calls)
+
+        total_loans_issued = results['total_loans_issued']
+        revenue_generated = results['revenue_generated']
+        default_rate = results['default_rate']
+        active_portfolio = results['active_portfolio']
+        loan_reason_trend_chart = results.get('loan_reason_trend_chart')
+        interest_vs_transaction_costs_chart = results['interest_vs_transaction_costs_chart']
+        loan_repayments_vs_expenses_chart = results['loan_repayments_vs_expenses_chart']
 
         return render_template(
             'business_analytics.html',
@@ -1155,9 +1189,7 @@ def business_analytics():
 
     except Exception as e:
         # Log the full error for debugging
-        print(f"Error in business_analytics_dashboard: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Business analytics dashboard failed", extra={'business_id': business_id})
 
         # Return error page or default values
         return render_template(
@@ -1174,26 +1206,17 @@ def business_analytics():
 
 
 @app.route('/settings')
+@business_required()
 def settings():
-    # Ensure business session is active
-    if 'business_data' not in session:
-        flash('Business session expired. Please log into business first.', 'error')
-        return redirect(url_for('business_login'))
-
-    business_id = session['business_data'].get('id')
-
-    if not business_id:
-        flash('Business ID not found in session.', 'error')
-        return redirect(url_for('business_login'))
+    business_id = current_business()['id']
 
 
-    return render_template('settings.html', business_id=business_id)
+    return render_template('settings.html', business_id=business_id, max_keys_per_batch=MAX_KEYS_PER_BATCH)
 
 
 @app.route('/save-key', methods=['POST'])
 def save_key():
     """Save secret key using form data"""
-    print("=== SAVE-KEY FORM ENDPOINT CALLED ===")
 
     if session.get("user", {}).get("role") != "admin":
         flash("Access denied: Admins only.", "error")
@@ -1211,42 +1234,65 @@ def save_key():
 
     try:
         secret_key = request.form.get('secret_key')
-        print(f"Received key from form: {secret_key}")
 
         if not secret_key or len(secret_key.strip()) == 0:
             flash('Secret key cannot be empty', 'error')
             return redirect(url_for('settings'))
 
         settings_tool = Settings()
-
-        print(f"Attempting to save key: {secret_key} for business_id: {business_id}")
         response = settings_tool.save_secret_key(secret_key, business_id)
 
-        print(f"Save response: {response}")
-
-        if hasattr(response, 'data') and response.data:
-            print("Key saved successfully")
+        if response.get('success'):
             return redirect(url_for('key_success'))
         else:
-            flash('Key saved but no confirmation received', 'warning')
+            flash(response.get('message', 'Failed to save key'), 'error')
 
         return redirect(url_for('settings'))
 
     except ImportError as e:
         error_msg = f"Import error - Settings class not found: {str(e)}"
-        print(error_msg)
-        print(traceback.format_exc())
+        logger.exception(error_msg)
         flash(f'Server error: {error_msg}', 'error')
         return redirect(url_for('settings'))
 
     except Exception as e:
         error_msg = f"Server error: {str(e)}"
-        print(error_msg)
-        print(traceback.format_exc())
+        logger.exception("Saving a secret key failed", extra={'business_id': business_id})
         flash(f'Failed to save key: {error_msg}', 'error')
         return redirect(url_for('settings'))
 
 
+@app.route('/generate-keys', methods=['POST'])
+def generate_keys():
+    """Mints a batch of secret keys, e.g. for onboarding a whole branch, and shows them once"""
+    if session.get("user", {}).get("role") != "admin":
+        flash("Access denied: Admins only.", "error")
+        return render_template('unauthorized_access.html')
+
+    if 'business_data' not in session:
+        flash("Business session expired. Please log into business first.", "error")
+        return redirect(url_for('business_login'))
+
+    business_id = session['business_data'].get('id')
+    if not business_id:
+        flash("Business ID not found in session.", "error")
+        return redirect(url_for('business_login'))
+
+    try:
+        count = int(request.form.get('key_count', '1'))
+    except ValueError:
+        flash('Number of keys must be a whole number', 'error')
+        return redirect(url_for('settings'))
+
+    response = Settings().generate_secret_keys(business_id, count)
+    if not response['success']:
+        flash(response['message'], 'error')
+        return redirect(url_for('settings'))
+
+    # Rendered directly rather than redirected, so the keys are never stored in the session cookie
+    return render_template('key_success.html', business_id=business_id, keys=response['keys'])
+
+
 @app.route('/key-success')
 def key_success():
     # Check user role
@@ -1269,9 +1315,9 @@ def key_success():
 
 @app.route("/loan_repayment", methods=["GET", "POST"])
 def loan_repayment():
-    if session.get("user", {}).get("role") != "admin":
+    if session.get("user", {}).get("role") not in Repayment.POSTING_ROLES:
         # Block access
-        flash("Access denied: Admins only.", "error")
+        flash("Access denied: your role cannot post repayments.", "error")
         return render_template('unauthorized_access.html')
 
     # Get business_id from session
@@ -1287,12 +1333,10 @@ def loan_repayment():
 
     if request.method == "POST":
         nrc = request.form.get("nrc").strip()
-        print(f"Received NRC: {nrc}")
 
         repayment_tool = Repayment()
         # Pass business_id to show_loans method
         raw_loans = repayment_tool.show_loans(nrc, business_id)
-        print(f"Raw loans data: {raw_loans}")
 
         # Pass the raw loan data without modification
         return render_template(
@@ -1306,8 +1350,8 @@ def loan_repayment():
 
 @app.route("/repayment_form/<string:loan_id>", methods=["GET"])
 def repayment_form(loan_id):
-    if session.get("user", {}).get("role") != "admin":
-        flash("Access denied: Admins only.", "error")
+    if session.get("user", {}).get("role") not in Repayment.POSTING_ROLES:
+        flash("Access denied: your role cannot post repayments.", "error")
         return render_template('unauthorized_access.html')
 
     # Get business_id from session
@@ -1333,9 +1377,9 @@ def repayment_form(loan_id):
 
 @app.route("/process_repayment", methods=["POST"])
 def process_repayment():
-    if session.get("user", {}).get("role") != "admin":
+    if session.get("user", {}).get("role") not in Repayment.POSTING_ROLES:
         # Block access
-        flash("Access denied: Admins only.", "error")
+        flash("Access denied: your role cannot post repayments.", "error")
         return render_template('unauthorized_access.html')
 
     # Get business_id from session
@@ -1355,12 +1399,6 @@ def process_repayment():
     status = request.form.get("status")
     discount = request.form.get('discount')
 
-    print("Loan ID:", loan_id)
-    print("Amount:", amount)
-    print("Repayment Date:", repayment_date)
-    print("Status:", status)
-    print("Business ID:", business_id)
-
     try:
         # Run your submit_repayment method here
         repayment_tool = Repayment()
@@ -1381,12 +1419,50 @@ def process_repayment():
 
     except Exception as e:
         # Handle any errors that might occur during repayment processing
-        print(f"Error processing repayment: {e}")
+        logger.exception("Processing a repayment failed", extra={'business_id': business_id, 'loan_id': loan_id})
         # You could redirect to an error page or back to the form with an error message
         flash(f"Error processing repayment: {str(e)}", "error")
         return redirect(url_for('loan_repayment'))
 
 
+@app.route("/bulk_repayments", methods=["POST"])
+# Covers an import of up to Repayment.BULK_BATCH_SIZE rows; each further batch posts with one more RPC
+@query_budget(5)
+def bulk_repayments():
+    """Imports many repayments at once from an uploaded CSV file or a JSON array and reports on every row"""
+    if session.get("user", {}).get("role") not in Repayment.POSTING_ROLES:
+        return jsonify({'success': False, 'error': 'Access denied: your role cannot post repayments.'}), 403
+
+    if 'business_data' not in session:
+        return jsonify({'success': False, 'error': 'Business session expired. Please log into business first'}), 401
+
+    business_id = session['business_data'].get('id')
+
+    if not business_id:
+        return jsonify({'success': False, 'error': 'Business ID not found in session'}), 401
+
+    try:
+        repayment_tool = Repayment()
+        upload = request.files.get('file')
+
+        if upload and upload.filename:
+            rows = repayment_tool.read_repayments_csv(upload.stream)
+        else:
+            rows = request.get_json(silent=True)
+            if isinstance(rows, dict):
+                rows = rows.get('repayments')
+
+        if not isinstance(rows, list) or not rows:
+            return jsonify({'success': False, 'error': 'Upload a CSV file or send a JSON array of repayments'}), 400
+
+        report = repayment_tool.submit_repayments_bulk(rows, business_id)
+        return jsonify(report), 200 if report.get('rows') else 400
+
+    except Exception as e:
+        logger.exception("Importing repayments failed", extra={'business_id': business_id})
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/capital_management', methods=['POST', 'GET'])
 def capital_management():
     # Ensure business session is active
@@ -1470,8 +1546,8 @@ def capital_management():
 
             return render_template('capital_management.html', owners=owners)
 
-        except Exception as e:
-            print(f"Error in capital_management: {e}")
+        except Exception:
+            logger.exception("Capital management failed", extra={'business_id': business_id})
             flash('An unexpected error occurred. Please try again.', 'error')
             return render_template('capital_management.html', owners=owners)
 
@@ -1579,8 +1655,7 @@ def download_transactions():
             amount = None
 
     # Pass business_id to ensure only relevant transactions are processed
-    result = capital_tool.download_capital_transactions(start_date, end_date, user_name, amount, business_id)
-    print(f"DEBUG - Function result: {result}")
+    result = capital_tool.download_capital_transactions(start_date, end_date, business_id, user_name, amount)
 
     if hasattr(result, 'status_code') and result.status_code == 204:
         flash('No transactions found for the selected date range.', 'warning')
@@ -1630,20 +1705,13 @@ def expenses():
     )
 
 @app.route('/upload_expense_type', methods=['POST', 'GET'])
+@business_required()
 def upload_expense_type():
     if session.get("user", {}).get("role") != "admin":
         flash("Access denied: Admins only.", "error")
         return render_template('unauthorized_access.html')
 
-    # Check for valid business session
-    if 'business_data' not in session:
-        flash('Business session expired. Please log into business first.', 'error')
-        return redirect(url_for('business_login'))
-
-    business_id = session['business_data'].get('id')
-    if not business_id:
-        flash('Business ID not found in session.', 'error')
-        return redirect(url_for('business_login'))
+    business_id = current_business()['id']
 
     if request.method == 'POST':
         expense_tool = Expenses()
@@ -1655,8 +1723,8 @@ def upload_expense_type():
                 flash('Expense type uploaded successfully.', 'success')
             else:
                 flash('Error uploading expense type.', 'error')
-        except Exception as e:
-            print(f'Exception: {e}')
+        except Exception:
+            logger.exception("Uploading an expense type failed", extra={'business_id': business_id})
             flash('An unexpected error occurred.', 'error')
 
         return redirect(url_for('expenses'))
@@ -1688,8 +1756,8 @@ def record_expense():
                 flash('Expense type uploaded successfully.', 'success')
             else:
                 flash('Error uploading expense type.', 'error')
-        except Exception as e:
-            print(f'Exception: {e}')
+        except Exception:
+            logger.exception("Uploading an expense type failed", extra={'business_id': business_id})
             flash('An unexpected error occurred.', 'error')
 
         return redirect(url_for('expenses'))
@@ -1718,8 +1786,8 @@ def download_expenses_csv():
     expense_tool = Expenses()
     try:
         return expense_tool.download_csv(business_id, start_date, end_date)
-    except Exception as e:
-        print(f'Exception: {e}')
+    except Exception:
+        logger.exception("Expenses CSV download failed", extra={'business_id': business_id})
         flash('An error occurred while downloading the CSV.', 'error')
         return redirect(url_for('expenses'))
 
@@ -1743,23 +1811,16 @@ def download_expenses_csv():
 
 
 @app.route('/ai_agents')
+@business_required()
 def ai_agents():
-    # Check for valid business session
-    if 'business_data' not in session:
-        flash('Business session expired. Please log into business first.', 'error')
-        return redirect(url_for('business_login'))
-
-    business_id = session['business_data'].get('id')
-    if not business_id:
-        flash('Business ID not found in session.', 'error')
-        return redirect(url_for('business_login'))
-
-
-
     return render_template('ai_agents.html')
 
 
 
 
 if __name__ == '__main__':
+    # The reloader runs this file in a parent that only watches for changes and a child that serves
+    # requests; only the child starts the background workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        init_process()
     app.run(debug=True)
@@ -0,0 +1,135 @@
+from flask import Response, g, request
+from functools import wraps
+import logging
+import os
+import time
+from typing import Optional
+
+try:
+    from prometheus_client import (CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, REGISTRY,
+                                   generate_latest, multiprocess)
+except ImportError:
+    logging.warning("prometheus_client not installed. The /metrics endpoint will be disabled.")
+    CollectorRegistry = None
+
+import query_profiler
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Histogram buckets in seconds, from a cached lookup up to a slow upload
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+if CollectorRegistry is not None:
+    REQUEST_LATENCY = Histogram(
+        'http_request_duration_seconds', 'Flask request latency by route',
+        ['route', 'method', 'status'], buckets=LATENCY_BUCKETS
+    )
+    QUERY_LATENCY = Histogram(
+        'supabase_query_duration_seconds', 'Supabase PostgREST call latency by table or RPC',
+        ['table', 'method'], buckets=LATENCY_BUCKETS
+    )
+    QUERY_ROWS = Counter('supabase_query_rows_total', 'Rows returned by Supabase calls', ['table'])
+    METHOD_LATENCY = Histogram(
+        'service_method_duration_seconds', 'Latency of instrumented service-class methods',
+        ['method'], buckets=LATENCY_BUCKETS
+    )
+    CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by cache and result', ['cache', 'result'])
+    UPLOAD_LATENCY = Histogram(
+        'storage_upload_duration_seconds', 'Supabase storage upload latency by bucket',
+        ['bucket', 'outcome'], buckets=LATENCY_BUCKETS
+    )
+
+
+def metrics_enabled() -> bool:
+    """Returns whether prometheus_client is installed"""
+    return CollectorRegistry is not None
+
+
+def observe_query(query) -> None:
+    """Query listener feeding every Supabase call into the per-table metrics"""
+    QUERY_LATENCY.labels(query['table'], query['method']).observe(query['ms'] / 1000)
+    if query['rows']:
+        QUERY_ROWS.labels(query['table']).inc(query['rows'])
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Counts one cache lookup; hit ratio is hits / (hits + misses) per cache"""
+    if metrics_enabled():
+        CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def record_upload(bucket: str, seconds: float, success: bool) -> None:
+    """Records the duration of one storage upload"""
+    if metrics_enabled():
+        UPLOAD_LATENCY.labels(bucket, 'success' if success else 'failure').observe(seconds)
+
+
+def timed(name: Optional[str] = None):
+    """Decorator recording the latency of a service-class method"""
+    def decorator(function):
+        label = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics_enabled():
+                return function(*args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                METHOD_LATENCY.labels(label).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drops the live-gauge files of an exited gunicorn worker in multiprocess mode"""
+    if metrics_enabled() and os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+def _registry():
+    """
+    Returns the registry to expose. With PROMETHEUS_MULTIPROC_DIR set (required under gunicorn with several
+    workers) every worker writes its samples to that directory and they are merged on each scrape.
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def init_app(app) -> None:
+    """
+    Times every request by route and serves the metrics at /metrics. When METRICS_TOKEN is set the endpoint
+    requires it as a bearer token.
+    """
+    if not metrics_enabled():
+        return
+
+    query_profiler.add_query_listener(observe_query)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.get('metrics_started')
+        if started is not None and request.endpoint != 'metrics':
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(
+                time.perf_counter() - started)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        token = os.getenv('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f"Bearer {token}":
+            return Response('Unauthorized', status=401)
+
+        return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -1,11 +1,13 @@
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
+from metrics import timed
 from datetime import date, timedelta, datetime, UTC
-from dotenv import load_dotenv
 import os
 
-# Load environment variables
-load_dotenv()
-
 class OverviewMetrics:
     """Contains metrics for the overview dashboard"""
 
@@ -467,13 +469,16 @@ class OverviewMetrics:
             print(f"Error calculating total period expenses: {e}")
             return 0
 
+    @timed()
     def recent_borrowers(self, business_id):
         """Returns a dictionary of 4 recent borrowers including NRC number, issue date, and due date"""
         try:
+            # The borrower and files of each loan are embedded, so the table takes one round trip
             response = (
                 self.supabase
                 .table('loans')
-                .select('id, borrower_id, amount, status, created_at, due_date')
+                .select('id, borrower_id, amount, status, created_at, due_date, borrowers(name, nrc_number), '
+                        'files(docs, photos, thumbnails)')
                 .eq('business_id', business_id)
                 .order('id', desc=True)
                 .limit(4)
@@ -486,33 +491,11 @@ class OverviewMetrics:
             recent_borrowers = []
             for loan in response.data:
                 try:
-                    # Step 1: Get borrower name and NRC number
-                    borrower_info = (
-                        self.supabase
-                        .table('borrowers')
-                        .select('name, nrc_number')
-                        .eq('id', loan['borrower_id'])
-                        .eq('business_id', business_id)
-                        .execute()
-                    ).data
-
-                    if borrower_info:
-                        borrower_name = borrower_info[0]['name']
-                        nrc_number = borrower_info[0]['nrc_number']
-                    else:
-                        borrower_name = "Unknown"
-                        nrc_number = "N/A"
-
-                    # Step 2: Get files for the loan
-                    file_info = (
-                        self.supabase
-                        .table('files')
-                        .select('docs, photos')
-                        .eq('loan_id', loan['id'])
-                        .eq('business_id', business_id)
-                        .limit(1)
-                        .execute()
-                    ).data
+                    borrower_info = loan.get('borrowers') or {}
+                    borrower_name = borrower_info.get('name', "Unknown")
+                    nrc_number = borrower_info.get('nrc_number', "N/A")
+
+                    file_info = loan.get('files') or []
                     file_data = file_info[0] if file_info else {}
 
                     # FIX: Extract the first contract URL from the docs array
@@ -521,6 +504,10 @@ class OverviewMetrics:
 
                     collateral_photos = file_data.get('photos', []) if isinstance(file_data.get('photos'), list) else []
 
+                    # Loans uploaded before thumbnails existed fall back to the full photos
+                    thumbnails = file_data.get('thumbnails') if isinstance(file_data.get('thumbnails'), list) else []
+                    collateral_thumbnails = thumbnails if len(thumbnails) == len(collateral_photos) else collateral_photos
+
                     recent_borrowers.append({
                         'name': borrower_name,
                         'nrc_number': nrc_number,
@@ -529,7 +516,8 @@ class OverviewMetrics:
                         'issue_date': loan['created_at'],
                         'due_date': loan['due_date'],
                         'contract': contract,
-                        'collateral_photos': collateral_photos
+                        'collateral_photos': collateral_photos,
+                        'collateral_thumbnails': collateral_thumbnails
                     })
                 except Exception as e:
                     print(f"Error processing borrower data: {e}")
@@ -540,86 +528,47 @@ class OverviewMetrics:
             print(f"Error getting recent borrowers: {e}")
             return []
 
+    def location_borrowers(self, days, business_id):
+        """Returns the borrowers registered in the period with their location and loan amounts, in one query"""
+        period, today = self.get_period(days)
+
+        response = (
+            self.supabase
+            .table('borrowers')
+            .select('id, location, loans(amount)')
+            .eq('business_id', business_id)
+            .gt('created_at', period.isoformat())
+            .lt('created_at', today.isoformat())
+            .execute()
+        )
+        return [borrower for borrower in (response.data or []) if borrower.get('location')]
+
     def locations_ids(self, days, business_id):
         """returns a dictionary of locations and the borrowers ids that belong to that location"""
         try:
-            period, today = self.get_period(days)
-            start_date = period.isoformat()
-            end_date = today.isoformat()
-
-            # Step 1: Get location data within date range
-            current_cities = (
-                self.supabase
-                .table('borrowers')
-                .select('location')
-                .eq('business_id', business_id)
-                .gt('created_at', start_date)
-                .lt('created_at', end_date)
-                .execute()
-            )
-
-            if not current_cities.data or len(current_cities.data) == 0:
-                return {}
-
-            # Step 2: Get unique locations
-            unique_locations = list(dict.fromkeys(item['location'] for item in current_cities.data if item.get('location')))
-
-            # Step 3: Map each location to its borrower IDs within the same date range
             locations_borrowers_ids = {}
-            for city in unique_locations:
-                try:
-                    id_info = (
-                        self.supabase
-                        .table('borrowers')
-                        .select('id')
-                        .eq('business_id', business_id)
-                        .eq('location', city)
-                        .gt('created_at', start_date)
-                        .lt('created_at', end_date)
-                        .execute()
-                    )
-                    ids = [item['id'] for item in (id_info.data or [])]
-                    locations_borrowers_ids[city] = ids
-                except Exception as e:
-                    print(f"Error processing location {city}: {e}")
-                    locations_borrowers_ids[city] = []
+            for borrower in self.location_borrowers(days, business_id):
+                locations_borrowers_ids.setdefault(borrower['location'], []).append(borrower['id'])
 
             return locations_borrowers_ids
         except Exception as e:
             print(f"Error getting locations IDs: {e}")
             return {}
 
+    @staticmethod
+    def _location_totals(borrowers):
+        """Sums the loan amounts of the given borrowers per location"""
+        location_totals = {}
+        for borrower in borrowers:
+            total = sum(item['amount'] for item in (borrower.get('loans') or []) if item.get('amount') is not None)
+            location_totals[borrower['location']] = location_totals.get(borrower['location'], 0) + total
+
+        return {location: round(total, 2) for location, total in location_totals.items()}
+
     def location_totals(self, days, business_id):
         """Returns a dictionary of total loan amounts given to each location."""
         try:
-            location_ids = self.locations_ids(days, business_id)
-            if not location_ids:
-                return {}
-
-            location_totals = {}
-
-            for location, id_list in location_ids.items():
-                total = 0
-                for borrower_id in id_list:
-                    try:
-                        response = (
-                            self.supabase
-                            .table('loans')
-                            .select('amount')
-                            .eq('business_id', business_id)
-                            .eq('borrower_id', borrower_id)
-                            .execute()
-                        )
-                        # Sum all amounts in this borrower's loans
-                        if response.data and len(response.data) > 0:
-                            total += sum(item['amount'] for item in response.data if 'amount' in item)
-                    except Exception as e:
-                        print(f"Error processing borrower {borrower_id}: {e}")
-                        continue
-
-                location_totals[location] = round(total, 2)
-
-            return location_totals
+            return self._location_totals(self.location_borrowers(days, business_id))
         except Exception as e:
             print(f"Error calculating location totals: {e}")
             return {}
@@ -664,21 +613,21 @@ class OverviewMetrics:
     def borrowers_by_location(self, days, business_id):
         """Creates a dictionary summary of total borrowers, loans, and average loan per location."""
         try:
-            # Get data from existing methods
-            location_ids = self.locations_ids(days, business_id)
-            location_totals = self.location_totals(days, business_id)
-            location_averages = self.location_average_loan(days, business_id)
-
-            if not location_ids:
-                return {}
+            # Counts, totals and averages all come from the same borrowers, read once
+            borrowers = self.location_borrowers(days, business_id)
+            location_totals = self._location_totals(borrowers)
 
             summary = {}
-            for location in location_ids:
-                summary[location] = {
-                    "total_borrowers": len(location_ids[location]),
-                    "total_loans": f"{location_totals.get(location, 0):,.2f}",  # Format with commas
-                    "average_loan": f"{location_averages.get(location, 0):,.2f}"  # Format with commas
-                }
+            for borrower in borrowers:
+                location = borrower['location']
+                if location not in summary:
+                    summary[location] = {"total_borrowers": 0}
+                summary[location]["total_borrowers"] += 1
+
+            for location, entry in summary.items():
+                total = location_totals.get(location, 0)
+                entry["total_loans"] = f"{total:,.2f}"  # Format with commas
+                entry["average_loan"] = f"{round(total / entry['total_borrowers'], 2):,.2f}"  # Format with commas
 
             return summary
         except Exception as e:
@@ -694,12 +643,10 @@ class OverviewMetrics:
             start_date = today.isoformat()
             end_date = next_week.isoformat()
 
-            print(f"Looking for due dates between {start_date} and {end_date}")
-
             response = (
                 self.supabase
                 .table('loans')
-                .select('borrower_id, amount, interest_rate, due_date')
+                .select('borrower_id, amount, interest_rate, due_date, borrowers(name)')
                 .eq('business_id', business_id)
                 .gt('due_date', start_date)
                 .lt('due_date', end_date)
@@ -714,17 +661,8 @@ class OverviewMetrics:
             weekly_loans_due = []
             for info in response.data:
                 try:
-                    borrower_id = info["borrower_id"]
-                    # get the name of that id from the borrowers table
-                    borrower_info = (
-                        self.supabase
-                        .table('borrowers')
-                        .select('name')
-                        .eq('id', borrower_id)
-                        .eq('business_id', business_id)
-                        .execute()
-                    ).data
-                    borrower_name = borrower_info[0]['name'] if borrower_info and len(borrower_info) > 0 else "Unknown"
+                    # The borrower's name is embedded in the loan row
+                    borrower_name = (info.get('borrowers') or {}).get('name', "Unknown")
                     due_date = info["due_date"]
                     amount = info["amount"] + (info["amount"] * (info["interest_rate"] / 100))
                     loan_data = {
@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from lazy_imports import lazy_import
+bcrypt = lazy_import('bcrypt')
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# bcrypt work factor for new hashes; each step doubles the cost of hashing and of every login check
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+
+# Threads that hash at once, and how many more hashes may wait for one before logins are turned away.
+# bcrypt releases the GIL, so the threads run on separate cores while the rest of the app keeps serving.
+HASH_THREADS = int(os.getenv('PASSWORD_HASH_THREADS', str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_BACKLOG = int(os.getenv('PASSWORD_HASH_BACKLOG', str(HASH_THREADS * 8)))
+
+# Seconds a request waits for a place in the backlog before giving up
+HASH_WAIT = float(os.getenv('PASSWORD_HASH_WAIT', '5'))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when more passwords are waiting to be hashed than the backlog allows"""
+    pass
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """Returns the work factor of a bcrypt hash such as $2b$12$..., or None if it is not one"""
+    parts = hashed.split('$')
+    try:
+        return int(parts[2]) if len(parts) > 3 and parts[1].startswith('2') else None
+    except ValueError:
+        return None
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords with bcrypt on a small dedicated thread pool. A login burst then queues for
+    those threads instead of occupying every request thread with bcrypt, and once the backlog is full
+    further attempts fail fast with PasswordHasherBusy instead of piling up.
+    """
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, threads: int = HASH_THREADS, backlog: int = HASH_BACKLOG):
+        self.rounds = rounds
+        self.threads = threads
+        self.backlog = backlog
+        self._start()
+
+    def _start(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(self.threads + self.backlog)
+
+    def _run(self, function: Callable, *args, wait: bool = True):
+        """Runs a bcrypt call on the pool; waits for the result unless wait is False"""
+        if not self._slots.acquire(timeout=HASH_WAIT if wait else 0):
+            raise PasswordHasherBusy("Too many passwords waiting to be hashed")
+
+        try:
+            future = self._executor.submit(function, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result() if wait else future
+
+    def hash(self, password: str) -> str:
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Whether a stored hash was made with a different work factor than the current one"""
+        return hash_rounds(hashed) != self.rounds
+
+    def rehash_later(self, password: str, save: Callable[[str], None]) -> None:
+        """
+        Hashes the password with the current work factor in the background and passes the new hash to
+        save. Used right after a successful login, so the user does not wait for a second bcrypt run; if
+        the pool is busy the rehash is skipped and happens on a later login.
+        """
+        def rehash():
+            try:
+                salt = bcrypt.gensalt(rounds=self.rounds)
+                save(bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8'))
+            except Exception as e:
+                logger.warning("Rehashing a password failed: %s", e)
+
+        try:
+            self._run(rehash, wait=False)
+        except PasswordHasherBusy:
+            logger.info("Password hasher busy, rehash deferred to a later login")
+
+
+_hasher: Optional[PasswordHasher] = None
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Returns the process-wide password hasher, created on first use"""
+    global _hasher
+
+    with _hasher_lock:
+        if _hasher is None:
+            _hasher = PasswordHasher()
+        return _hasher
+
+
+def _reset_after_fork() -> None:
+    """Threads do not survive a fork, so a forked worker gets its own pool"""
+    global _hasher_lock
+    _hasher_lock = threading.Lock()
+    if _hasher is not None:
+        _hasher._start()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def login_throughput(rounds: int, threads: int, seconds: float = 3.0) -> float:
+    """Returns how many password checks per second a hasher with the given settings sustains"""
+    hasher = PasswordHasher(rounds=rounds, threads=threads, backlog=threads * 4)
+    hashed = bcrypt.hashpw(b'correct horse battery staple', bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+    checks = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        nonlocal checks
+        while time.perf_counter() < deadline:
+            hasher.verify('correct horse battery staple', hashed)
+            with lock:
+                checks += 1
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(threads * 2)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    return checks / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure login (bcrypt check) throughput per core.')
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 11, 12])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, HASH_THREADS])
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{'rounds':>6} {'threads':>7} {'logins/s':>9} {'per core':>9} {'ms/login':>9}")
+    for rounds in args.rounds:
+        for threads in sorted(set(args.threads)):
+            rate = login_throughput(rounds, threads, args.seconds)
+            per_core = rate / min(threads, os.cpu_count() or 1)
+            print(f"{rounds:>6} {threads:>7} {rate:>9.1f} {per_core:>9.1f} {1000 / per_core:>9.1f}")
@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, UTC
+from typing import Optional
+
+from subscription import Subscriptions, PENDING, EXPIRED
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class PaymentPoller:
+    """
+    Background thread that follows pending subscription payments to completion. Each cycle claims the
+    payments due for a check in one RPC, asks TuMeNy for their status and records the ones that finished;
+    payments nobody approved within PAYMENT_TIMEOUT expire. The TuMeNy webhook completes payments the same
+    way, so the poller is the fallback when a callback is lost.
+    """
+
+    # Seconds between two status checks of the same payment, also the lease held while checking it
+    CHECK_INTERVAL = int(os.getenv('PAYMENT_CHECK_INTERVAL', '10'))
+
+    # Seconds a payment may stay pending before it expires; mobile money prompts time out after a few minutes
+    PAYMENT_TIMEOUT = int(os.getenv('PAYMENT_TIMEOUT', '600'))
+
+    # Seconds the poller sleeps between cycles, and the most payments it checks per cycle
+    POLL_INTERVAL = int(os.getenv('PAYMENT_POLL_INTERVAL', '5'))
+    BATCH_SIZE = 20
+
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._worker_lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._subscription_tool = None
+
+    def _get_subscription_tool(self) -> Subscriptions:
+        """Creates the subscription tool inside the worker process on first use"""
+        if self._subscription_tool is None:
+            self._subscription_tool = Subscriptions()
+        return self._subscription_tool
+
+    def run_pending(self) -> int:
+        """Checks every payment that is currently due and returns how many finished"""
+        subscription_tool = self._get_subscription_tool()
+
+        payments = subscription_tool.supabase.rpc('claim_subscription_payments', {
+            'p_limit': self.BATCH_SIZE,
+            'p_lease_seconds': self.CHECK_INTERVAL
+        }).execute().data or []
+
+        finished = 0
+        deadline = datetime.now(UTC) - timedelta(seconds=self.PAYMENT_TIMEOUT)
+
+        for payment in payments:
+            payment_id = payment['payment_id']
+            status = subscription_tool.refresh_payment(payment_id)
+
+            if status in (PENDING, None) and datetime.fromisoformat(payment['created_at']) < deadline:
+                subscription_tool.complete_payment(payment_id, EXPIRED)
+                logger.info("Payment %s expired after %s checks", payment_id, payment['checks'])
+                status = EXPIRED
+
+            if status not in (PENDING, None):
+                finished += 1
+
+        return finished
+
+    def _work(self) -> None:
+        """Worker thread loop"""
+        while True:
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Payment poller error: {e}")
+
+            self._wakeup.wait(self.POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def wake(self) -> None:
+        """Makes the worker check for due payments now instead of at the end of its sleep"""
+        self._wakeup.set()
+
+    def start_worker(self) -> None:
+        """Starts the background worker of this process if it is not already running"""
+        if not os.getenv('TUMENY_API_KEY') or not os.getenv('TUMENY_API_SECRET'):
+            logger.warning("TUMENY_API_KEY or TUMENY_API_SECRET not set. Subscription payments will not be polled.")
+            return
+
+        with self._worker_lock:
+            # A worker thread does not survive a fork, so each process starts its own
+            if self._worker and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+
+            self._subscription_tool = None
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._work, name='payment-poller', daemon=True)
+            self._worker.start()
+
+
+_payment_poller: Optional[PaymentPoller] = None
+_payment_poller_lock = threading.Lock()
+
+
+def get_payment_poller() -> PaymentPoller:
+    """Returns the process-wide payment poller, created on first use"""
+    global _payment_poller
+
+    with _payment_poller_lock:
+        if _payment_poller is None:
+            _payment_poller = PaymentPoller()
+        return _payment_poller
@@ -0,0 +1,211 @@
+from flask import g, has_request_context, request
+from urllib.parse import unquote
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REST_PREFIX = '/rest/v1/'
+
+# Callables notified of every finished query, inside a request or not
+_query_listeners = []
+
+# Clients shared by every service object of this process, keyed by URL and key
+_clients: Dict[tuple, 'Client'] = {}
+_clients_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a request makes more database round trips than its route allows"""
+    pass
+
+
+def _rows_from_content_range(content_range: Optional[str]) -> Optional[int]:
+    """Returns the number of rows described by a PostgREST Content-Range header such as '0-24/*' or '*/0'"""
+    if not content_range:
+        return None
+
+    span = content_range.split('/')[0]
+    if span == '*':
+        return 0
+
+    try:
+        first, last = span.split('-')
+        return int(last) - int(first) + 1
+    except ValueError:
+        return None
+
+
+def _on_request(http_request) -> None:
+    """httpx request hook: notes when the query was sent"""
+    http_request.extensions['profiler_started'] = time.perf_counter()
+
+
+def add_query_listener(listener) -> None:
+    """Registers a callable that receives the record of every finished query"""
+    _query_listeners.append(listener)
+
+
+def _on_response(response) -> None:
+    """httpx response hook: records the finished query against the current Flask request"""
+    in_request = has_request_context()
+    if not in_request and not _query_listeners:
+        return
+
+    # Read the body here so the latency covers the whole transfer; postgrest reads it right after anyway
+    response.read()
+
+    http_request = response.request
+    started = http_request.extensions.get('profiler_started', time.perf_counter())
+    path = http_request.url.path
+    table = path.split(REST_PREFIX, 1)[-1] if REST_PREFIX in path else path
+
+    params = [(key, value) for key, value in http_request.url.params.multi_items()]
+
+    query = {
+        'method': http_request.method,
+        'table': table,
+        'select': next((value for key, value in params if key == 'select'), None),
+        'filters': [f"{key}={unquote(value)}" for key, value in params if key != 'select'],
+        'status': response.status_code,
+        'rows': _rows_from_content_range(response.headers.get('content-range')),
+        'bytes': len(response.content),
+        'ms': (time.perf_counter() - started) * 1000
+    }
+
+    record_query(query)
+
+
+def record_query(query: Dict[str, Any]) -> None:
+    """
+    Records a finished query for the query listeners and against the current Flask request. Called by the
+    httpx hook for real clients; stand-in clients such as benchmarks.FakeSupabase call it directly, so
+    query budgets also apply to them.
+    """
+    for listener in _query_listeners:
+        try:
+            listener(query)
+        except Exception as e:
+            logger.warning(f"Query listener failed: {e}")
+
+    if has_request_context():
+        g.setdefault('query_log', []).append(query)
+
+
+def instrument_client(client: 'Client') -> 'Client':
+    """Adds the profiler hooks to the PostgREST session of a Supabase client"""
+    session = client.postgrest.session
+    session.event_hooks['request'].append(_on_request)
+    session.event_hooks['response'].append(_on_response)
+    return client
+
+
+def create_client(supabase_url: str, supabase_key: str, options: Any = None) -> 'Client':
+    """
+    Drop-in replacement for supabase.create_client whose table and RPC calls are profiled per request.
+
+    Without options, every caller in a process gets the same client, so the service objects created on
+    each request reuse its pooled HTTP connections instead of opening new ones. The app never signs in
+    through client.auth, which would change the headers for every user of the shared client. The
+    supabase package is imported on the first call rather than at app start.
+    """
+    from supabase import create_client as create_supabase_client
+
+    if options is not None:
+        return instrument_client(create_supabase_client(supabase_url, supabase_key, options))
+
+    key = (supabase_url, supabase_key)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = instrument_client(create_supabase_client(supabase_url, supabase_key))
+        return _clients[key]
+
+
+def reset_clients() -> None:
+    """
+    Drops the shared clients so the next caller creates new ones. Runs in every forked child, where the
+    parent's pooled connections must not be reused.
+    """
+    global _clients_lock
+    _clients.clear()
+    _clients_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_clients)
+
+
+def query_budget(max_queries: int):
+    """Route decorator setting the most database round trips one request to the route may make"""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def request_queries() -> List[Dict[str, Any]]:
+    """Returns the queries recorded so far for the current request"""
+    return g.get('query_log', []) if has_request_context() else []
+
+
+def query_summary(queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals a list of recorded queries"""
+    return {
+        'count': len(queries),
+        'ms': sum(query['ms'] for query in queries),
+        'rows': sum(query['rows'] or 0 for query in queries),
+        'bytes': sum(query['bytes'] for query in queries)
+    }
+
+
+def init_app(app) -> None:
+    """
+    Reports every request's Supabase round trips in a Server-Timing header and a log line, and checks them
+    against the route's query_budget. Over-budget requests are logged, or fail when QUERY_BUDGET_ENFORCE is
+    set (as tests should do). Setting QUERY_PROFILER_DETAIL logs every query of every request.
+    """
+    app.config.setdefault('QUERY_BUDGET_ENFORCE', os.getenv('QUERY_BUDGET_ENFORCE', '').lower() in ('1', 'true'))
+    app.config.setdefault('QUERY_PROFILER_DETAIL', os.getenv('QUERY_PROFILER_DETAIL', '').lower() in ('1', 'true'))
+
+    @app.before_request
+    def start_query_log():
+        g.query_log = []
+
+    @app.after_request
+    def report_queries(response):
+        queries = request_queries()
+        summary = query_summary(queries)
+
+        response.headers['Server-Timing'] = (
+            f'db;dur={summary["ms"]:.1f};desc="{summary["count"]} queries, {summary["rows"]} rows, '
+            f'{summary["bytes"]} bytes"'
+        )
+
+        if queries:
+            logger.info(f"{request.method} {request.path} [{request.endpoint}]: {summary['count']} queries, "
+                        f"{summary['ms']:.1f} ms, {summary['rows']} rows, {summary['bytes']} bytes")
+
+        if app.config['QUERY_PROFILER_DETAIL']:
+            for query in queries:
+                logger.info(f"  {query['method']} {query['table']} {' '.join(query['filters'])} -> "
+                            f"{query['status']}, {query['rows']} rows, {query['bytes']} bytes, {query['ms']:.1f} ms")
+
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+
+        if budget is not None and summary['count'] > budget:
+            tables = ', '.join(query['table'] for query in queries)
+            message = f"{request.endpoint} made {summary['count']} queries, over its budget of {budget}: {tables}"
+
+            if app.config['QUERY_BUDGET_ENFORCE']:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from flask import request
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Proxies in front of the app that append to X-Forwarded-For, applied app-wide through ProxyFix in main.
+# 0 trusts only the socket address, which suits the development server; behind a load balancer every client
+# would then share the balancer's bucket, so gunicorn.conf.py defaults it to 1 for the container.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+
+
+class TokenBucketLimiter:
+    """
+    In-memory token buckets per key. Each key may make capacity attempts at once, and regains one every
+    1 / refill_rate seconds. Buckets live in the process, so with several workers each one limits
+    separately; that still bounds a brute-force attempt to a small multiple of the configured rate.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float, max_keys: int = 100000):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: str, cost: float = 1) -> bool:
+        """Takes cost tokens from the key's bucket and returns whether there were enough"""
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_rate)
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+
+            if len(self._buckets) >= self.max_keys and key not in self._buckets:
+                self._prune(now)
+            self._buckets[key] = (tokens, now)
+
+        return allowed
+
+    def _prune(self, now: float) -> None:
+        """Drops buckets that have refilled completely, which behave the same as a missing one"""
+        full_after = self.capacity / self.refill_rate
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < full_after}
+        if len(self._buckets) >= self.max_keys:
+            self._buckets.clear()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+# Per client address: bursts of 20 auth attempts, then one every 2 seconds
+_ip_limiter = TokenBucketLimiter(capacity=float(os.getenv('AUTH_RATE_LIMIT_IP_BURST', '20')),
+                                 refill_rate=float(os.getenv('AUTH_RATE_LIMIT_IP_PER_SECOND', '0.5')))
+
+# Per client address and email address: 5 attempts, then one every 30 seconds. Keyed on both, so someone
+# guessing a known user's password from elsewhere cannot lock that user out of their own logins.
+_email_limiter = TokenBucketLimiter(capacity=float(os.getenv('AUTH_RATE_LIMIT_EMAIL_BURST', '5')),
+                                    refill_rate=float(os.getenv('AUTH_RATE_LIMIT_EMAIL_PER_SECOND', '0.0333')))
+
+
+def client_address() -> str:
+    """Returns the address of the client making the current request, as resolved by ProxyFix"""
+    return request.remote_addr or 'unknown'
+
+
+def auth_attempt_allowed(scope: str, email: Optional[str] = None) -> bool:
+    """
+    Counts an authentication attempt against the client's address and, when given, against the client's
+    attempts on the email it targets. Returns False when either is over its limit, before any password
+    hashing or database query happens.
+    """
+    address = client_address()
+    allowed = _ip_limiter.allow(f"{scope}:{address}")
+
+    if email:
+        allowed = _email_limiter.allow(f"{scope}:{address}:{email.strip().lower()}") and allowed
+
+    if not allowed:
+        logger.warning("Rate limited %s attempt", scope, extra={'client': address, 'email': email})
+    return allowed
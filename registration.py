@@ -1,4 +1,10 @@
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
+from borrower_risk import BorrowerRisk
 from datetime import date, timedelta, datetime, UTC
 from dotenv import load_dotenv
 import os
@@ -19,6 +25,8 @@ class Registration:
         except Exception as e:
             raise ValueError(f"Failed to create Supabase client: {str(e)}")
 
+        self.risk_tool = BorrowerRisk()
+
     def check_borrower(self, nrc, business_id):
         """Checks if a borrower is registered in the database using the NRC number for a specific business"""
         try:
@@ -119,6 +127,8 @@ class Registration:
             if response and response.data and isinstance(response.data, list) and len(response.data) > 0:
                 loan_id = response.data[0].get('id')
                 if loan_id:
+                    # A new loan changes the borrower's exposure, so their stored risk is recomputed
+                    self.risk_tool.refresh_borrowers([raw_borrower_data['id']], business_id)
                     return loan_id
                 else:
                     return "Loan ID not returned from database"
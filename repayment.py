@@ -1,10 +1,16 @@
-from supabase import create_client, Client
+from query_profiler import create_client
+from metrics import timed
 import datetime
 import os
 import logging
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
 from decimal import Decimal, InvalidOperation
-from dotenv import load_dotenv
+from lazy_imports import lazy_import
+pd = lazy_import('pandas')
 
 # Import your registration module - assuming it exists
 try:
@@ -13,6 +19,12 @@ except ImportError:
     logging.warning("Registration module not found. Some functionality may be limited.")
     Registration = None
 
+try:
+    from borrower_risk import BorrowerRisk
+except ImportError:
+    logging.warning("BorrowerRisk module not found. Borrower risk will not be refreshed on repayment.")
+    BorrowerRisk = None
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,11 +36,20 @@ class RepaymentError(Exception):
 
 
 class Repayment:
+    # Statuses a repayment may set on its loan, and the loan statuses that can still receive repayments
+    REPAYMENT_STATUSES = ['Active', 'Completed', 'Default', 'Overdue']
+    REPAYABLE_STATUSES = ['Active', 'Overdue', 'Default']
+
+    # Session roles that may post repayments, one at a time or in bulk; REPAYMENT_ROLES=admin,agent lets field
+    # collection agents post the repayments they bring back
+    POSTING_ROLES = [role.strip() for role in os.getenv('REPAYMENT_ROLES', 'admin').split(',') if role.strip()]
+
+    # Columns of a bulk repayment import and rows posted per post_repayments call
+    BULK_COLUMNS = ['loan_id', 'amount', 'discount', 'repayment_date', 'status']
+    BULK_BATCH_SIZE = 500
+
     def __init__(self):
         try:
-            # Load environment variables
-            load_dotenv()
-
             url = os.getenv("SUPABASE_URL")
             service_role_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
@@ -52,6 +73,16 @@ class Repayment:
                 self.reg_tool = None
                 logger.warning("Registration module not available")
 
+            # Initialize borrower risk tool if available
+            if BorrowerRisk:
+                try:
+                    self.risk_tool = BorrowerRisk()
+                except Exception as e:
+                    logger.warning(f"Failed to initialize BorrowerRisk tool: {str(e)}")
+                    self.risk_tool = None
+            else:
+                self.risk_tool = None
+
         except Exception as e:
             logger.error(f"Failed to initialize Repayment class: {str(e)}")
             raise RepaymentError(f"Initialization failed: {str(e)}")
@@ -157,6 +188,7 @@ class Repayment:
             logger.error(f"Traceback: {traceback.format_exc()}")
             return []
 
+    @timed()
     def submit_repayment(self, loan_id, status: str, amount: Union[float, str, int],
                          repayment_date: str, discount: Union[float, str, int] = 0,
                          business_id=None) -> bool:
@@ -207,69 +239,29 @@ class Repayment:
             logger.info(
                 f"Processing repayment for loan {loan_id}: amount={amount}, discount={discount}, status={status}")
 
-            # Step 1: Insert repayment record
-            repayment_data = {
-                'loan_id': loan_id,
-                'amount': amount,
-                'repayment_date': repayment_date,
-                'discount': discount,
-                'business_id': business_id
-            }
-
-            logger.info("Inserting repayment record")
-            insert_response = self.supabase.table('repayments').insert(repayment_data).execute()
-
-            if not hasattr(insert_response, 'data') or not insert_response.data:
-                logger.error("Repayment insertion failed - no data returned")
-                return False
-
-            logger.info("Repayment recorded successfully")
-
-            # Step 2: Fetch current loan amount
-            logger.info(f"Fetching current loan data for ID: {loan_id} under business: {business_id}")
-            loan_response = (
-                self.supabase
-                .table('loans')
-                .select('amount')
-                .eq('id', loan_id)
-                .eq('business_id', business_id)
-                .execute()
-            )
-
-            if not hasattr(loan_response, 'data') or not loan_response.data:
-                logger.error(f"Loan with ID {loan_id} not found for business {business_id}")
-                return False
-
-            current_amount = loan_response.data[0].get('amount')
-            if current_amount is None:
-                logger.error(f"Loan {loan_id} has no amount field")
+            # Insert the repayment, lower the loan balance and set its status in one transaction
+            logger.info(f"Posting repayment for loan {loan_id} under business: {business_id}")
+            response = self.supabase.rpc('post_repayment', {
+                'p_loan_id': loan_id,
+                'p_business_id': business_id,
+                'p_amount': amount,
+                'p_discount': discount,
+                'p_repayment_date': repayment_date,
+                'p_status': status
+            }).execute()
+
+            if not hasattr(response, 'data') or not response.data:
+                logger.error("Repayment posting failed - no data returned")
                 return False
 
-            try:
-                current_amount = float(current_amount)
-                updated_amount = current_amount - amount - discount
-                if updated_amount < 0:
-                    logger.info(f"Loan amount would be negative ({updated_amount}), setting to 0")
-                    updated_amount = 0
-                logger.info(f"Updating loan amount from {current_amount} to {updated_amount}")
-            except (ValueError, TypeError) as e:
-                logger.error(f"Error calculating updated amount: {str(e)}")
-                return False
+            logger.info(
+                f"Repayment {response.data.get('repayment_id')} posted, loan {loan_id} balance is now "
+                f"{response.data.get('balance')} with status {response.data.get('status')}")
 
-            # Step 3: Update loan status only
-            logger.info(f"Updating loan {loan_id} status to {status}")
-            update_response = (
-                self.supabase
-                .table("loans")
-                .update({
-                    "status": status
-                })
-                .eq("id", loan_id)
-                .eq("business_id", business_id)
-                .execute()
-            )
+            # Refresh the borrower's stored risk now that the loan has changed
+            if self.risk_tool:
+                self.risk_tool.refresh_borrowers([response.data.get('borrower_id')], business_id)
 
-            logger.info("Loan status updated successfully")
             return True
 
         except Exception as e:
@@ -518,9 +510,9 @@ class Repayment:
                 validation_result['is_valid'] = False
                 validation_result['errors'].append("Repayment amount must be greater than 0")
 
-            # Check if amount exceeds remaining balance
-            current_loan_amount = float(loan_data.get('amount', 0))
-            # Ideally replace with self.get_remaining_balance(loan_id, business_id)
+            # Check if amount exceeds remaining balance, falling back to the principal for loans never repaid
+            balance = loan_data.get('balance')
+            current_loan_amount = float(balance if balance is not None else loan_data.get('amount', 0))
             if amount_float > current_loan_amount:
                 validation_result['warnings'].append(
                     f"Repayment amount ({amount_float}) exceeds remaining loan balance ({current_loan_amount})"
@@ -540,4 +532,161 @@ class Repayment:
 
         return validation_result
 
+    def read_repayments_csv(self, file_obj) -> List[Dict[str, Any]]:
+        """Reads an uploaded repayments CSV into row dicts, keeping every value as text for validation"""
+        frame = pd.read_csv(file_obj, dtype=str, keep_default_na=False, skipinitialspace=True)
+        frame.columns = [str(column).strip().lower() for column in frame.columns]
+        return frame.to_dict('records')
+
+    def validate_repayments_bulk(self, rows: List[Dict[str, Any]], business_id) -> 'pd.DataFrame':
+        """
+        Validates a batch of repayment rows in one pass. Returns a frame with one row per input row holding
+        the parsed values and an errors list; loans are checked against the business with a single query.
+        """
+        frame = pd.DataFrame(rows, columns=self.BULK_COLUMNS).reset_index(drop=True)
+        frame = frame.astype(object).where(frame.notna(), '')
+        frame['row'] = frame.index + 1
+
+        loan_id = pd.to_numeric(frame['loan_id'], errors='coerce')
+        amount = pd.to_numeric(frame['amount'], errors='coerce')
+        discount_text = frame['discount'].astype(str).str.strip()
+        discount = pd.to_numeric(discount_text.where(discount_text != '', '0'), errors='coerce')
+        repayment_date = pd.to_datetime(frame['repayment_date'].astype(str).str.strip(), errors='coerce', utc=True,
+                                        format='ISO8601')
+        status = frame['status'].astype(str).str.strip().str.capitalize()
+
+        checks = [
+            (loan_id.isna() | (loan_id % 1 != 0), "Invalid loan_id"),
+            (amount.isna(), "Invalid repayment amount"),
+            (amount.notna() & (amount <= 0), "Repayment amount must be greater than 0"),
+            (discount.isna(), "Invalid discount"),
+            (discount.notna() & (discount < 0), "Discount cannot be negative"),
+            (repayment_date.isna(), "Invalid repayment date. Expected ISO format (YYYY-MM-DD)"),
+            (~status.isin(self.REPAYMENT_STATUSES), f"Status must be one of {', '.join(self.REPAYMENT_STATUSES)}")
+        ]
+
+        # Look up every referenced loan of this business at once
+        candidate_ids = sorted({int(value) for value in loan_id.dropna() if value % 1 == 0})
+        loans = {}
+        if candidate_ids:
+            response = (
+                self.supabase
+                .table('loans')
+                .select('id, status')
+                .in_('id', candidate_ids)
+                .eq('business_id', business_id)
+                .execute()
+            )
+            loans = {loan['id']: (loan.get('status') or '').strip().capitalize() for loan in (response.data or [])}
+
+        loan_status = loan_id.map(lambda value: loans.get(int(value)) if pd.notna(value) and value % 1 == 0 else None)
+        checks.append((loan_id.notna() & loan_status.isna(), "Loan not found"))
+        checks.append((loan_status.notna() & ~loan_status.isin(self.REPAYABLE_STATUSES),
+                       "Cannot process repayment for loan with status: " + loan_status.fillna('')))
+
+        frame['errors'] = [[] for _ in range(len(frame))]
+        for failed, message in checks:
+            messages = message if isinstance(message, pd.Series) else pd.Series(message, index=frame.index)
+            for position in failed[failed].index:
+                frame.at[position, 'errors'].append(messages[position])
+
+        frame['loan_id'] = loan_id
+        frame['amount'] = amount
+        frame['discount'] = discount
+        frame['repayment_date'] = repayment_date
+        frame['status'] = status
+        return frame
+
+    @timed()
+    def submit_repayments_bulk(self, rows: List[Dict[str, Any]], business_id) -> Dict[str, Any]:
+        """
+        Validates and posts a batch of repayments for a specific business. Valid rows are posted in chunks
+        through the post_repayments function, which inserts the repayments and updates every affected loan in
+        one transaction per chunk. Returns a per-row report.
+        """
 
+        if not business_id:
+            logger.error("business_id is required")
+            return {'success': False, 'error': 'Missing business_id', 'posted': 0, 'rejected': 0, 'rows': []}
+
+        if not rows:
+            return {'success': False, 'error': 'No repayments provided', 'posted': 0, 'rejected': 0, 'rows': []}
+
+        try:
+            frame = self.validate_repayments_bulk(rows, business_id)
+        except Exception as e:
+            logger.error(f"Error validating bulk repayments for business {business_id}: {str(e)}")
+            return {'success': False, 'error': str(e), 'posted': 0, 'rejected': 0, 'rows': []}
+
+        valid = frame[frame['errors'].map(len) == 0]
+        results = {
+            row: {'row': row, 'loan_id': loan_id, 'status': 'rejected', 'errors': errors}
+            for row, loan_id, errors in zip(frame['row'], frame['loan_id'], frame['errors'])
+        }
+
+        payload = [
+            {
+                'row_number': int(row),
+                'loan_id': int(loan_id),
+                'amount': float(amount),
+                'discount': float(discount),
+                'repayment_date': repayment_date.isoformat(),
+                'status': status
+            }
+            for row, loan_id, amount, discount, repayment_date, status in zip(
+                valid['row'], valid['loan_id'], valid['amount'], valid['discount'], valid['repayment_date'],
+                valid['status']
+            )
+        ]
+
+        borrower_ids = []
+        for start in range(0, len(payload), self.BULK_BATCH_SIZE):
+            batch = payload[start:start + self.BULK_BATCH_SIZE]
+            try:
+                response = self.supabase.rpc('post_repayments', {
+                    'p_business_id': business_id,
+                    'p_rows': batch
+                }).execute()
+
+                result = response.data or {}
+                borrower_ids.extend(loan.get('borrower_id') for loan in (result.get('loans') or []))
+                applied = set(result.get('applied_rows') or [])
+            except Exception as e:
+                logger.error(f"Error posting repayment batch starting at row {batch[0]['row_number']}: {str(e)}")
+                for item in batch:
+                    results[item['row_number']].update({'status': 'failed', 'errors': [str(e)]})
+                continue
+
+            # Rows whose loan was removed or closed after validation are skipped by the database
+            for item in batch:
+                if item['row_number'] in applied:
+                    results[item['row_number']].update({'status': 'posted', 'errors': []})
+                else:
+                    results[item['row_number']].update({
+                        'status': 'rejected',
+                        'errors': ["Loan was closed or removed before the repayment could be posted"]
+                    })
+
+        report_rows = []
+        for item in results.values():
+            loan_id = item['loan_id']
+            item['loan_id'] = int(loan_id) if pd.notna(loan_id) and loan_id % 1 == 0 else rows[item['row'] - 1].get('loan_id')
+            report_rows.append(item)
+
+        posted = sum(1 for item in report_rows if item['status'] == 'posted')
+        rejected = sum(1 for item in report_rows if item['status'] == 'rejected')
+        failed = len(report_rows) - posted - rejected
+
+        logger.info(f"Bulk repayments for business {business_id}: {posted} posted, {rejected} rejected, {failed} failed")
+
+        # Refresh the stored risk of every borrower whose loans changed
+        if self.risk_tool and borrower_ids:
+            self.risk_tool.refresh_borrowers(borrower_ids, business_id)
+
+        return {
+            'success': failed == 0,
+            'posted': posted,
+            'rejected': rejected,
+            'failed': failed,
+            'rows': report_rows
+        }
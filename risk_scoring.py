@@ -0,0 +1,258 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
+from datetime import datetime, UTC
+import os
+import logging
+import time
+
+from lazy_imports import lazy_import
+np = lazy_import('numpy')
+
+from borrower_information import BorrowerInformation
+
+# Set up logging
+logging.basicConfig(level=logging.ERROR)
+logger = logging.getLogger(__name__)
+
+# Sentinel for "no date" once dates are held as integer day numbers (the int64 maximum)
+NO_DATE = 2 ** 63 - 1
+
+
+def _day_array(values):
+    """Converts ISO date/timestamp strings to a datetime64[D] array, with NaT for missing values"""
+    return np.array([value[:10] if value else 'NaT' for value in values], dtype='datetime64[D]')
+
+
+def book_arrays(loans, repayments):
+    """
+    Converts loan and repayment rows into the column arrays used by score_book.
+
+    Loans need id, borrower_id, business_id, status, created_at and due_date. Repayments need loan_id and
+    repayment_date; repayments of loans that are not in the book are ignored.
+    """
+    borrower_keys = np.array([str(loan.get('borrower_id')) for loan in loans])
+    unique_keys, first_index, borrower_index = np.unique(borrower_keys, return_index=True, return_inverse=True)
+
+    loan_positions = {loan.get('id'): position for position, loan in enumerate(loans)}
+    repayment_loan_index = np.array(
+        [loan_positions.get(repayment.get('loan_id'), -1) for repayment in repayments], dtype=np.int64
+    )
+    known = repayment_loan_index >= 0
+
+    return {
+        'borrower_ids': [loans[i].get('borrower_id') for i in first_index],
+        'business_ids': [loans[i].get('business_id') for i in first_index],
+        'borrower_index': borrower_index.astype(np.int64),
+        'status': np.array([loan.get('status') or '' for loan in loans]),
+        'created_at': _day_array([loan.get('created_at') for loan in loans]),
+        'due_date': _day_array([loan.get('due_date') for loan in loans]),
+        'repayment_loan_index': repayment_loan_index[known],
+        'repayment_date': _day_array([repayment.get('repayment_date') for repayment in repayments])[known]
+    }
+
+
+def score_book(arrays, today=None):
+    """
+    Scores every borrower of a book in one vectorized pass and returns one borrower_risk row per borrower.
+
+    Risk bands come from BorrowerInformation.risk_standings applied to the share of overdue loans, and
+    standing comes from BorrowerInformation.borrower_standings applied to the share of due loans that
+    have received repayments.
+    """
+    today = np.datetime64(today or datetime.now(UTC).date(), 'D')
+    today_day = today.astype(np.int64)
+
+    borrower_index = arrays['borrower_index']
+    borrower_count = len(arrays['borrower_ids'])
+    loan_count = len(borrower_index)
+
+    if borrower_count == 0:
+        return []
+
+    status = arrays['status']
+    overdue = status == 'Overdue'
+    missed = np.isin(status, ['Overdue', 'Default'])
+
+    total_loans = np.bincount(borrower_index, minlength=borrower_count)
+    overdue_loans = np.bincount(borrower_index, weights=overdue, minlength=borrower_count)
+    missed_payments = np.bincount(borrower_index, weights=missed, minlength=borrower_count)
+    default_percentage = overdue_loans / np.maximum(total_loans, 1) * 100
+
+    # Earliest repayment per loan, so lateness can be judged against the due date
+    repayment_loan_index = arrays['repayment_loan_index']
+    repayment_days = arrays['repayment_date']
+    dated = ~np.isnat(repayment_days)
+    first_repayment = np.full(loan_count, NO_DATE, dtype=np.int64)
+    np.minimum.at(first_repayment, repayment_loan_index[dated], repayment_days[dated].astype(np.int64))
+    has_repayment = np.bincount(repayment_loan_index, minlength=loan_count) > 0
+
+    due_date = arrays['due_date']
+    is_due = ~np.isnat(due_date) & (due_date < today)
+    on_time = is_due & (first_repayment <= due_date.astype(np.int64))
+
+    due_loans = np.bincount(borrower_index, weights=is_due, minlength=borrower_count)
+    repaid_due_loans = np.bincount(borrower_index, weights=is_due & has_repayment, minlength=borrower_count)
+    on_time_loans = np.bincount(borrower_index, weights=on_time, minlength=borrower_count)
+    repaid_percentage = repaid_due_loans / np.maximum(due_loans, 1) * 100
+    on_time_ratio = on_time_loans / np.maximum(due_loans, 1)
+
+    created_at = arrays['created_at']
+    created = ~np.isnat(created_at)
+    earliest_loan = np.full(borrower_count, NO_DATE, dtype=np.int64)
+    np.minimum.at(earliest_loan, borrower_index[created], created_at[created].astype(np.int64))
+    has_history = earliest_loan != NO_DATE
+    tenure_days = np.where(has_history, today_day - earliest_loan, 0)
+    customer_since = np.datetime_as_string(np.where(has_history, earliest_loan, 0).astype('datetime64[D]'))
+
+    # First matching band wins, exactly like the per-borrower loops in BorrowerInformation
+    risk_card = BorrowerInformation.risk_standings()
+    in_band = [(default_percentage >= low) & (default_percentage <= high) for low, high, _ in risk_card.values()]
+    risk_level = np.select(in_band, list(risk_card), default='no_risk')
+    risk_score = np.select(in_band, [score for _, _, score in risk_card.values()], default=100)
+
+    borrower_standings = BorrowerInformation.borrower_standings()
+    standing = np.select(
+        [repaid_percentage >= threshold for threshold in borrower_standings.values()],
+        list(borrower_standings),
+        default='bad standing'
+    )
+    standing = np.where(due_loans > 0, standing, 'Standing Not Determined Yet')
+
+    updated_at = datetime.now(UTC).isoformat()
+
+    return [
+        {
+            'borrower_id': borrower_id,
+            'business_id': business_id,
+            'risk_level': level,
+            'risk_score': score,
+            'standing': borrower_standing,
+            'default_percentage': round(percentage, 2),
+            'missed_payments': int(missed_count),
+            'total_loans': loans,
+            'on_time_ratio': round(ratio, 4),
+            'tenure_days': tenure,
+            'customer_since': since if history else None,
+            'updated_at': updated_at
+        }
+        for borrower_id, business_id, level, score, borrower_standing, percentage, missed_count, loans, ratio,
+            tenure, since, history in zip(
+            arrays['borrower_ids'], arrays['business_ids'], risk_level.tolist(), risk_score.tolist(),
+            standing.tolist(), default_percentage.tolist(), missed_payments.tolist(), total_loans.tolist(),
+            on_time_ratio.tolist(), tenure_days.tolist(), customer_since.tolist(), has_history.tolist()
+        )
+    ]
+
+
+class PortfolioRiskScoring:
+    """Scores the risk of every borrower in a book at once"""
+
+    def __init__(self):
+        try:
+            url = os.getenv("SUPABASE_URL")
+            service_role_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+            if not url or not service_role_key:
+                raise ValueError("SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY is not set.")
+
+            self.supabase: Client = create_client(url, service_role_key)
+        except Exception as e:
+            logger.error(f"Failed to initialize Supabase client: {e}")
+            raise
+
+    def _fetch_all(self, table, columns, business_id=None, page_size=1000):
+        """Reads every row of a table for a business (or for all businesses) page by page"""
+        rows = []
+        start = 0
+
+        while True:
+            query = self.supabase.table(table).select(columns)
+            if business_id:
+                query = query.eq('business_id', business_id)
+
+            page = query.order('id').range(start, start + page_size - 1).execute().data or []
+            rows.extend(page)
+
+            if len(page) < page_size:
+                return rows
+            start += page_size
+
+    def load_book(self, business_id=None):
+        """Returns the loans and repayments of a business, or of every business when none is given"""
+        loans = self._fetch_all('loans', 'id, borrower_id, business_id, status, created_at, due_date', business_id)
+        repayments = self._fetch_all('repayments', 'loan_id, repayment_date', business_id)
+        return loans, repayments
+
+    def score_business(self, business_id=None):
+        """Returns borrower_risk rows for every borrower of a business, or of every business when none is given"""
+        try:
+            loans, repayments = self.load_book(business_id)
+            rows = score_book(book_arrays(loans, repayments))
+
+            logger.info(f"Scored {len(rows)} borrowers from {len(loans)} loans and {len(repayments)} repayments")
+            return rows
+
+        except Exception as e:
+            logger.error(f"Error scoring book for business {business_id}: {e}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return []
+
+
+def synthetic_book(borrowers, loans_per_borrower=3, repayments_per_loan=2, seed=0):
+    """Builds a random book with the columns book_arrays expects, for benchmarking"""
+    rng = np.random.default_rng(seed)
+    loan_count = borrowers * loans_per_borrower
+    statuses = np.array(['Active', 'Overdue', 'Completed', 'Default'])
+
+    created = np.datetime64('2023-01-01') + rng.integers(0, 900, loan_count)
+    due = created + rng.integers(7, 120, loan_count)
+    loans = [
+        {
+            'id': loan_id,
+            'borrower_id': loan_id // loans_per_borrower,
+            'business_id': 'benchmark',
+            'status': status,
+            'created_at': f"{created_day}T09:30:00+00:00",
+            'due_date': str(due_day)
+        }
+        for loan_id, status, created_day, due_day in zip(
+            range(loan_count), statuses[rng.integers(0, 4, loan_count)].tolist(), created.tolist(), due.tolist()
+        )
+    ]
+
+    repayment_loans = rng.integers(0, loan_count, loan_count * repayments_per_loan)
+    repayment_days = created[repayment_loans] + rng.integers(0, 150, len(repayment_loans))
+    repayments = [
+        {'loan_id': loan_id, 'repayment_date': str(day)}
+        for loan_id, day in zip(repayment_loans.tolist(), repayment_days.tolist())
+    ]
+
+    return loans, repayments
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark vectorized portfolio risk scoring on a synthetic book.')
+    parser.add_argument('--borrowers', type=int, default=100_000)
+    parser.add_argument('--loans-per-borrower', type=int, default=3)
+    parser.add_argument('--repayments-per-loan', type=int, default=2)
+    args = parser.parse_args()
+
+    loans, repayments = synthetic_book(args.borrowers, args.loans_per_borrower, args.repayments_per_loan)
+
+    started = time.perf_counter()
+    arrays = book_arrays(loans, repayments)
+    converted = time.perf_counter()
+    rows = score_book(arrays)
+    finished = time.perf_counter()
+
+    print(f"{len(rows):,} borrowers, {len(loans):,} loans, {len(repayments):,} repayments")
+    print(f"  to arrays: {converted - started:.2f}s")
+    print(f"  scoring:   {finished - converted:.2f}s")
+    print(f"  total:     {finished - started:.2f}s")
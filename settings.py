@@ -1,6 +1,35 @@
 import os
 import datetime
-from supabase import create_client, Client
+import secrets
+import string
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from caching import TTLCache
+from query_profiler import create_client
+
+# Characters and length of generated registration keys, matching the keys the settings page used to make
+KEY_ALPHABET = string.ascii_uppercase + string.digits
+KEY_LENGTH = 10
+
+# Most keys minted by one request, e.g. for a whole branch of staff
+MAX_KEYS_PER_BATCH = int(os.getenv('SECRET_KEY_BATCH_LIMIT', '200'))
+
+# Key counts per business are reused for this many seconds. Keys added or removed through Settings, and keys
+# used up by a signup in this process, invalidate it; changes made by other processes show once it expires.
+_key_counts = TTLCache('secret_key_count', float(os.getenv('SECRET_KEY_COUNT_TTL', '60')))
+
+
+def invalidate_key_count(business_id) -> None:
+    """Drops a business's cached key count, e.g. after a signup used up one of its keys"""
+    _key_counts.invalidate(business_id)
+
+
+def generate_key() -> str:
+    """Returns a random registration key"""
+    return ''.join(secrets.choice(KEY_ALPHABET) for _ in range(KEY_LENGTH))
 
 
 class Settings:
@@ -53,6 +82,7 @@ class Settings:
             # Verify the insertion was successful
             if response.data and len(response.data) > 0:
                 print(f"Insert successful: {response}")
+                _key_counts.invalidate(business_id)
                 return {"success": True, "message": "Secret key saved successfully.", "data": response.data}
             else:
                 return {"success": False, "message": "Failed to save secret key - no data returned."}
@@ -61,6 +91,43 @@ class Settings:
             print(f"Error in save_secret_key: {str(e)}")
             return {"success": False, "message": f"Unexpected error: {str(e)}"}
 
+    def generate_secret_keys(self, business_id, count: int):
+        """Mints count new registration keys for a business and saves them all with one insert."""
+        try:
+            if not business_id:
+                return {"success": False, "message": "Business ID is required."}
+
+            if count <= 0 or count > MAX_KEYS_PER_BATCH:
+                return {"success": False, "message": f"Number of keys must be between 1 and {MAX_KEYS_PER_BATCH}."}
+
+            # Random keys; a set keeps a batch free of the (unlikely) repeat
+            keys = set()
+            while len(keys) < count:
+                keys.add(generate_key())
+
+            created_at = datetime.datetime.now(datetime.UTC).isoformat()
+            rows = [{"key": key, "business_id": business_id, "created_at": created_at} for key in keys]
+
+            response = self.supabase.table("secret_keys").insert(rows).execute()
+
+            if hasattr(response, 'error') and response.error:
+                print(f"Supabase error: {response.error}")
+                return {"success": False, "message": f"Database error: {response.error}"}
+
+            if not response.data:
+                return {"success": False, "message": "Failed to save secret keys - no data returned."}
+
+            _key_counts.invalidate(business_id)
+            return {
+                "success": True,
+                "message": f"Generated {len(response.data)} secret key(s).",
+                "keys": [row["key"] for row in response.data]
+            }
+
+        except Exception as e:
+            print(f"Error in generate_secret_keys: {str(e)}")
+            return {"success": False, "message": f"Unexpected error: {str(e)}"}
+
     def delete_expired_keys(self, business_id, hours: int = 24):
         """Deletes secret keys older than the specified number of hours (default: 24) for a specific business."""
         try:
@@ -70,26 +137,11 @@ class Settings:
 
             cutoff = (datetime.datetime.now(datetime.UTC) - datetime.timedelta(hours=hours)).isoformat()
 
-            # First, check if there are any keys to delete for this business
-            check_response = (
-                self.supabase
-                .table("secret_keys")
-                .select("id")
-                .eq("business_id", business_id)
-                .lt("created_at", cutoff)
-                .execute()
-            )
-
-            if not check_response.data or len(check_response.data) == 0:
-                return {"success": True, "message": "No expired keys found to delete.", "deleted_count": 0}
-
-            keys_to_delete = len(check_response.data)
-
-            # Proceed with deletion
+            # One delete that reports how many rows it removed, without sending them back
             response = (
                 self.supabase
                 .table("secret_keys")
-                .delete()
+                .delete(count="exact", returning="minimal")
                 .eq("business_id", business_id)
                 .lt("created_at", cutoff)
                 .execute()
@@ -99,8 +151,12 @@ class Settings:
                 print(f"Supabase error in delete: {response.error}")
                 return {"success": False, "message": f"Database error: {response.error}"}
 
-            # Check if deletion was successful
-            deleted_count = len(response.data) if response.data else keys_to_delete
+            deleted_count = response.count if response.count is not None else len(response.data or [])
+            if not deleted_count:
+                return {"success": True, "message": "No expired keys found to delete.", "deleted_count": 0}
+
+            _key_counts.invalidate(business_id)
+
             return {
                 "success": True,
                 "message": f"Successfully deleted {deleted_count} expired key(s).",
@@ -140,22 +196,27 @@ class Settings:
             print(f"Error in get_all_secret_keys: {str(e)}")
             return {"success": False, "message": f"Unexpected error: {str(e)}"}
 
-    def count_secret_keys(self, business_id):
-        """Returns the count of secret keys in the database for a specific business."""
+    def count_secret_keys(self, business_id, use_cache: bool = True):
+        """Returns the count of secret keys in the database for a specific business, cached for a short while."""
         try:
-            response = (
-                self.supabase
-                .table("secret_keys")
-                .select("id", count="exact")
-                .eq("business_id", business_id)
-                .execute()
-            )
+            count = _key_counts.get(business_id) if use_cache else None
 
-            if hasattr(response, 'error') and response.error:
-                print(f"Supabase error: {response.error}")
-                return {"success": False, "message": f"Database error: {response.error}"}
+            if count is None:
+                response = (
+                    self.supabase
+                    .table("secret_keys")
+                    .select("id", count="exact")
+                    .eq("business_id", business_id)
+                    .limit(1)
+                    .execute()
+                )
 
-            count = response.count if hasattr(response, 'count') else (len(response.data) if response.data else 0)
+                if hasattr(response, 'error') and response.error:
+                    print(f"Supabase error: {response.error}")
+                    return {"success": False, "message": f"Database error: {response.error}"}
+
+                count = response.count if response.count is not None else len(response.data or [])
+                _key_counts.set(business_id, count)
 
             return {
                 "success": True,
@@ -202,6 +263,7 @@ class Settings:
                 return {"success": False, "message": f"Database error: {response.error}"}
 
             if response.data and len(response.data) > 0:
+                _key_counts.invalidate(business_id)
                 return {"success": True, "message": "Secret key deleted successfully."}
             else:
                 return {"success": False, "message": "Failed to delete secret key."}
@@ -214,7 +276,7 @@ class Settings:
         """Comprehensive cleanup method that removes expired keys for a specific business and returns cleanup statistics."""
         try:
             # Get count before cleanup
-            before_count = self.count_secret_keys(business_id)
+            before_count = self.count_secret_keys(business_id, use_cache=False)
             if not before_count["success"]:
                 return before_count
 
@@ -223,19 +285,46 @@ class Settings:
             if not cleanup_result["success"]:
                 return cleanup_result
 
-            # Get count after cleanup
-            after_count = self.count_secret_keys(business_id)
-            if not after_count["success"]:
-                return after_count
+            # The delete reports how many rows it removed, so the count after needs no second query. A signup
+            # may use up a key in between, so the result is not cached and is kept from going negative.
+            deleted_count = cleanup_result.get("deleted_count", 0)
+            after_count = max(before_count["count"] - deleted_count, 0)
 
             return {
                 "success": True,
-                "message": f"Cleanup completed. Removed {cleanup_result.get('deleted_count', 0)} expired key(s).",
+                "message": f"Cleanup completed. Removed {deleted_count} expired key(s).",
                 "before_count": before_count["count"],
-                "after_count": after_count["count"],
-                "deleted_count": cleanup_result.get("deleted_count", 0)
+                "after_count": after_count,
+                "deleted_count": deleted_count
             }
 
         except Exception as e:
             print(f"Error in cleanup_database: {str(e)}")
             return {"success": False, "message": f"Cleanup failed: {str(e)}"}
+
+    def sweep_expired_keys(self, hours: int = 24):
+        """
+        Deletes the secret keys older than the given number of hours for every business with one statement,
+        and returns how many were removed per business. Run on a schedule instead of cleaning up per business.
+        """
+        try:
+            if hours <= 0:
+                return {"success": False, "message": "Hours must be a positive number."}
+
+            response = self.supabase.rpc('delete_expired_secret_keys', {'p_hours': hours}).execute()
+
+            deleted = {row['business_id']: row['deleted_count'] for row in response.data or []}
+            for business_id in deleted:
+                _key_counts.invalidate(business_id)
+
+            total = sum(deleted.values())
+            return {
+                "success": True,
+                "message": f"Deleted {total} expired key(s) across {len(deleted)} business(es).",
+                "deleted_count": total,
+                "deleted_by_business": deleted
+            }
+
+        except Exception as e:
+            print(f"Error in sweep_expired_keys: {str(e)}")
+            return {"success": False, "message": f"Sweep failed: {str(e)}"}
@@ -1,12 +1,78 @@
 import os
 import datetime
+import logging
 import textwrap
-
-from supabase import create_client, Client
-import requests
+import threading
 import time
-import smtplib
-from email.message import EmailMessage
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
+from lazy_imports import lazy_import
+from caching import RefreshAheadValue, parse_expiry
+from business_context import BusinessContext, invalidate_business_context
+requests = lazy_import('requests')
+from email_queue import get_email_queue
+from typing import Any, Dict, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Payment statuses; a payment starts pending and ends in exactly one of the others
+PENDING = 'pending'
+SUCCESS = 'success'
+FAILED = 'failed'
+EXPIRED = 'expired'
+FINAL_STATUSES = (SUCCESS, FAILED, EXPIRED)
+
+# Seconds an exchange rate is reused, and the token lifetime assumed when TuMeNy does not say
+EXCHANGE_RATE_TTL = int(os.getenv('EXCHANGE_RATE_TTL', '3600'))
+DEFAULT_TOKEN_TTL = 3000
+
+# A token is treated as expired this many seconds early, so it never runs out while a request is in flight
+TOKEN_EXPIRY_MARGIN = 60
+
+# HTTP session and cached token and rate shared by every Subscriptions object of this process
+_session = None
+_shared_values: Dict[tuple, RefreshAheadValue] = {}
+_shared_lock = threading.Lock()
+
+
+def tumeny_session():
+    """
+    Returns the process-wide requests session for TuMeNy and the exchange-rate API, so checkouts and the
+    payment poller reuse open TLS connections instead of setting up a new one per call.
+    """
+    global _session
+
+    with _shared_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def _shared_value(key: tuple, name: str, loader) -> RefreshAheadValue:
+    """Returns the process-wide cached value for a key, created with the loader on first use"""
+    with _shared_lock:
+        if key not in _shared_values:
+            _shared_values[key] = RefreshAheadValue(name, loader)
+        return _shared_values[key]
+
+
+def _reset_after_fork() -> None:
+    """A forked worker opens its own connections; the cached token and rate stay valid"""
+    global _session, _shared_lock
+    _session = None
+    _shared_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 class Subscriptions:
@@ -25,59 +91,77 @@ class Subscriptions:
         if not self.tumeny_api_key or not self.tumeny_api_secret:
             raise Exception("Missing TUMENY_API_KEY or TUMENY_API_SECRET in environment variables.")
 
-        # Generate auth token
-        self.tumeny_token, self.token_expiry = self.get_tumeny_auth_token()
-        print(f" TuMeNy token acquired: {self.tumeny_token[:10]}...")
-
-        self.headers = {
-            "Authorization": f"Bearer {self.tumeny_token}",
-            "Content-Type": "application/json"
-        }
-
-        self.base_url = os.getenv('https://tumeny.herokuapp.com/api/token')
+        # Overridable so tests can point the app at the fake server in fake_tumeny.py
+        self.base_url = os.getenv('TUMENY_BASE_URL', 'https://tumeny.herokuapp.com').rstrip('/')
 
         # EXCHANGE RTE API
         self.exchange_rate_url = os.getenv('EXCHANGE_RATE_URL')
 
+        # The auth token and exchange rate are fetched on first use and then shared by the whole process
+        # until shortly before they expire; a background refresh replaces them before callers have to wait
+        self.session = tumeny_session()
+        self.token_cache = _shared_value(('tumeny_token', self.base_url, self.tumeny_api_key),
+                                         'tumeny_token', self._load_token)
+        self.rate_cache = _shared_value(('exchange_rate', self.exchange_rate_url),
+                                        'exchange_rate', self._load_exchange_rate)
 
-        # email configuration
-        self.email_password = os.getenv('EMAIL_KEY')
-        self.sender_email = os.getenv('SENDER_EMAIL')
 
     def get_tumeny_auth_token(self):
-        url = "https://tumeny.herokuapp.com/api/token"
+        url = f"{self.base_url}/api/token"
         headers = {
             "apiKey": self.tumeny_api_key,
             "apiSecret": self.tumeny_api_secret
         }
-        response = requests.post(url, headers=headers)
+        response = self.session.post(url, headers=headers, timeout=15)
         if response.status_code == 200:
             data = response.json()
             return data['token'], data['expireAt']
         else:
             raise Exception(f"Failed to get TuMeNy token: {response.text}")
 
-    def convert_to_zmw(self, amount):
-        """Converts the USD amount to ZMW and returns the converted value"""
-        response = requests.get(self.exchange_rate_url)
+    def _load_token(self) -> Tuple[str, float]:
+        """Token cache loader: a new token and the time it should stop being used"""
+        token, expire_at = self.get_tumeny_auth_token()
+        return token, parse_expiry(expire_at, DEFAULT_TOKEN_TTL) - TOKEN_EXPIRY_MARGIN
+
+    def _load_exchange_rate(self) -> Tuple[float, float]:
+        """Rate cache loader: the current USD to ZMW rate, reused for EXCHANGE_RATE_TTL seconds"""
+        response = self.session.get(self.exchange_rate_url, timeout=10)
         data = response.json()
 
         # Make sure the API returned success and contains the rate
         rate = data.get("conversion_rate")
-        if rate:
-            return round(amount * rate, 2)
-        else:
+        if not rate:
             raise ValueError("Failed to fetch exchange rate.")
+        return rate, time.time() + EXCHANGE_RATE_TTL
 
-    def request_payment(self, amount, first_name, last_name, email, phone, plan):
-        """Requests a payment using TuMeNy API and returns the payment ID"""
-        url = "https://tumeny.herokuapp.com/api/v1/payment"
-
-        headers = {
-            "Authorization": f"Bearer {self.tumeny_token}",
+    def auth_headers(self) -> Dict[str, str]:
+        """Returns the TuMeNy request headers with the cached auth token"""
+        return {
+            "Authorization": f"Bearer {self.token_cache.get()}",
             "Content-Type": "application/json"
         }
 
+    def _tumeny_request(self, method: str, url: str, **kwargs):
+        """
+        Sends an authorized TuMeNy request. A 401 means the cached token was revoked or expired early,
+        so it is dropped and the request is sent once more with a new one.
+        """
+        response = self.session.request(method, url, headers=self.auth_headers(), **kwargs)
+        if response.status_code == 401:
+            logger.info("TuMeNy rejected the cached token, fetching a new one")
+            self.token_cache.invalidate()
+            response = self.session.request(method, url, headers=self.auth_headers(), **kwargs)
+        return response
+
+    def convert_to_zmw(self, amount):
+        """Converts the USD amount to ZMW with the cached rate and returns the converted value"""
+        return round(amount * self.rate_cache.get(), 2)
+
+    def request_payment(self, amount, first_name, last_name, email, phone, plan):
+        """Requests a payment using TuMeNy API and returns the payment ID"""
+        url = f"{self.base_url}/api/v1/payment"
+
         try:
             zmw_amount = self.convert_to_zmw(amount)
 
@@ -90,7 +174,7 @@ class Subscriptions:
                 "amount": zmw_amount
             }
 
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = self._tumeny_request('POST', url, json=payload, timeout=30)
             response_data = response.json()
 
             if response.status_code == 200 and 'payment' in response_data:
@@ -102,107 +186,146 @@ class Subscriptions:
         except requests.exceptions.Timeout:
             return {'success': False, 'message': 'Payment request timed out.'}
         except requests.exceptions.RequestException as e:
-            print(f'Payment request exception: {e}')
+            logger.warning("Payment request exception: %s", e)
             return {'success': False, 'message': 'Payment service unavailable.'}
         except Exception as e:
-            print(f'Unexpected error: {e}')
+            logger.exception("Unexpected error requesting payment: %s", e)
             return {'success': False, 'message': 'Unexpected error occurred.'}
 
 
     def check_business_pay_status(self, business_id):
-        """checks if the business has a paid subscription or not"""
+        """checks if the business has a paid subscription or not, from its briefly cached context"""
         try:
-            response = self.supabase.table('business_users').select('paid').eq('id', business_id).execute()
-            return response.data[0]['paid']
-        except Exception as e:
-            print(f'Exception: {e}')
+            return BusinessContext().load(business_id)['paid']
+        except Exception:
+            logger.exception("Error checking the pay status of business %s", business_id)
+            return False
 
 
-    def check_payment_status_with_retries(self, payment_id, max_attempts=5, delay_seconds=10):
+    def fetch_payment_status(self, payment_id) -> Optional[str]:
         """
-        Polls the TuMeNy API to check payment status every `delay_seconds` up to `max_attempts`.
-        Returns True if payment succeeded, False otherwise.
+        Asks TuMeNy once for the status of a payment. Returns 'success', 'failed' or 'pending', or None
+        when the status could not be read and the check should simply be tried again later.
         """
-        url = f"https://tumeny.herokuapp.com/api/v1/payment/{payment_id}"
-        headers = {
-            "Authorization": f"Bearer {self.tumeny_token}"
-        }
-
-        for attempt in range(max_attempts):
-            try:
-                response = requests.get(url, headers=headers, timeout=10)
-                if response.status_code == 200:
-                    data = response.json()
-                    status = data['payment']['status'].lower()
-                    print(f"[Attempt {attempt + 1}] Payment status: {status}")
-
-                    if status == "success":
-                        return True
-                    elif status == "failed":
-                        return False
-
-                else:
-                    print(f"Unexpected status code: {response.status_code}")
-            except Exception as e:
-                print(f"Error checking payment status: {e}")
+        url = f"{self.base_url}/api/v1/payment/{payment_id}"
 
-            print(f"Waiting {delay_seconds} seconds before next attempt...")
-            time.sleep(delay_seconds)
+        try:
+            response = self._tumeny_request('GET', url, timeout=10)
+            if response.status_code != 200:
+                logger.warning("Unexpected status code %s checking payment %s", response.status_code, payment_id)
+                return None
 
-        return False  # After all attempts, still not successful
+            status = response.json()['payment']['status'].lower()
+        except Exception as e:
+            logger.warning("Error checking payment %s: %s", payment_id, e)
+            return None
 
+        return status if status in (SUCCESS, FAILED) else PENDING
 
-    def buy_plan(self, business_id, amount, first_name, last_name, email, phone, plan):
-        """Handles the buying of a selected plan and updates payment status in a database"""
+    def buy_plan(self, business_id, amount, first_name, last_name, email, phone, plan) -> Optional[str]:
+        """
+        Starts the purchase of a plan and returns the payment ID without waiting for the customer to
+        approve the mobile money prompt. The payment is recorded as pending; the payment poller or the
+        TuMeNy webhook completes it and marks the business as paid, and the browser follows it through
+        payment_status. Returns None if the payment could not be requested.
+        """
         try:
-            # Step 1: Request payment
             result = self.request_payment(amount, first_name, last_name, email, phone, plan)
 
             if not result.get("success"):
-                print("Failed to initiate payment:", result.get("message"))
-                return False
+                logger.warning("Failed to initiate payment for business %s: %s", business_id, result.get("message"))
+                return None
 
             payment_id = result.get("payment_id")
             if not payment_id:
-                print("No payment ID returned from payment request.")
-                return False
+                logger.warning("No payment ID returned from payment request for business %s", business_id)
+                return None
+
+            self.supabase.table('subscription_payments').insert({
+                'payment_id': str(payment_id),
+                'business_id': business_id,
+                'plan': plan,
+                'amount': amount,
+                'email': email,
+                'first_name': first_name,
+                'last_name': last_name,
+                'phone': phone,
+                'status': PENDING
+            }).execute()
+
+            logger.info("Payment %s pending for business %s", payment_id, business_id)
+            return str(payment_id)
+
+        except Exception:
+            logger.exception("Unexpected error starting plan purchase for business %s", business_id)
+            return None
+
+    def payment_status(self, payment_id, business_id) -> Optional[Dict[str, Any]]:
+        """Returns the stored payment if it belongs to the business; one indexed read, no TuMeNy call"""
+        response = (
+            self.supabase.table('subscription_payments')
+            .select('payment_id, status, plan, amount, email, first_name, last_name')
+            .eq('payment_id', str(payment_id))
+            .eq('business_id', business_id)
+            .limit(1)
+            .execute()
+        )
+        return response.data[0] if response.data else None
+
+    def stored_status(self, payment_id) -> Optional[str]:
+        """Returns the recorded status of a payment, or None if there is no such payment; no TuMeNy call"""
+        response = (
+            self.supabase.table('subscription_payments')
+            .select('status')
+            .eq('payment_id', str(payment_id))
+            .limit(1)
+            .execute()
+        )
+        return response.data[0]['status'] if response.data else None
+
+    def complete_payment(self, payment_id, status: str) -> bool:
+        """
+        Records a payment's final status, marking the business as paid on success. Sends the receipt only
+        if this call is the one that completed the payment. Returns whether the payment changed.
+        """
+        result = self.supabase.rpc('complete_subscription_payment', {
+            'p_payment_id': str(payment_id),
+            'p_status': status
+        }).execute().data or {}
 
-            is_paid = self.check_payment_status_with_retries(payment_id)
-            if not is_paid:
-                print("Payment was not completed or failed.")
-                return False
+        payment = result.get('payment') or {}
+        if not result.get('changed'):
+            return False
 
-            # Step 2: Update the database
-            update_response = self.supabase.table('business_users') \
-                .update({'paid': True}) \
-                .eq('id', business_id) \
-                .execute()
+        logger.info("Payment %s %s for business %s", payment_id, status, payment.get('business_id'))
 
-            if not update_response or not getattr(update_response, 'data', None):
-                print("Failed to update 'paid' status in database.")
-                return False
+        # The business's paid status and plan just changed
+        invalidate_business_context(payment.get('business_id'))
 
-            # Step 3: Send email receipt
+        if status == SUCCESS:
             try:
                 self.send_receipt_by_email(
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name,
-                    amount=amount,
-                    plan=plan,
-                    phone=phone
+                    email=payment.get('email'),
+                    first_name=payment.get('first_name'),
+                    last_name=payment.get('last_name'),
+                    amount=payment.get('amount'),
+                    plan=payment.get('plan'),
+                    phone=payment.get('phone')
                 )
             except Exception as e:
-                print(f"Failed to send receipt email: {e}")
+                logger.warning("Failed to queue receipt email for payment %s: %s", payment_id, e)
 
-            return True
+        return True
 
-        except Exception as e:
-            print("Unexpected error during plan purchase:", e)
-            return False
+    def refresh_payment(self, payment_id) -> Optional[str]:
+        """Checks a payment with TuMeNy once and records it if it has finished; returns the status seen"""
+        status = self.fetch_payment_status(payment_id)
+        if status in FINAL_STATUSES:
+            self.complete_payment(payment_id, status)
+        return status
 
     def send_receipt_by_email(self, email, first_name, last_name, amount, plan, phone):
-        """Sends a receipt of the amount paid to the email"""
+        """Queues a receipt of the amount paid for the email"""
 
         subject = f"Subscription for {plan} at InXource Dashboard"
         body = textwrap.dedent(f"""
@@ -221,17 +344,5 @@ class Subscriptions:
             InXource Team
         """)
 
-        msg = EmailMessage()
-        msg['Subject'] = subject
-        msg['From'] = self.sender_email
-        msg['To'] = email
-        msg.set_content(body)
-
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            smtp.login(self.sender_email, self.email_password)
-            smtp.send_message(msg)
-            print("Receipt email sent successfully.")
-
-
-
-
+        # Sent by the email queue's worker; the SMTP connection is not opened here
+        get_email_queue().enqueue(email, subject, body, kind='receipt')
@@ -0,0 +1,19 @@
+-- Per-borrower risk and standing, kept up to date by BorrowerRisk (borrower_risk.py)
+create table if not exists public.borrower_risk (
+    borrower_id bigint primary key references public.borrowers (id) on delete cascade,
+    business_id uuid not null,
+    risk_level text not null,
+    risk_score integer not null,
+    standing text not null,
+    default_percentage numeric not null default 0,
+    missed_payments integer not null default 0,
+    total_loans integer not null default 0,
+    customer_since date,
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists borrower_risk_business_score_idx
+    on public.borrower_risk (business_id, risk_score);
+
+create index if not exists borrower_risk_business_level_idx
+    on public.borrower_risk (business_id, risk_level);
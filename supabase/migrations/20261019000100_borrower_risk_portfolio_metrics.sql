@@ -0,0 +1,4 @@
+-- Metrics produced by the portfolio risk scoring engine (risk_scoring.py)
+alter table public.borrower_risk
+    add column if not exists on_time_ratio numeric not null default 0,
+    add column if not exists tenure_days integer not null default 0;
@@ -0,0 +1,52 @@
+-- Remaining balance per loan, kept separate from amount which analytics read as the principal
+alter table public.loans
+    add column if not exists balance numeric;
+
+-- Records a repayment, lowers the loan balance and sets the loan status in one transaction.
+-- The loan row is locked first so concurrent postings on the same loan are applied one after another.
+create or replace function public.post_repayment(
+    p_loan_id bigint,
+    p_business_id uuid,
+    p_amount numeric,
+    p_discount numeric,
+    p_repayment_date timestamptz,
+    p_status text
+)
+returns json
+language plpgsql
+as $$
+declare
+    v_loan public.loans%rowtype;
+    v_repayment_id bigint;
+    v_balance numeric;
+begin
+    select * into v_loan
+    from public.loans
+    where id = p_loan_id and business_id = p_business_id
+    for update;
+
+    if not found then
+        raise exception 'Loan % not found for business %', p_loan_id, p_business_id
+            using errcode = 'P0002';
+    end if;
+
+    insert into public.repayments (loan_id, amount, repayment_date, discount, business_id)
+    values (p_loan_id, p_amount, p_repayment_date, coalesce(p_discount, 0), p_business_id)
+    returning id into v_repayment_id;
+
+    v_balance := greatest(coalesce(v_loan.balance, v_loan.amount) - p_amount - coalesce(p_discount, 0), 0);
+
+    update public.loans
+    set balance = v_balance,
+        status = p_status
+    where id = p_loan_id;
+
+    return json_build_object(
+        'repayment_id', v_repayment_id,
+        'loan_id', p_loan_id,
+        'borrower_id', v_loan.borrower_id,
+        'balance', v_balance,
+        'status', p_status
+    );
+end;
+$$;
@@ -0,0 +1,67 @@
+-- Bulk counterpart of post_repayment: inserts a batch of repayments and updates every affected loan in one
+-- statement. p_rows is a JSON array of {row_number, loan_id, amount, discount, repayment_date, status};
+-- when a loan appears more than once its final status is taken from the latest repayment.
+create or replace function public.post_repayments(p_business_id uuid, p_rows json)
+returns json
+language plpgsql
+as $$
+declare
+    v_result json;
+begin
+    -- Lock the affected loans in a fixed order so concurrent batches cannot deadlock
+    perform 1
+    from public.loans
+    where business_id = p_business_id
+      and id in (select (r ->> 'loan_id')::bigint from json_array_elements(p_rows) r)
+    order by id
+    for update;
+
+    with input as (
+        select r.*
+        from json_to_recordset(p_rows) as r(
+            row_number integer,
+            loan_id bigint,
+            amount numeric,
+            discount numeric,
+            repayment_date timestamptz,
+            status text
+        )
+        where exists (
+            select 1 from public.loans l where l.id = r.loan_id and l.business_id = p_business_id
+        )
+    ),
+    inserted as (
+        insert into public.repayments (loan_id, amount, repayment_date, discount, business_id)
+        select loan_id, amount, repayment_date, coalesce(discount, 0), p_business_id
+        from input
+        order by row_number
+        returning loan_id
+    ),
+    totals as (
+        select loan_id,
+               sum(amount + coalesce(discount, 0)) as paid,
+               (array_agg(status order by repayment_date desc, row_number desc))[1] as last_status
+        from input
+        group by loan_id
+    ),
+    updated as (
+        update public.loans l
+        set balance = greatest(coalesce(l.balance, l.amount) - t.paid, 0),
+            status = t.last_status
+        from totals t
+        where l.id = t.loan_id
+          and l.business_id = p_business_id
+        returning l.id, l.borrower_id, l.balance, l.status
+    )
+    select json_agg(json_build_object(
+        'loan_id', id,
+        'borrower_id', borrower_id,
+        'balance', balance,
+        'status', status
+    ))
+    into v_result
+    from updated;
+
+    return coalesce(v_result, '[]'::json);
+end;
+$$;
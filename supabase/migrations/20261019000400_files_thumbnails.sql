@@ -0,0 +1,3 @@
+-- Thumbnail URLs of a loan's collateral photos, in the same order as files.photos
+alter table public.files
+    add column if not exists thumbnails text[] not null default '{}';
@@ -0,0 +1,15 @@
+-- Content-addressed index of stored documents, maintained by DocumentStore (document_store.py).
+-- One row per business, bucket, SHA-256 of the uploaded bytes and variant ('original', 'web', 'thumbnail').
+create table if not exists public.document_index (
+    id bigint generated by default as identity primary key,
+    business_id uuid not null,
+    bucket text not null,
+    sha256 text not null,
+    variant text not null default 'original',
+    path text not null,
+    url text not null,
+    size_bytes bigint,
+    original_name text,
+    created_at timestamptz not null default now(),
+    unique (business_id, bucket, sha256, variant)
+);
@@ -0,0 +1,92 @@
+-- Subscription payments awaiting confirmation from TuMeNy, one row per payment request.
+-- A checkout records a pending row and returns; the payment poller (payment_poller.py) or the TuMeNy
+-- webhook moves it to success, failed or expired, and the browser polls the row's status.
+create table if not exists public.subscription_payments (
+    payment_id text primary key,
+    business_id uuid not null,
+    plan text not null,
+    amount numeric not null,
+    email text,
+    first_name text,
+    last_name text,
+    phone text,
+    status text not null default 'pending'
+        check (status in ('pending', 'success', 'failed', 'expired')),
+    checks integer not null default 0,
+    next_check_at timestamptz not null default now(),
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists subscription_payments_due_idx
+    on public.subscription_payments (next_check_at)
+    where status = 'pending';
+
+create index if not exists subscription_payments_business_idx
+    on public.subscription_payments (business_id, created_at desc);
+
+-- Hands out pending payments that are due for a status check and pushes their next check back by the
+-- lease, so several app processes polling at once never check the same payment at the same time.
+create or replace function public.claim_subscription_payments(
+    p_limit integer default 20,
+    p_lease_seconds integer default 30
+)
+returns setof public.subscription_payments
+language sql
+as $$
+    update public.subscription_payments p
+    set checks = p.checks + 1,
+        next_check_at = now() + make_interval(secs => p_lease_seconds),
+        updated_at = now()
+    where p.payment_id in (
+        select payment_id
+        from public.subscription_payments
+        where status = 'pending' and next_check_at <= now()
+        order by next_check_at
+        limit p_limit
+        for update skip locked
+    )
+    returning p.*;
+$$;
+
+-- Moves a pending payment to its final status and, on success, marks the business as paid, in one
+-- transaction. Only the call that actually leaves 'pending' gets changed = true, so the receipt is
+-- sent once even when the poller and the webhook see the same payment.
+create or replace function public.complete_subscription_payment(
+    p_payment_id text,
+    p_status text
+)
+returns json
+language plpgsql
+as $$
+declare
+    v_payment public.subscription_payments%rowtype;
+begin
+    if p_status not in ('success', 'failed', 'expired') then
+        raise exception 'Invalid final payment status %', p_status
+            using errcode = '22023';
+    end if;
+
+    update public.subscription_payments
+    set status = p_status,
+        updated_at = now()
+    where payment_id = p_payment_id and status = 'pending'
+    returning * into v_payment;
+
+    if not found then
+        select * into v_payment
+        from public.subscription_payments
+        where payment_id = p_payment_id;
+
+        return json_build_object('changed', false, 'payment', row_to_json(v_payment));
+    end if;
+
+    if p_status = 'success' then
+        update public.business_users
+        set paid = true
+        where id = v_payment.business_id;
+    end if;
+
+    return json_build_object('changed', true, 'payment', row_to_json(v_payment));
+end;
+$$;
@@ -0,0 +1,44 @@
+-- Plan a business is subscribed to, read with its paid status by BusinessContext (business_context.py)
+alter table public.business_users
+    add column if not exists plan text;
+
+-- As in 20261019000600_subscription_payments.sql, and also records the plan that was paid for
+create or replace function public.complete_subscription_payment(
+    p_payment_id text,
+    p_status text
+)
+returns json
+language plpgsql
+as $$
+declare
+    v_payment public.subscription_payments%rowtype;
+begin
+    if p_status not in ('success', 'failed', 'expired') then
+        raise exception 'Invalid final payment status %', p_status
+            using errcode = '22023';
+    end if;
+
+    update public.subscription_payments
+    set status = p_status,
+        updated_at = now()
+    where payment_id = p_payment_id and status = 'pending'
+    returning * into v_payment;
+
+    if not found then
+        select * into v_payment
+        from public.subscription_payments
+        where payment_id = p_payment_id;
+
+        return json_build_object('changed', false, 'payment', row_to_json(v_payment));
+    end if;
+
+    if p_status = 'success' then
+        update public.business_users
+        set paid = true,
+            plan = v_payment.plan
+        where id = v_payment.business_id;
+    end if;
+
+    return json_build_object('changed', true, 'payment', row_to_json(v_payment));
+end;
+$$;
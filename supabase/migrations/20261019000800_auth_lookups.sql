@@ -0,0 +1,59 @@
+-- Login and signup look users up by email, and signup looks keys up by their value
+create index if not exists users_email_idx on public.users (email);
+create index if not exists business_users_email_idx on public.business_users (email);
+create index if not exists secret_keys_key_idx on public.secret_keys (key);
+create index if not exists admin_keys_key_idx on public.admin_keys (key);
+
+-- Creates a user from a registration key in one transaction: checks the email is free, resolves the key
+-- (an admin key makes an admin and is reusable, a secret key makes a viewer and is used up) and inserts the
+-- user with the password hash computed by the app. Returns success and a message like sign_up did.
+create or replace function public.sign_up_user(
+    p_name text,
+    p_email text,
+    p_password_hash text,
+    p_secret_key text
+)
+returns json
+language plpgsql
+as $$
+declare
+    v_role text;
+    v_business_id uuid;
+    v_secret_key_id bigint;
+begin
+    if exists (select 1 from public.users where email = p_email) then
+        return json_build_object('success', false, 'message', 'Email already registered.');
+    end if;
+
+    select business_id into v_business_id
+    from public.admin_keys
+    where key = p_secret_key
+    limit 1;
+
+    if found then
+        v_role := 'admin';
+    else
+        -- Locked so two signups cannot both use the same one-time key
+        select id, business_id into v_secret_key_id, v_business_id
+        from public.secret_keys
+        where key = p_secret_key
+        limit 1
+        for update;
+
+        if not found then
+            return json_build_object('success', false, 'message', 'Invalid registration secret key.');
+        end if;
+
+        v_role := 'viewer';
+    end if;
+
+    insert into public.users (name, email, role, password, business_id)
+    values (p_name, p_email, v_role, p_password_hash, v_business_id);
+
+    if v_secret_key_id is not null then
+        delete from public.secret_keys where id = v_secret_key_id;
+    end if;
+
+    return json_build_object('success', true, 'message', 'User created successfully.', 'role', v_role);
+end;
+$$;
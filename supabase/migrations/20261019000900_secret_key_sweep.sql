@@ -0,0 +1,32 @@
+-- The expiry sweep finds old keys by their age
+create index if not exists secret_keys_created_at_idx on public.secret_keys (created_at);
+
+-- Deletes the secret keys older than p_hours for every business in one statement and returns how many
+-- were removed per business, so the app can refresh the counts it caches.
+create or replace function public.delete_expired_secret_keys(p_hours integer default 24)
+returns table (business_id uuid, deleted_count bigint)
+language sql
+as $$
+    with deleted as (
+        delete from public.secret_keys
+        where created_at < now() - make_interval(hours => p_hours)
+        returning secret_keys.business_id
+    )
+    select deleted.business_id, count(*) as deleted_count
+    from deleted
+    group by deleted.business_id;
+$$;
+
+-- Run the sweep hourly inside the database where pg_cron is enabled; elsewhere schedule
+-- `flask --app main sweep-secret-keys` instead
+do $$
+begin
+    if exists (select 1 from pg_extension where extname = 'pg_cron') then
+        perform cron.schedule(
+            'sweep-expired-secret-keys',
+            '15 * * * *',
+            'select * from public.delete_expired_secret_keys(24)'
+        );
+    end if;
+end;
+$$;
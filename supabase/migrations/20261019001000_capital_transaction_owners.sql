@@ -0,0 +1,22 @@
+-- Capital transactions embed their owner's name (owners(user_name)), which PostgREST resolves through a
+-- foreign key. Added as not valid where missing, so existing rows are not rechecked.
+do $$
+begin
+    if not exists (
+        select 1
+        from pg_constraint
+        where contype = 'f'
+          and conrelid = 'public.capital_transactions'::regclass
+          and confrelid = 'public.owners'::regclass
+    ) then
+        alter table public.capital_transactions
+            add constraint capital_transactions_owner_id_fkey
+            foreign key (owner_id) references public.owners (id) not valid;
+    end if;
+end;
+$$;
+
+-- The transactions page lists a business's latest transactions, and the CSV filters them by owner
+create index if not exists capital_transactions_business_created_idx
+    on public.capital_transactions (business_id, created_at desc);
+create index if not exists capital_transactions_owner_idx on public.capital_transactions (owner_id);
@@ -0,0 +1,58 @@
+-- sign_up_user also reports the business a signup joined and whether it used up a one-time secret key,
+-- so the app can drop that business's cached key count. Otherwise unchanged.
+create or replace function public.sign_up_user(
+    p_name text,
+    p_email text,
+    p_password_hash text,
+    p_secret_key text
+)
+returns json
+language plpgsql
+as $$
+declare
+    v_role text;
+    v_business_id uuid;
+    v_secret_key_id bigint;
+begin
+    if exists (select 1 from public.users where email = p_email) then
+        return json_build_object('success', false, 'message', 'Email already registered.');
+    end if;
+
+    select business_id into v_business_id
+    from public.admin_keys
+    where key = p_secret_key
+    limit 1;
+
+    if found then
+        v_role := 'admin';
+    else
+        -- Locked so two signups cannot both use the same one-time key
+        select id, business_id into v_secret_key_id, v_business_id
+        from public.secret_keys
+        where key = p_secret_key
+        limit 1
+        for update;
+
+        if not found then
+            return json_build_object('success', false, 'message', 'Invalid registration secret key.');
+        end if;
+
+        v_role := 'viewer';
+    end if;
+
+    insert into public.users (name, email, role, password, business_id)
+    values (p_name, p_email, v_role, p_password_hash, v_business_id);
+
+    if v_secret_key_id is not null then
+        delete from public.secret_keys where id = v_secret_key_id;
+    end if;
+
+    return json_build_object(
+        'success', true,
+        'message', 'User created successfully.',
+        'role', v_role,
+        'business_id', v_business_id,
+        'used_secret_key', v_secret_key_id is not null
+    );
+end;
+$$;
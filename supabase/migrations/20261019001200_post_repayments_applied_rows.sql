@@ -0,0 +1,72 @@
+-- post_repayments re-checks every row once its loans are locked: a loan deleted, moved or closed since the
+-- app validated the batch no longer takes the repayment. It now returns the row numbers it applied along
+-- with the updated loans, so the app reports the skipped rows as rejected instead of posted.
+create or replace function public.post_repayments(p_business_id uuid, p_rows json)
+returns json
+language plpgsql
+as $$
+declare
+    v_loans json;
+    v_applied json;
+begin
+    -- Lock the affected loans in a fixed order so concurrent batches cannot deadlock
+    perform 1
+    from public.loans
+    where business_id = p_business_id
+      and id in (select (r ->> 'loan_id')::bigint from json_array_elements(p_rows) r)
+    order by id
+    for update;
+
+    with input as (
+        select r.*
+        from json_to_recordset(p_rows) as r(
+            row_number integer,
+            loan_id bigint,
+            amount numeric,
+            discount numeric,
+            repayment_date timestamptz,
+            status text
+        )
+        join public.loans l on l.id = r.loan_id
+        where l.business_id = p_business_id
+          and initcap(trim(coalesce(l.status, ''))) in ('Active', 'Overdue', 'Default')
+    ),
+    inserted as (
+        insert into public.repayments (loan_id, amount, repayment_date, discount, business_id)
+        select loan_id, amount, repayment_date, coalesce(discount, 0), p_business_id
+        from input
+        order by row_number
+        returning loan_id
+    ),
+    totals as (
+        select loan_id,
+               sum(amount + coalesce(discount, 0)) as paid,
+               (array_agg(status order by repayment_date desc, row_number desc))[1] as last_status
+        from input
+        group by loan_id
+    ),
+    updated as (
+        update public.loans l
+        set balance = greatest(coalesce(l.balance, l.amount) - t.paid, 0),
+            status = t.last_status
+        from totals t
+        where l.id = t.loan_id
+          and l.business_id = p_business_id
+        returning l.id, l.borrower_id, l.balance, l.status
+    )
+    select
+        (select json_agg(json_build_object(
+            'loan_id', id,
+            'borrower_id', borrower_id,
+            'balance', balance,
+            'status', status
+        )) from updated),
+        (select json_agg(row_number order by row_number) from input)
+    into v_loans, v_applied;
+
+    return json_build_object(
+        'loans', coalesce(v_loans, '[]'::json),
+        'applied_rows', coalesce(v_applied, '[]'::json)
+    );
+end;
+$$;
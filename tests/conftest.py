@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set before main is imported, so the app never reads a developer's .env or talks to a real Supabase
+os.environ['SUPABASE_URL'] = 'http://supabase.test'
+os.environ['SUPABASE_SERVICE_ROLE_KEY'] = 'test-service-role-key'
+os.environ.setdefault('FLASK_SECRET_KEY', 'test-secret-key')
+
+import query_profiler  # noqa: E402
+from benchmarks import FakeSupabase  # noqa: E402
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    """Returns a function that makes an in-memory Supabase holding the given tables the app's client"""
+    def install(tables):
+        fake = FakeSupabase(tables)
+        key = (os.environ['SUPABASE_URL'], os.environ['SUPABASE_SERVICE_ROLE_KEY'])
+        monkeypatch.setitem(query_profiler._clients, key, fake)
+        return fake
+
+    return install
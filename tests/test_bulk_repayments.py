@@ -0,0 +1,117 @@
+import pytest
+
+import main
+from repayment import Repayment
+
+BUSINESS_ID = 'business-1'
+
+
+def post_repayments(client, p_business_id, p_rows):
+    """Stands in for the post_repayments function: applies rows whose loan is still open at posting time"""
+    loans = {loan['id']: loan for loan in client.tables['loans'] if loan['business_id'] == p_business_id}
+    applied = [row for row in p_rows
+               if row['loan_id'] in loans and loans[row['loan_id']]['status'] in Repayment.REPAYABLE_STATUSES]
+
+    for row in applied:
+        loan = loans[row['loan_id']]
+        loan['balance'] = max(loan['balance'] - row['amount'] - row['discount'], 0)
+        loan['status'] = row['status']
+
+    return {
+        'loans': [{'loan_id': loan_id, 'borrower_id': loans[loan_id]['borrower_id']}
+                  for loan_id in {row['loan_id'] for row in applied}],
+        'applied_rows': [row['row_number'] for row in applied]
+    }
+
+
+@pytest.fixture
+def loans_supabase(fake_supabase):
+    fake = fake_supabase({
+        'loans': [
+            {'id': 1, 'borrower_id': 'borrower-1', 'business_id': BUSINESS_ID, 'status': 'Active', 'balance': 500.0},
+            {'id': 2, 'borrower_id': 'borrower-2', 'business_id': BUSINESS_ID, 'status': 'Active', 'balance': 800.0},
+            {'id': 3, 'borrower_id': 'borrower-3', 'business_id': BUSINESS_ID, 'status': 'Completed', 'balance': 0.0},
+            {'id': 4, 'borrower_id': 'borrower-4', 'business_id': 'business-2', 'status': 'Active', 'balance': 900.0}
+        ],
+        'borrower_risk': []
+    })
+    fake.functions['post_repayments'] = post_repayments
+    return fake
+
+
+def repayment(loan_id, amount='100', discount='', repayment_date='2026-10-01', status='Active'):
+    return {'loan_id': loan_id, 'amount': amount, 'discount': discount, 'repayment_date': repayment_date,
+            'status': status}
+
+
+def test_validation_reports_every_problem_per_row(loans_supabase):
+    repayment_tool = Repayment()
+    loans_supabase.reset()
+
+    frame = repayment_tool.validate_repayments_bulk([
+        repayment(1),
+        repayment('abc'),
+        repayment(1, amount='-5'),
+        repayment(1, discount='-1'),
+        repayment(1, repayment_date='yesterday'),
+        repayment(1, status='Paid'),
+        repayment(3),
+        repayment(4),
+    ], BUSINESS_ID)
+
+    errors = dict(zip(frame['row'], frame['errors']))
+    assert errors[1] == []
+    assert errors[2] == ['Invalid loan_id']
+    assert errors[3] == ['Repayment amount must be greater than 0']
+    assert errors[4] == ['Discount cannot be negative']
+    assert errors[5] == ['Invalid repayment date. Expected ISO format (YYYY-MM-DD)']
+    assert errors[6][0].startswith('Status must be one of')
+    assert errors[7] == ['Cannot process repayment for loan with status: Completed']
+    assert errors[8] == ['Loan not found'], "another business's loan must not be visible"
+
+    # The loans were checked with one query
+    assert len(loans_supabase.queries) == 1
+
+
+def test_rows_skipped_by_the_database_are_rejected(loans_supabase, monkeypatch):
+    repayment_tool = Repayment()
+    validate = repayment_tool.validate_repayments_bulk
+
+    def validate_then_close_loan(rows, business_id):
+        frame = validate(rows, business_id)
+        # Another user completes loan 2 between validation and posting
+        loans_supabase.tables['loans'][1]['status'] = 'Completed'
+        return frame
+
+    monkeypatch.setattr(repayment_tool, 'validate_repayments_bulk', validate_then_close_loan)
+
+    report = repayment_tool.submit_repayments_bulk([repayment(1), repayment(2), repayment('x')], BUSINESS_ID)
+    statuses = {row['row']: row['status'] for row in report['rows']}
+
+    assert statuses == {1: 'posted', 2: 'rejected', 3: 'rejected'}
+    assert report['posted'] == 1
+    assert report['rejected'] == 2
+    assert report['rows'][1]['errors'] == ["Loan was closed or removed before the repayment could be posted"]
+    assert loans_supabase.tables['loans'][0]['balance'] == 400.0
+    assert loans_supabase.tables['loans'][1]['balance'] == 800.0
+
+
+@pytest.mark.parametrize('role, posting_roles, expected_status', [
+    ('viewer', ['admin'], 403),
+    ('agent', ['admin'], 403),
+    ('agent', ['admin', 'agent'], 200),
+])
+def test_bulk_route_allows_the_repayment_posting_roles(loans_supabase, monkeypatch, role, posting_roles,
+                                                       expected_status):
+    monkeypatch.setattr(Repayment, 'POSTING_ROLES', posting_roles)
+    monkeypatch.setitem(main.app.config, 'WTF_CSRF_ENABLED', False)
+    monkeypatch.setitem(main.app.config, 'QUERY_BUDGET_ENFORCE', True)
+
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['business_data'] = {'id': BUSINESS_ID}
+        session['user'] = {'role': role}
+
+    response = client.post('/bulk_repayments', json=[repayment(1)])
+
+    assert response.status_code == expected_status
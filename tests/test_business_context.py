@@ -0,0 +1,60 @@
+import pytest
+
+import business_context
+import main
+
+BUSINESS_ID = 'business-1'
+
+
+@pytest.fixture
+def client(fake_supabase, monkeypatch):
+    monkeypatch.setitem(main.app.config, 'TESTING', True)
+    yield main.app.test_client()
+    business_context.invalidate_business_context(BUSINESS_ID)
+
+
+def log_in(client, fake_supabase, **row):
+    fake_supabase({'business_users': [{'id': BUSINESS_ID, 'business_name': 'Test Lenders',
+                                       'email': 'owner@example.com', **row}]})
+    with client.session_transaction() as session:
+        session['business_data'] = {'id': BUSINESS_ID}
+
+
+def test_requires_business_session(client):
+    response = client.get('/settings')
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/business_login')
+
+
+def test_unpaid_business_is_sent_to_subscription(client, fake_supabase):
+    log_in(client, fake_supabase, paid=False, plan=None)
+
+    response = client.get('/settings')
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/subscription')
+
+
+def test_plan_limits_reach_templates(client, fake_supabase):
+    log_in(client, fake_supabase, paid=True, plan='Basic')
+
+    response = client.get('/ai_agents')
+
+    assert response.status_code == 200
+    assert b'You are on the Basic plan' in response.data
+
+
+def test_feature_outside_plan_is_refused(client, fake_supabase):
+    log_in(client, fake_supabase, paid=True, plan='Basic')
+
+    @business_context.business_required('quickbooks')
+    def view():
+        return 'ok'
+
+    with main.app.test_request_context():
+        main.session['business_data'] = {'id': BUSINESS_ID}
+        response = view()
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/subscription')
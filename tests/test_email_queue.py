@@ -0,0 +1,89 @@
+import socket
+
+import pytest
+
+import fake_smtp
+from email_queue import EmailQueue, SmtpConnection
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    """Starts the fake SMTP server on a free port and points the email queue at it"""
+    server = fake_smtp.serve(0)
+
+    monkeypatch.setenv('SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('SMTP_PORT', str(server.server_address[1]))
+    monkeypatch.setenv('SMTP_SSL', 'false')
+    monkeypatch.setenv('SENDER_EMAIL', 'app@example.com')
+    monkeypatch.delenv('EMAIL_PASSWORD', raising=False)
+    monkeypatch.delenv('EMAIL_KEY', raising=False)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    # The tests send with run_pending themselves instead of through the worker thread
+    monkeypatch.setattr(EmailQueue, 'start_worker', lambda self: None)
+    return EmailQueue(str(tmp_path))
+
+
+def test_batch_is_sent_over_one_connection(queue, smtp_server):
+    for number in range(3):
+        queue.enqueue(f"user{number}@example.com", 'Receipt', 'Thank you', kind='receipt')
+
+    assert queue.run_pending() == 3
+
+    assert smtp_server.fake.connections == 1
+    assert len(smtp_server.fake.messages) == 3
+    assert queue.email_counts() == {}
+
+
+def test_dropped_connection_is_reopened(queue, smtp_server):
+    queue.enqueue('user@example.com', 'First', 'body')
+    queue.run_pending()
+
+    # The connection kept open between batches drops
+    queue._smtp._smtp.sock.shutdown(socket.SHUT_RDWR)
+
+    queue.enqueue('user@example.com', 'Second', 'body')
+
+    assert queue.run_pending() == 1
+    assert smtp_server.fake.connections == 2
+    assert len(smtp_server.fake.messages) == 2
+
+
+def test_failed_send_is_retried(queue, smtp_server, monkeypatch):
+    queue.RETRY_DELAY = 0
+    open_connection = SmtpConnection._open
+    attempts = []
+
+    def open_after_one_refusal(self):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionRefusedError('Connection refused')
+        return open_connection(self)
+
+    monkeypatch.setattr(SmtpConnection, '_open', open_after_one_refusal)
+    queue.enqueue('user@example.com', 'Password reset', 'new password')
+
+    assert queue.run_pending() == 1
+    assert len(attempts) == 2
+    assert len(smtp_server.fake.messages) == 1
+    assert queue.email_counts() == {}
+
+
+def test_gives_up_after_max_attempts_and_clears_body(queue, smtp_server):
+    queue.RETRY_DELAY = 0
+    smtp_server.shutdown()
+    smtp_server.server_close()
+
+    email_id = queue.enqueue('user@example.com', 'Password reset', 'new password')
+
+    assert queue.run_pending() == 0
+    assert queue.email_counts() == {'failed': 1}
+
+    with queue._connect() as conn:
+        email = conn.execute("select attempts, body from emails where id = ?", (email_id,)).fetchone()
+    assert email['attempts'] == EmailQueue.MAX_ATTEMPTS
+    assert email['body'] == ''
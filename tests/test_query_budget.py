@@ -0,0 +1,118 @@
+from datetime import date, timedelta
+
+import pytest
+
+import business_context
+import main
+from benchmarks import seed_client
+from borrower_profile import BorrowerProfile
+from query_profiler import QueryBudgetExceeded
+
+BUSINESS_ID = 'business-1'
+BORROWER_ID = 'borrower-1'
+
+
+@pytest.fixture
+def profile_supabase(fake_supabase):
+    """Serves every service class from an in-memory Supabase holding one borrower with one loan"""
+    return fake_supabase({
+        'business_users': [{'id': BUSINESS_ID, 'business_name': 'Test Lenders', 'email': 'owner@example.com',
+                            'paid': True, 'plan': 'Basic'}],
+        'borrowers': [{'id': BORROWER_ID, 'business_id': BUSINESS_ID, 'name': 'Test Borrower',
+                       'nrc_number': '123456/10/1', 'created_at': '2026-01-05T00:00:00+00:00'}],
+        'borrower_risk': [],
+        'loans': [{'id': 'loan-1', 'borrower_id': BORROWER_ID, 'business_id': BUSINESS_ID, 'principal': 1000.0,
+                   'interest': 200.0, 'status': 'active', 'created_at': '2026-01-05T00:00:00+00:00',
+                   'due_date': '2026-02-05'}],
+        'repayments': [{'id': 'repayment-1', 'loan_id': 'loan-1', 'business_id': BUSINESS_ID, 'amount': 300.0,
+                        'discount': 0.0, 'repayment_date': '2026-01-20'}]
+    })
+
+
+@pytest.fixture
+def client(profile_supabase, monkeypatch):
+    monkeypatch.setitem(main.app.config, 'TESTING', True)
+    monkeypatch.setitem(main.app.config, 'QUERY_BUDGET_ENFORCE', True)
+
+    # As at business login, which caches the context the pages read the plan from
+    business_context.remember_business_context(profile_supabase.tables['business_users'][0])
+    profile_supabase.reset()
+
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['business_data'] = {'id': BUSINESS_ID}
+    yield client
+
+    business_context.invalidate_business_context(BUSINESS_ID)
+
+
+def test_borrower_information_stays_within_budget(client, profile_supabase):
+    response = client.get(f'/borrower_information?borrower_id={BORROWER_ID}')
+
+    assert response.status_code == 200
+    assert len(profile_supabase.queries) <= main.borrower_information.query_budget
+
+
+def test_extra_query_exceeds_budget(client, monkeypatch):
+    load = BorrowerProfile.load
+
+    def load_with_extra_query(self, borrower_id, business_id):
+        # The kind of per-row lookup a budget is there to catch
+        self.supabase.table('repayments').select('*').eq('loan_id', 'loan-1').execute()
+        return load(self, borrower_id, business_id)
+
+    monkeypatch.setattr(BorrowerProfile, 'load', load_with_extra_query)
+
+    with pytest.raises(QueryBudgetExceeded, match='borrower_information made 3 queries'):
+        client.get(f'/borrower_information?borrower_id={BORROWER_ID}')
+
+
+@pytest.fixture
+def dashboard_client(fake_supabase, monkeypatch):
+    """A client logged into a seeded business whose context is not cached yet, the costliest case"""
+    seeded, business_id = seed_client(300)
+    fake = fake_supabase(seeded.tables)
+    fake.tables['business_users'] = [{'id': business_id, 'business_name': 'Seeded Lenders', 'paid': True,
+                                      'plan': 'Basic'}]
+
+    # Loans that have just fallen overdue make the dashboard update them and refresh their borrowers' risk
+    for loan in [loan for loan in fake.tables['loans'] if loan['business_id'] == business_id][:3]:
+        loan.update(status='Active', due_date=(date.today() - timedelta(days=3)).isoformat())
+
+    monkeypatch.setitem(main.app.config, 'TESTING', True)
+    monkeypatch.setitem(main.app.config, 'WTF_CSRF_ENABLED', False)
+    monkeypatch.setitem(main.app.config, 'QUERY_BUDGET_ENFORCE', True)
+
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['business_data'] = {'id': business_id}
+    yield client, fake
+
+    business_context.invalidate_business_context(business_id)
+
+
+def test_overview_stays_within_budget(dashboard_client):
+    client, fake = dashboard_client
+
+    assert client.get('/overview_dashboard').status_code == 200
+
+    response = client.post('/overview_dashboard', json={'action': 'update_period', 'period': 'Last 30 Days'})
+    assert response.get_json()['success']
+
+
+def test_login_stays_within_budget(dashboard_client):
+    client, fake = dashboard_client
+    fake.tables['users'] = []
+
+    assert client.post('/login', data={'email': 'agent@example.com', 'password': 'secret'}).status_code == 302
+
+
+def test_subscription_status_stays_within_budget(dashboard_client, monkeypatch):
+    client, fake = dashboard_client
+    monkeypatch.setenv('TUMENY_API_KEY', 'test-key')
+    monkeypatch.setenv('TUMENY_API_SECRET', 'test-secret')
+    business_id = fake.tables['business_users'][0]['id']
+    fake.tables['subscription_payments'] = [{'payment_id': 'payment-1', 'business_id': business_id,
+                                             'status': 'pending', 'plan': 'Basic'}]
+
+    assert client.get('/subscription/status/payment-1').get_json() == {'status': 'pending'}
@@ -0,0 +1,142 @@
+from datetime import datetime, UTC
+
+import pytest
+
+import business_context
+import fake_tumeny
+import main
+import subscription
+from payment_poller import PaymentPoller
+from subscription import Subscriptions
+
+BUSINESS_ID = 'business-1'
+
+
+def claim_subscription_payments(client, p_limit, p_lease_seconds):
+    """Stands in for claim_subscription_payments: hands out the pending payments and counts the check"""
+    claimed = [payment for payment in client.tables['subscription_payments'] if payment['status'] == 'pending']
+    for payment in claimed[:p_limit]:
+        # Column defaults the database fills in when buy_plan inserts the row
+        payment.setdefault('created_at', datetime.now(UTC).isoformat())
+        payment['checks'] = payment.get('checks', 0) + 1
+    return [dict(payment) for payment in claimed[:p_limit]]
+
+
+def complete_subscription_payment(client, p_payment_id, p_status):
+    """Stands in for complete_subscription_payment: only a pending payment changes, and success pays"""
+    payment = next(row for row in client.tables['subscription_payments'] if row['payment_id'] == p_payment_id)
+    if payment['status'] != 'pending':
+        return {'changed': False, 'payment': dict(payment)}
+
+    payment['status'] = p_status
+    if p_status == 'success':
+        business = next(row for row in client.tables['business_users'] if row['id'] == payment['business_id'])
+        business.update(paid=True, plan=payment['plan'])
+    return {'changed': True, 'payment': dict(payment)}
+
+
+class SentEmails:
+    """Records what would have been queued for sending"""
+
+    def __init__(self):
+        self.emails = []
+
+    def enqueue(self, to, subject, body, kind='email'):
+        self.emails.append({'to': to, 'subject': subject, 'kind': kind})
+
+
+@pytest.fixture
+def payments_supabase(fake_supabase):
+    fake = fake_supabase({
+        'business_users': [{'id': BUSINESS_ID, 'business_name': 'Test Lenders', 'email': 'owner@example.com',
+                            'paid': False, 'plan': None}],
+        'subscription_payments': []
+    })
+    fake.functions['claim_subscription_payments'] = claim_subscription_payments
+    fake.functions['complete_subscription_payment'] = complete_subscription_payment
+    yield fake
+    business_context.invalidate_business_context(BUSINESS_ID)
+
+
+@pytest.fixture
+def tumeny(monkeypatch):
+    """Starts the fake TuMeNy on a free port; tests set how its payments resolve on tumeny.fake"""
+    server = fake_tumeny.serve(0)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    monkeypatch.setenv('TUMENY_API_KEY', 'test-key')
+    monkeypatch.setenv('TUMENY_API_SECRET', 'test-secret')
+    monkeypatch.setenv('TUMENY_BASE_URL', base_url)
+    monkeypatch.setenv('EXCHANGE_RATE_URL', f"{base_url}/rate")
+    monkeypatch.setenv('NO_PROXY', '127.0.0.1')
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def sent_emails(monkeypatch):
+    emails = SentEmails()
+    monkeypatch.setattr(subscription, 'get_email_queue', lambda: emails)
+    return emails
+
+
+def buy_basic_plan():
+    payment_id = Subscriptions().buy_plan(BUSINESS_ID, 10, 'Test', 'Owner', 'owner@example.com', '0970000000',
+                                          'Basic')
+    assert payment_id
+    return payment_id
+
+
+def stored_payment(fake, payment_id):
+    return next(row for row in fake.tables['subscription_payments'] if row['payment_id'] == payment_id)
+
+
+def test_poller_completes_approved_payment(payments_supabase, tumeny, sent_emails):
+    tumeny.fake.approve_after = 0
+    payment_id = buy_basic_plan()
+    assert stored_payment(payments_supabase, payment_id)['status'] == 'pending'
+
+    assert PaymentPoller().run_pending() == 1
+
+    assert stored_payment(payments_supabase, payment_id)['status'] == 'success'
+    assert payments_supabase.tables['business_users'][0]['paid'] is True
+    assert payments_supabase.tables['business_users'][0]['plan'] == 'Basic'
+    assert [email['kind'] for email in sent_emails.emails] == ['receipt']
+
+
+def test_webhook_records_failed_payment(payments_supabase, tumeny, sent_emails):
+    tumeny.fake.approve_after = 0
+    tumeny.fake.outcome = 'failed'
+    payment_id = buy_basic_plan()
+
+    response = main.app.test_client().post('/webhooks/tumeny', json={'payment': {'id': payment_id}})
+
+    assert response.get_json() == {'received': True, 'status': 'failed'}
+    assert stored_payment(payments_supabase, payment_id)['status'] == 'failed'
+    assert payments_supabase.tables['business_users'][0]['paid'] is False
+    assert sent_emails.emails == []
+
+
+def test_unapproved_payment_expires(payments_supabase, tumeny, sent_emails, monkeypatch):
+    tumeny.fake.approve_after = 3600
+    monkeypatch.setattr(PaymentPoller, 'PAYMENT_TIMEOUT', -1)
+    payment_id = buy_basic_plan()
+
+    assert PaymentPoller().run_pending() == 1
+
+    assert stored_payment(payments_supabase, payment_id)['status'] == 'expired'
+    assert payments_supabase.tables['business_users'][0]['paid'] is False
+    assert sent_emails.emails == []
+
+
+def test_completed_payment_sends_one_receipt(payments_supabase, tumeny, sent_emails):
+    tumeny.fake.approve_after = 0
+    payment_id = buy_basic_plan()
+    PaymentPoller().run_pending()
+
+    # A late callback and a second completion find the payment already recorded
+    response = main.app.test_client().post('/webhooks/tumeny', json={'payment': {'id': payment_id}})
+
+    assert response.get_json() == {'received': True, 'status': 'success'}
+    assert Subscriptions().complete_payment(payment_id, 'success') is False
+    assert len(sent_emails.emails) == 1
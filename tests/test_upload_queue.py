@@ -0,0 +1,110 @@
+import io
+import json
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from upload_queue import UploadQueue
+
+
+class FakeLoans:
+    """Stands in for the Loans methods the worker calls; the first failures uploads raise"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.uploads = []
+        self.saved = []
+
+    def upload_loan_files(self, borrower_id, business_id, contract_file_obj=None, collateral_files_list=None,
+                          nrc_number=None):
+        self.uploads.append([file_obj.read() for file_obj in [contract_file_obj, *collateral_files_list] if file_obj])
+        if len(self.uploads) <= self.failures:
+            raise ConnectionError('Storage unavailable')
+        return 'contract-url', ['collateral-url'] * len(collateral_files_list), ['thumbnail-url']
+
+    def save_loan_files(self, loan_id, business_id, contract_file_url, collateral_file_urls, thumbnail_urls):
+        self.saved.append((loan_id, contract_file_url, collateral_file_urls))
+        return True
+
+
+def upload(data, filename):
+    return FileStorage(stream=io.BytesIO(data), filename=filename, content_type='application/pdf')
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    # The tests process jobs with run_pending themselves instead of through the worker thread
+    monkeypatch.setattr(UploadQueue, 'start_worker', lambda self: None)
+    return UploadQueue(str(tmp_path))
+
+
+def enqueue_loan(queue):
+    return queue.enqueue_loan_files('loan-1', 'borrower-1', 'business-1',
+                                    contract_file_obj=upload(b'contract', 'contract.pdf'),
+                                    collateral_files_list=[upload(b'car', 'car.pdf'), upload(b'', 'empty.pdf')])
+
+
+def job(queue, job_id):
+    with queue._connect() as conn:
+        return conn.execute("select * from upload_jobs where id = ?", (job_id,)).fetchone()
+
+
+def make_due(queue, job_id):
+    with queue._connect() as conn:
+        conn.execute("update upload_jobs set next_attempt_at = 0 where id = ?", (job_id,))
+
+
+def test_enqueue_spools_files_and_records_job(queue):
+    job_id = enqueue_loan(queue)
+
+    files = json.loads(job(queue, job_id)['files'])
+    assert queue.job_counts() == {'pending': 1}
+    assert open(files['contract']['path'], 'rb').read() == b'contract'
+    # The empty collateral file is skipped
+    assert [entry['filename'] for entry in files['collaterals']] == ['car.pdf']
+
+
+def test_nothing_to_upload_records_no_job(queue):
+    assert queue.enqueue_loan_files('loan-1', 'borrower-1', 'business-1') is None
+    assert queue.job_counts() == {}
+
+
+def test_failed_upload_backs_off_then_succeeds(queue):
+    queue._loan_tool = FakeLoans(failures=2)
+    job_id = enqueue_loan(queue)
+    job_dir = json.loads(job(queue, job_id)['files'])['job_dir']
+
+    for attempt in (1, 2):
+        queue.run_pending()
+        retry = job(queue, job_id)
+        assert retry['status'] == 'pending'
+        assert retry['attempts'] == attempt
+        assert retry['next_attempt_at'] - retry['updated_at'] == pytest.approx(
+            UploadQueue.RETRY_DELAY * 2 ** (attempt - 1), abs=1)
+
+        # Not due again until the delay has passed
+        assert queue.run_pending() == 0
+        make_due(queue, job_id)
+
+    assert queue.run_pending() == 1
+
+    assert job(queue, job_id)['status'] == 'done'
+    assert queue._loan_tool.uploads[-1] == [b'contract', b'car']
+    assert queue._loan_tool.saved == [('loan-1', 'contract-url', ['collateral-url'])]
+    assert not os.path.exists(job_dir)
+
+
+def test_final_failure_removes_spooled_files(queue):
+    queue.MAX_ATTEMPTS = 2
+    queue._loan_tool = FakeLoans(failures=2)
+    job_id = enqueue_loan(queue)
+    job_dir = json.loads(job(queue, job_id)['files'])['job_dir']
+
+    queue.run_pending()
+    make_due(queue, job_id)
+    queue.run_pending()
+
+    assert job(queue, job_id)['status'] == 'failed'
+    assert queue._loan_tool.saved == []
+    assert not os.path.exists(job_dir)
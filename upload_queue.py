@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from upload_streams import save_upload, rewind_upload, UploadTooLargeError, MAX_CONTRACT_BYTES, MAX_COLLATERAL_BYTES
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Where queued files and the queue database live, UPLOAD_QUEUE_DIR or instance/upload_queue next to this
+# file. It must survive restarts for the queue to be durable: a loan row is inserted before its files are
+# uploaded, so jobs lost with the directory leave loans without their documents. In a container, point
+# UPLOAD_QUEUE_DIR at a persistent volume.
+DEFAULT_QUEUE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'upload_queue')
+
+
+class UploadJobError(Exception):
+    """Raised when a queued upload job has to be retried"""
+    pass
+
+
+class UploadQueue:
+    """
+    Durable SQLite-backed queue of loan document uploads. A loan submission copies its files to local disk
+    and records a job, then returns; a background worker thread uploads the files to storage with retries
+    and inserts the loan's files row. Pending jobs survive restarts, and several processes can share one
+    queue directory because jobs are claimed inside an immediate SQLite transaction.
+    """
+
+    # Attempts per job, and the delay before the n-th retry is RETRY_DELAY * 2 ** (n - 1) seconds
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 5
+
+    # A job still marked running after this many seconds is assumed lost with its process and is retried
+    JOB_TIMEOUT = 600
+
+    # Seconds the worker sleeps when no job is due
+    POLL_INTERVAL = 2
+
+    def __init__(self, queue_dir: Optional[str] = None):
+        self.queue_dir = queue_dir or os.getenv('UPLOAD_QUEUE_DIR', DEFAULT_QUEUE_DIR)
+        self.files_dir = os.path.join(self.queue_dir, 'files')
+        self.db_path = os.path.join(self.queue_dir, 'upload_queue.sqlite3')
+
+        os.makedirs(self.files_dir, exist_ok=True)
+
+        self._wakeup = threading.Event()
+        self._worker_lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._loan_tool = None
+
+        with self._connect() as conn:
+            conn.execute("""
+                create table if not exists upload_jobs (
+                    id integer primary key autoincrement,
+                    loan_id text not null,
+                    borrower_id text not null,
+                    business_id text not null,
+                    files text not null,
+                    status text not null default 'pending',
+                    attempts integer not null default 0,
+                    next_attempt_at real not null,
+                    last_error text,
+                    created_at real not null,
+                    updated_at real not null
+                )
+            """)
+            conn.execute("create index if not exists upload_jobs_due_idx on upload_jobs (status, next_attempt_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Opens an autocommit connection to the queue database and closes it afterwards"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.row_factory = sqlite3.Row
+            conn.execute('pragma journal_mode=wal')
+            yield conn
+        finally:
+            conn.close()
+
+    def _save_file(self, file_obj: Any, job_dir: str, name: str, max_bytes: int) -> Optional[Dict[str, str]]:
+        """Copies one uploaded file into the job directory and returns its queue entry, or None if unusable"""
+
+        if not file_obj or not getattr(file_obj, 'filename', None):
+            return None
+
+        path = os.path.join(job_dir, name)
+
+        try:
+            with open(path, 'wb') as destination:
+                size = save_upload(file_obj, destination, max_bytes)
+        except UploadTooLargeError as e:
+            logger.error(f"Rejected queued file {file_obj.filename}: {str(e)}")
+            os.unlink(path)
+            return None
+        finally:
+            rewind_upload(file_obj)
+
+        if not size:
+            logger.warning(f"File {file_obj.filename} is empty, skipping")
+            os.unlink(path)
+            return None
+
+        return {
+            'path': path,
+            'filename': file_obj.filename,
+            'content_type': getattr(file_obj, 'content_type', None) or 'application/octet-stream'
+        }
+
+    def enqueue_loan_files(self, loan_id, borrower_id, business_id, contract_file_obj: Optional[Any] = None,
+                           collateral_files_list: Optional[List[Any]] = None,
+                           nrc_number: Optional[str] = None) -> Optional[int]:
+        """
+        Copies a loan's contract and collateral files to the queue directory and records an upload job for
+        them. Returns the job id, or None when there is nothing to upload.
+        """
+
+        job_dir = os.path.join(self.files_dir, uuid.uuid4().hex)
+        os.makedirs(job_dir)
+
+        try:
+            contract = self._save_file(contract_file_obj, job_dir, 'contract', MAX_CONTRACT_BYTES)
+            collaterals = [
+                entry for entry in (
+                    self._save_file(file_obj, job_dir, f"collateral_{index}", MAX_COLLATERAL_BYTES)
+                    for index, file_obj in enumerate(collateral_files_list or [])
+                ) if entry
+            ]
+
+            if not contract and not collaterals:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                return None
+
+            files = {'job_dir': job_dir, 'nrc_number': nrc_number, 'contract': contract, 'collaterals': collaterals}
+            now = time.time()
+
+            with self._connect() as conn:
+                cursor = conn.execute(
+                    "insert into upload_jobs (loan_id, borrower_id, business_id, files, next_attempt_at, created_at, "
+                    "updated_at) values (?, ?, ?, ?, ?, ?, ?)",
+                    (str(loan_id), str(borrower_id), str(business_id), json.dumps(files), now, now, now)
+                )
+                job_id = cursor.lastrowid
+
+        except Exception:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+        logger.info(f"Queued upload job {job_id} for loan {loan_id}: "
+                    f"{'1' if contract else '0'} contract, {len(collaterals)} collateral files")
+
+        self.start_worker()
+        self._wakeup.set()
+        return job_id
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Marks the oldest due job as running and returns it, or None when no job is due"""
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute('begin immediate')
+            try:
+                job = conn.execute(
+                    "select * from upload_jobs where (status = 'pending' and next_attempt_at <= ?) "
+                    "or (status = 'running' and updated_at <= ?) order by id limit 1",
+                    (now, now - self.JOB_TIMEOUT)
+                ).fetchone()
+
+                if job:
+                    conn.execute(
+                        "update upload_jobs set status = 'running', attempts = attempts + 1, updated_at = ? "
+                        "where id = ?", (now, job['id'])
+                    )
+                conn.execute('commit')
+            except Exception:
+                conn.execute('rollback')
+                raise
+
+        return job
+
+    def _finish(self, job_id: int, status: str, error: Optional[str] = None, retry_at: Optional[float] = None):
+        """Records the outcome of a job attempt"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "update upload_jobs set status = ?, last_error = ?, next_attempt_at = coalesce(?, next_attempt_at), "
+                "updated_at = ? where id = ?", (status, error, retry_at, now, job_id)
+            )
+
+    def _get_loan_tool(self):
+        """Returns the Loans instance used by this worker, created on first use"""
+        if self._loan_tool is None:
+            # Imported here because loans imports this module
+            from loans import Loans
+            self._loan_tool = Loans()
+        return self._loan_tool
+
+    def _process(self, job: sqlite3.Row) -> None:
+        """Uploads a job's files and stores the resulting URLs in the loan's files row"""
+        from werkzeug.datastructures import FileStorage
+
+        files = json.loads(job['files'])
+        final_attempt = job['attempts'] + 1 >= self.MAX_ATTEMPTS
+        streams = []
+
+        def as_upload(entry):
+            stream = open(entry['path'], 'rb')
+            streams.append(stream)
+            return FileStorage(stream=stream, filename=entry['filename'], content_type=entry['content_type'])
+
+        loan_tool = self._get_loan_tool()
+
+        try:
+            contract = as_upload(files['contract']) if files.get('contract') else None
+            collaterals = [as_upload(entry) for entry in files.get('collaterals', [])]
+
+            contract_file_url, collateral_file_urls, thumbnail_urls = loan_tool.upload_loan_files(
+                job['borrower_id'], job['business_id'],
+                contract_file_obj=contract,
+                collateral_files_list=collaterals,
+                nrc_number=files.get('nrc_number')
+            )
+        finally:
+            for stream in streams:
+                stream.close()
+
+        # Stored files are content-addressed, so a retry only re-sends the ones that failed
+        complete = (contract_file_url or not contract) and len(collateral_file_urls) == len(collaterals)
+        if not complete and not final_attempt:
+            raise UploadJobError(
+                f"Uploaded {'the' if contract_file_url else 'no'} contract and {len(collateral_file_urls)} "
+                f"of {len(collaterals)} collateral files")
+
+        if not loan_tool.save_loan_files(job['loan_id'], job['business_id'], contract_file_url,
+                                         collateral_file_urls, thumbnail_urls):
+            raise UploadJobError("Could not save the files row")
+
+    def run_pending(self) -> int:
+        """Processes every job that is currently due and returns how many were processed"""
+        processed = 0
+
+        while True:
+            job = self._claim()
+            if not job:
+                return processed
+
+            processed += 1
+            files = json.loads(job['files'])
+
+            try:
+                self._process(job)
+                self._finish(job['id'], 'done')
+                shutil.rmtree(files['job_dir'], ignore_errors=True)
+                logger.info(f"Upload job {job['id']} for loan {job['loan_id']} finished")
+
+            except Exception as e:
+                attempts = job['attempts'] + 1
+                if attempts >= self.MAX_ATTEMPTS:
+                    self._finish(job['id'], 'failed', str(e))
+                    shutil.rmtree(files['job_dir'], ignore_errors=True)
+                    logger.error(f"Upload job {job['id']} for loan {job['loan_id']} failed after {attempts} attempts: {e}")
+                else:
+                    retry_at = time.time() + self.RETRY_DELAY * 2 ** (attempts - 1)
+                    self._finish(job['id'], 'pending', str(e), retry_at)
+                    logger.warning(f"Upload job {job['id']} for loan {job['loan_id']} will be retried: {e}")
+
+    def _work(self) -> None:
+        """Worker thread loop"""
+        while True:
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Upload queue worker error: {e}")
+
+            self._wakeup.wait(self.POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def start_worker(self) -> None:
+        """Starts the background worker of this process if it is not already running"""
+        with self._worker_lock:
+            # A worker thread does not survive a fork, so each process starts its own
+            if self._worker and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+
+            self._loan_tool = None
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._work, name='upload-queue-worker', daemon=True)
+            self._worker.start()
+
+    def job_counts(self) -> Dict[str, int]:
+        """Returns the number of jobs in each status"""
+        with self._connect() as conn:
+            rows = conn.execute("select status, count(*) as total from upload_jobs group by status").fetchall()
+        return {row['status']: row['total'] for row in rows}
+
+
+_upload_queue = None
+_upload_queue_lock = threading.Lock()
+
+
+def get_upload_queue() -> UploadQueue:
+    """Returns the process-wide upload queue, created on first use"""
+    global _upload_queue
+
+    with _upload_queue_lock:
+        if _upload_queue is None:
+            _upload_queue = UploadQueue()
+        return _upload_queue
@@ -0,0 +1,81 @@
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Largest accepted size of each kind of uploaded file, in bytes
+MAX_CONTRACT_BYTES = 20 * 1024 * 1024
+MAX_COLLATERAL_BYTES = 15 * 1024 * 1024
+MAX_TRANSACTION_FILE_BYTES = 20 * 1024 * 1024
+
+# Largest accepted request body; enough for a contract and ten collateral photos at their limits
+MAX_REQUEST_BYTES = MAX_CONTRACT_BYTES + 10 * MAX_COLLATERAL_BYTES
+
+# Bytes copied at a time from the upload to the spool file
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an uploaded file is larger than its allowed size"""
+    pass
+
+
+def save_upload(file_obj: Any, destination: Any, max_bytes: int) -> int:
+    """
+    Copies an uploaded file into an open binary file in fixed-size chunks and returns the number of bytes
+    copied. Memory use stays at one chunk however large the upload is, and UploadTooLargeError is raised
+    as soon as more than max_bytes have been read.
+    """
+
+    stream = getattr(file_obj, 'stream', file_obj)
+    size = 0
+
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return size
+
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLargeError(
+                f"{getattr(file_obj, 'filename', 'Upload')} is larger than the "
+                f"{max_bytes // (1024 * 1024)} MB limit")
+
+        destination.write(chunk)
+
+
+@contextmanager
+def spool_upload(file_obj: Any, max_bytes: int) -> Iterator[Optional[str]]:
+    """
+    Copies an uploaded file to a temporary file with save_upload and yields the temporary file's path, or
+    None when the upload is empty. The temporary file is removed on exit and the upload is rewound so it
+    can be read again.
+    """
+
+    spool = tempfile.NamedTemporaryFile(prefix='upload_', delete=False)
+
+    try:
+        with spool:
+            size = save_upload(file_obj, spool, max_bytes)
+
+        yield spool.name if size else None
+
+    finally:
+        os.unlink(spool.name)
+        rewind_upload(file_obj)
+
+
+def rewind_upload(file_obj: Any) -> None:
+    """Moves an upload back to its start for potential re-reading"""
+    stream = getattr(file_obj, 'stream', file_obj)
+    if hasattr(stream, 'seek'):
+        try:
+            stream.seek(0)
+        except Exception as e:
+            logger.warning(f"Could not reset file pointer: {e}")
+
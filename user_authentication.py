@@ -1,13 +1,19 @@
 import textwrap
 
-import bcrypt
-from supabase import create_client, Client
+from password_hashing import get_password_hasher, PasswordHasherBusy
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from query_profiler import create_client
+from business_context import remember_business_context
+from settings import invalidate_key_count
 from flask import session
 import os
 import random
 import string
-import smtplib
-from email.message import EmailMessage
+from email_queue import get_email_queue
 
 
 class UserAuthentication:
@@ -20,76 +26,60 @@ class UserAuthentication:
 
         self.supabase: Client = create_client(url, service_role_key)
 
-        # email authentication
+        # Internal notifications go to the sending address; the email queue holds the SMTP credentials
         self.sender_email = os.getenv('SENDER_EMAIL')
-        self.email_password = os.getenv('EMAIL_PASSWORD')
 
     def hash_password(self, password: str) -> str:
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        """Hashes on the password hasher's thread pool with the configured BCRYPT_ROUNDS"""
+        return get_password_hasher().hash(password)
 
     def verify_password(self, password: str, hashed: str) -> bool:
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        return get_password_hasher().verify(password, hashed)
+
+    def _save_rehashed_password(self, user_id, hashed: str) -> None:
+        """Replaces a user's password hash after a login found it made with an outdated work factor"""
+        self.supabase.table('users').update({'password': hashed}).eq('id', user_id).execute()
 
     def sign_up(self, name, email, password, secret_key):
+        """
+        Creates a user from a registration key. The key check, the email check, the insert and using up a
+        one-time secret key all happen in the sign_up_user RPC, in one round trip and one transaction.
+        """
         try:
-            # 1. Check if email already exists
-            existing = self.supabase.table("users").select("email").eq("email", email).execute()
-            if existing.data:
-                return {"success": False, "message": "Email already registered."}
-
-            # 2. Check both tables for the key
-            key_response = self.supabase.table("secret_keys").select("id", "key").eq("key", secret_key).execute()
-            admin_key_response = self.supabase.table("admin_keys").select("id", "key", "business_id").eq("key",
-                                                                                                         secret_key).execute()
-
-            if not key_response.data and not admin_key_response.data:
-                return {"success": False, "message": "Invalid registration secret key."}
-
-            # 3. Determine role and optional business_id
-            if admin_key_response.data:
-                role = "admin"
-                key_table = "admin_keys"
-                key_id = admin_key_response.data[0]["id"]
-                business_id = admin_key_response.data[0]["business_id"]
-            else:
-                role = "viewer"
-                key_table = "secret_keys"
-                key_id = key_response.data[0]["id"]
-                business_id = key_response.data[0]["business_id"]
-
-            # 4. Hash the password securely
+            # Hash the password securely; the RPC only ever sees the hash
             hashed_password = self.hash_password(password)
 
-            # 5. Prepare user data
-            data = {
-                "name": name.strip(),
-                "email": email.strip().lower(),
-                "role": role,
-                "password": hashed_password
-            }
-
-            # Include business_id if it's from admin_keys
-            if business_id:
-                data["business_id"] = business_id
+            result = self.supabase.rpc('sign_up_user', {
+                'p_name': name.strip(),
+                'p_email': email.strip().lower(),
+                'p_password_hash': hashed_password,
+                'p_secret_key': secret_key
+            }).execute().data
 
-            # 6. Insert the new user
-            result = self.supabase.table("users").insert(data).execute()
+            if not result:
+                return {"success": False, "message": "Signup failed due to a database error."}
 
-            if result.data:
-                # 7. Delete the key if it's from secret_keys (one-time use)
-                if key_table == "secret_keys":
-                    self.supabase.table("secret_keys").delete().eq("id", key_id).execute()
+            # The business now has one key fewer than the settings page may have cached
+            if result.get("used_secret_key") and result.get("business_id"):
+                invalidate_key_count(result["business_id"])
 
-                return {"success": True, "message": "User created successfully."}
-            else:
-                return {"success": False, "message": "Signup failed due to a database error."}
+            return {"success": result.get("success", False), "message": result.get("message")}
 
+        except PasswordHasherBusy:
+            return {"success": False, "message": "Too many signups at once. Please try again shortly."}
         except Exception as e:
             return {"success": False, "message": f"Signup failed: {str(e)}"}
 
     def login(self, email, password):
         try:
-            result = self.supabase.table("users").select("*").eq("email", email).execute()
+            # Only the columns the session needs, through the users_email_idx index
+            result = (
+                self.supabase.table("users")
+                .select("id, name, email, role, password")
+                .eq("email", email.strip().lower())
+                .limit(1)
+                .execute()
+            )
 
             if not result.data or len(result.data) == 0:
                 return {"success": False, "message": "User not found."}
@@ -97,6 +87,11 @@ class UserAuthentication:
             user = result.data[0]
 
             if self.verify_password(password, user["password"]):
+                # Bring hashes made with an older work factor up to date while the password is at hand
+                hasher = get_password_hasher()
+                if hasher.needs_rehash(user["password"]):
+                    hasher.rehash_later(password, lambda hashed: self._save_rehashed_password(user["id"], hashed))
+
                 # Store user in session here
                 session["user"] = {
                     "id": user["id"],
@@ -108,6 +103,8 @@ class UserAuthentication:
             else:
                 return {"success": False, "message": "Invalid password."}
 
+        except PasswordHasherBusy:
+            return {"success": False, "message": "Too many logins at once. Please try again shortly."}
         except Exception as e:
             return {"success": False, "message": f"Login failed: {str(e)}"}
 
@@ -115,7 +112,13 @@ class UserAuthentication:
         """Logs the user into the business"""
         try:
             # Get business user by email
-            result = self.supabase.table("business_users").select("*").eq("email", business_email).execute()
+            result = (
+                self.supabase.table("business_users")
+                .select("id, business_name, email, password, paid, plan")
+                .eq("email", business_email)
+                .limit(1)
+                .execute()
+            )
 
             # Check if user exists
             if not result.data:
@@ -134,7 +137,7 @@ class UserAuthentication:
             if stored_password != business_password:
                 return {"success": False, "message": "Invalid email or password"}
 
-            # Return success with business data
+            # Return success with business data, and the paid status and plan read from the same row
             return {
                 "success": True,
                 "message": "Business login successful",
@@ -143,7 +146,8 @@ class UserAuthentication:
                     "email": business_user.get("email"),
                     "name": business_user.get("business_name"),  # Adjust field name as needed
                     # Add other relevant business fields
-                }
+                },
+                "business_context": remember_business_context(business_user)
             }
 
         except Exception as e:
@@ -291,7 +295,7 @@ class UserAuthentication:
             return None
 
     def email_retrieved_business_password(self, email):
-        """Emails the retrieved business password to the given email"""
+        """Queues an email with the retrieved business password for the given email"""
 
         try:
             password = self.retrieve_business_password(email)
@@ -312,28 +316,16 @@ class UserAuthentication:
                 InXource Team
             """)
 
-            msg = EmailMessage()
-            msg['Subject'] = subject
-            msg['From'] = self.sender_email
-            msg['To'] = email
-            msg.set_content(body)
-
-            try:
-                with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-                    smtp.login(self.sender_email, self.email_password)
-                    smtp.send_message(msg)
-                    print("Password email sent successfully.")
-                    return True
-            except Exception as smtp_error:
-                print(f"Failed to send email: {smtp_error}")
-                return False
+            # Sent by the email queue's worker; the SMTP connection is not opened here
+            get_email_queue().enqueue(email, subject, body, kind='password')
+            return True
 
         except Exception as e:
-            print(f"Unexpected error while emailing password: {e}")
+            print(f"Unexpected error while queueing password email: {e}")
             return False
 
     def email_retrieved_user_password(self, email, business_id):
-        """Emails the retrieved business password to the given email"""
+        """Queues an email with the retrieved business password for the given email"""
 
         try:
             password = self.retrieve_user_password(business_id, email)
@@ -354,28 +346,16 @@ class UserAuthentication:
                    InXource Team
                """)
 
-            msg = EmailMessage()
-            msg['Subject'] = subject
-            msg['From'] = self.sender_email
-            msg['To'] = email
-            msg.set_content(body)
-
-            try:
-                with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-                    smtp.login(self.sender_email, self.email_password)
-                    smtp.send_message(msg)
-                    print("Password email sent successfully.")
-                    return True
-            except Exception as smtp_error:
-                print(f"Failed to send email: {smtp_error}")
-                return False
+            # Sent by the email queue's worker; the SMTP connection is not opened here
+            get_email_queue().enqueue(email, subject, body, kind='password')
+            return True
 
         except Exception as e:
-            print(f"Unexpected error while emailing password: {e}")
+            print(f"Unexpected error while queueing password email: {e}")
             return False
 
     def enterprise_request(self, business_id, name, email, phone, address, description):
-        """Sends an internal notification email to self when a business requests enterprise access."""
+        """Queues an internal notification email to self when a business requests enterprise access."""
         try:
             subject = "Enterprise Request for inXource Loan Dashboard"
             body = textwrap.dedent(f"""
@@ -395,24 +375,12 @@ class UserAuthentication:
                 -- inXource Notification
             """)
 
-            msg = EmailMessage()
-            msg['Subject'] = subject
-            msg['From'] = self.sender_email
-            msg['To'] = self.sender_email  # sending to self (internal)
-            msg.set_content(body)
-
-            try:
-                with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-                    smtp.login(self.sender_email, self.email_password)
-                    smtp.send_message(msg)
-                    print("Enterprise request email sent successfully.")
-                    return True
-            except Exception as smtp_error:
-                print(f"Failed to send enterprise email: {smtp_error}")
-                return False
+            # Sent to self (internal) by the email queue's worker
+            get_email_queue().enqueue(self.sender_email, subject, body, kind='enterprise_request')
+            return True
 
         except Exception as e:
-            print(f"Unexpected error while sending enterprise request: {e}")
+            print(f"Unexpected error while queueing enterprise request: {e}")
             return False
 
 